@@ -1,19 +1,51 @@
-from flask import Flask, render_template, request, send_file, jsonify, redirect, url_for
-from qr_generator_logic import generate_qr_code
+from flask import (Blueprint, Flask, current_app, has_app_context, render_template, request, send_file, jsonify,
+                   redirect, url_for, stream_with_context, abort)
+from qr_generator_logic import construir_payload
+from qr_cache import RenderCache, render_key
+from qr_forms import (ERROR_LEVELS, OUTPUT_FORMATS, CONTENT_TYPES, WIFI_SECURITY_TYPES, TEXT_STYLES,
+                      validate_generation_form)
+import qr_batch
+import qr_pool
+from qr_artifacts import ArtifactStore
+from qr_capacity import plan_capacity
+import qr_metrics
+import qr_matrix
+from qr_matrix import matrix_cache_info, get_matrix, build_matrix
+from qr_render import RenderBudget, iter_png, render_matrix
 from io import BytesIO
 import datetime
-import re
+import gc
+import base64
+import json
+import shutil
+import struct
+import sys
+import tempfile
+import time
 import uuid
 from flask_sqlalchemy import SQLAlchemy
+import sqlalchemy as sa
+import storage
+from tracking import (VisitCounter, ShortCodeCache, ShortCodeAllocator, PeriodicTask,
+                      classify_user_agent, classify_referrer)
 import os
 
-app = Flask(__name__)
-
-# Configuración de la base de datos SQLite
+# La app se crea con create_app(config) (al final del módulo): aplica DEFAULT_CONFIG a lo que `config`
+# no fije, enlaza la BD, crea el estado por proceso (cachés, contadores de visitas, allocator) y registra
+# las rutas de `bp`. Importar el módulo no abre la BD: el esquema se crea con `flask --app app init-db`.
+# `app` es la instancia por defecto (gunicorn app:app, flask --app app, pruebas); el estado por proceso
+# es el de la última app creada, así que se espera una app por proceso.
 basedir = os.path.abspath(os.path.dirname(__file__))
-app.config['SQLALCHEMY_DATABASE_URI'] = 'sqlite:///' + os.path.join(basedir, 'qr_codes.db')
-app.config['SQLALCHEMY_TRACK_MODIFICATIONS'] = False
-db = SQLAlchemy(app)
+DEFAULT_CONFIG = {
+    # QR_DB_PATH (el mismo que usa redirect_server.py) permite apuntar a otro fichero, p. ej. en qr_bench.py
+    'SQLALCHEMY_DATABASE_URI': 'sqlite:///' + (os.environ.get('QR_DB_PATH') or os.path.join(basedir, 'qr_codes.db')),
+    'SQLALCHEMY_TRACK_MODIFICATIONS': False,
+}
+db = SQLAlchemy()
+bp = Blueprint('qr', __name__, cli_group=None) # Sin grupo: los comandos siguen siendo `flask init-db`, etc.
+
+# Estado por proceso, creado por create_app a partir de la configuración
+render_cache = visit_counter = visit_rollup_task = short_code_cache = short_code_allocator = None
 
 # Modelo de la base de datos para los QRs rastreables
 class TrackableQR(db.Model):
@@ -23,250 +55,852 @@ class TrackableQR(db.Model):
     created_at = db.Column(db.DateTime, default=datetime.datetime.utcnow)
     short_code = db.Column(db.String(10), unique=True, nullable=False)
 
+    # Índices para la paginación por clave (keyset) de /stats y el filtro por prefijo de URL
+    __table_args__ = (
+        db.Index('ix_trackable_qr_created_at_id', 'created_at', 'id'),
+        db.Index('ix_trackable_qr_visit_count_id', 'visit_count', 'id'),
+        db.Index('ix_trackable_qr_original_url', 'original_url'),
+    )
+
     def __repr__(self):
         return f'<TrackableQR {self.short_code} -> {self.original_url} (Visits: {self.visit_count})>'
 
-with app.app_context():
-    db.create_all() # Crea las tablas si no existen
-
-ERROR_LEVELS = {'L': 'L (Low ~7%)', 'M': 'M (Medium ~15%)', 'Q': 'Q (Quartile ~25%)', 'H': 'H (High ~30%)'}
-OUTPUT_FORMATS = {'png': 'PNG', 'svg': 'SVG', 'txt': 'TXT (Text Art)'} # HTML no soportado por ahora
-CONTENT_TYPES = {
-    'url': 'URL', 'text': 'Text', 'wifi': 'WiFi', 'vcard': 'vCard (Contact)',
-    'mecard': 'MeCard (Contact)', 'email': 'Email', 'sms': 'SMS', 'tel': 'Telephone',
-    'event': 'Event (iCalendar)', 'geo': 'Geo Location', 'epc': 'EPC (Payment)'
+# Secuencia compartida de la que ShortCodeAllocator reserva bloques de short_codes
+class ShortCodeSequence(db.Model):
+    name = db.Column(db.String(32), primary_key=True)
+    next_value = db.Column(db.BigInteger, nullable=False, default=0)
+
+# Registro de visitas solo de inserción (se escribe por lotes desde VisitCounter, fuera de la redirección)
+class VisitEvent(db.Model):
+    id = db.Column(db.Integer, primary_key=True, autoincrement=True)
+    short_code = db.Column(db.String(10), nullable=False)
+    occurred_at = db.Column(db.DateTime, nullable=False)
+    ua_class = db.Column(db.String(16))
+    referrer_class = db.Column(db.String(16))
+
+    __table_args__ = (db.Index('ix_visit_event_short_code_occurred_at', 'short_code', 'occurred_at'),)
+
+# Agregados por hora y por día que mantiene rollup_visit_events; las series temporales se leen de aquí
+class VisitRollup(db.Model):
+    short_code = db.Column(db.String(10), primary_key=True)
+    bucket = db.Column(db.String(4), primary_key=True) # 'hour' o 'day'
+    bucket_start = db.Column(db.DateTime, primary_key=True)
+    visits = db.Column(db.Integer, nullable=False, default=0)
+
+# Último VisitEvent.id ya agregado en VisitRollup
+class RollupState(db.Model):
+    name = db.Column(db.String(32), primary_key=True)
+    last_event_id = db.Column(db.Integer, nullable=False, default=0)
+
+def init_db():
+    # Crea las tablas que falten y los índices nuevos de tablas existentes (create_all no los añade).
+    # Idempotente: se ejecuta al desplegar o actualizar, no al importar la app. Todos los modelos están en
+    # el bind principal (el de lectura, si existe, es el mismo fichero).
+    db.create_all(bind_key=None)
+    for index in TrackableQR.__table__.indexes:
+        index.create(bind=db.engine, checkfirst=True)
+
+@bp.cli.command('init-db')
+def init_db_command():
+    """Crea las tablas y los índices que falten en la base de datos."""
+    init_db()
+    print(f"Esquema listo en {db.engine.url.render_as_string(hide_password=True)}")
+
+# Caché de renders (memoria LRU por bytes + nivel opcional en disco)
+DEFAULT_CONFIG.setdefault('QR_RENDER_CACHE_MAX_BYTES', 64 * 1024 * 1024)
+DEFAULT_CONFIG.setdefault('QR_RENDER_CACHE_DIR', os.environ.get('QR_RENDER_CACHE_DIR'))
+
+# Presupuesto por render (ver RenderBudget en qr_render.py): píxeles de la imagen y bytes del mayor buffer
+# en memoria; 'reject' responde 400 y 'downscale' baja la escala. Los PNG de al menos QR_STREAM_MIN_PIXELS
+# se codifican por scanlines directamente en la respuesta, sin pasar por la caché de renders.
+DEFAULT_CONFIG.setdefault('QR_MAX_PIXELS', int(os.environ.get('QR_MAX_PIXELS', 64_000_000)))
+DEFAULT_CONFIG.setdefault('QR_MAX_RENDER_BYTES', int(os.environ.get('QR_MAX_RENDER_BYTES', 256 * 1024 * 1024)))
+DEFAULT_CONFIG.setdefault('QR_RENDER_BUDGET_POLICY', os.environ.get('QR_RENDER_BUDGET_POLICY', 'reject'))
+DEFAULT_CONFIG.setdefault('QR_STREAM_MIN_PIXELS', int(os.environ.get('QR_STREAM_MIN_PIXELS', 4_000_000)))
+DEFAULT_CONFIG.setdefault('PNG_COMPRESSION', os.environ.get('QR_PNG_COMPRESSION', 'default')) # 'fast', 'default' o 'best'
+
+def render_budget():
+    return RenderBudget(current_app.config['QR_MAX_PIXELS'], current_app.config['QR_MAX_RENDER_BYTES'],
+                        current_app.config['QR_RENDER_BUDGET_POLICY'])
+
+# Pool de procesos para los renders de /generate (ver qr_pool.py): cola acotada (503 + Retry-After al
+# llenarse), timeout por trabajo y reciclado de workers. Los renders de hasta RENDER_POOL_INLINE_MAX_PIXELS
+# se hacen en el hilo de la petición; RENDER_POOL_WORKERS = 0 los hace todos en línea.
+DEFAULT_CONFIG.setdefault('RENDER_POOL_EXECUTOR', 'process') # 'process' o 'thread'
+DEFAULT_CONFIG.setdefault('RENDER_POOL_WORKERS', os.cpu_count() or 1)
+DEFAULT_CONFIG.setdefault('RENDER_POOL_MAX_QUEUE', 2 * (os.cpu_count() or 1)) # Trabajos en espera además de los que corren
+DEFAULT_CONFIG.setdefault('RENDER_POOL_TIMEOUT', 30.0) # Segundos
+DEFAULT_CONFIG.setdefault('RENDER_POOL_MAX_JOBS_PER_WORKER', 500)
+DEFAULT_CONFIG.setdefault('RENDER_POOL_INLINE_MAX_PIXELS', 250_000)
+DEFAULT_CONFIG.setdefault('RENDER_POOL_RETRY_AFTER', 2) # Segundos
+
+# Imágenes de los QR rastreables en un almacén en disco direccionado por contenido (ver qr_artifacts.py),
+# servidas en GET /qr/<short_code>.<png|svg>. Se renderizan al pedirlas por primera vez o, para los formatos
+# de ARTIFACT_PRERENDER, al crear el código. Todas usan ARTIFACT_RENDER_OPTIONS, así que la URL es estable:
+# Cache-Control de ARTIFACT_MAX_AGE con 'immutable'. Con ARTIFACT_ACCEL_REDIRECT (p. ej. '/_qr_artifacts/',
+# una location 'internal' de nginx con alias al directorio) la app solo responde la cabecera y el proxy
+# envía el fichero. GC: 'flask gc-artifacts'.
+DEFAULT_CONFIG.setdefault('ARTIFACT_DIR', os.environ.get('QR_ARTIFACT_DIR') or os.path.join(basedir, 'qr_artifacts'))
+DEFAULT_CONFIG.setdefault('ARTIFACT_RENDER_OPTIONS', {'error': 'M', 'scale': 10, 'border': 4,
+                                                  'dark_color': '#000000', 'light_color': '#ffffff'})
+DEFAULT_CONFIG.setdefault('ARTIFACT_PRERENDER', ()) # p. ej. ('png', 'svg')
+DEFAULT_CONFIG.setdefault('ARTIFACT_MAX_AGE', 365 * 24 * 3600)
+DEFAULT_CONFIG.setdefault('ARTIFACT_ACCEL_REDIRECT', os.environ.get('QR_ARTIFACT_ACCEL_REDIRECT'))
+DEFAULT_CONFIG.setdefault('ARTIFACT_GC_GRACE', 3600.0) # Segundos antes de borrar un blob sin enlaces
+# Origen (esquema y host, p. ej. 'https://qr.example.com') de la URL de seguimiento que codifican los
+# artefactos; si falta se usa SERVER_NAME. Nunca sale de la cabecera Host: el artefacto se guarda por
+# short_code y se sirve a todos como immutable, así que un Host falso en la primera petición lo envenenaría.
+DEFAULT_CONFIG.setdefault('ARTIFACT_BASE_URL', os.environ.get('QR_ARTIFACT_BASE_URL'))
+
+# Generación masiva (/generate/batch): pool de workers y límite de renders en vuelo
+DEFAULT_CONFIG.setdefault('BATCH_EXECUTOR', 'process') # 'process' o 'thread'
+DEFAULT_CONFIG.setdefault('BATCH_WORKERS', os.cpu_count() or 1)
+DEFAULT_CONFIG.setdefault('BATCH_MAX_IN_FLIGHT', 4 * (os.cpu_count() or 1))
+DEFAULT_CONFIG.setdefault('BATCH_SPOOL_MAX_BYTES', 8 * 1024 * 1024) # Entradas mayores se vuelcan a disco
+
+# El pool de renders, el almacén de artefactos y el executor de lotes se crean al primer uso con la config
+# de la app y se guardan en app.extensions['qr']: cada app de create_app tiene los suyos.
+QR_EXTENSION_KEYS = ('render_pool', 'artifact_store', 'batch_executor')
+
+# Conteo de visitas de /track: por defecto write-behind (VisitCounter); TRACKING_SYNC_COUNTS=True
+# hace el incremento atómico en la misma petición, para despliegues que necesiten conteo exacto al instante.
+DEFAULT_CONFIG.setdefault('TRACKING_SYNC_COUNTS', os.environ.get('TRACKING_SYNC_COUNTS') == '1')
+DEFAULT_CONFIG.setdefault('TRACKING_FLUSH_INTERVAL', 1.0) # Segundos entre volcados
+DEFAULT_CONFIG.setdefault('TRACKING_FLUSH_THRESHOLD', 1000) # Visitas pendientes que fuerzan un volcado
+DEFAULT_CONFIG.setdefault('TRACKING_MAX_PENDING_EVENTS', 100_000) # Eventos en memoria si la BD falla (ver VisitCounter)
+
+def add_visit_counts(counts, events=()):
+    # Un único UPDATE atómico por lote (executemany en una transacción), sin leer los registros,
+    # y el INSERT de los eventos de visita en la misma transacción
+    if counts:
+        stmt = (sa.update(TrackableQR.__table__)
+                .where(TrackableQR.__table__.c.short_code == sa.bindparam('code'))
+                .values(visit_count=sa.func.coalesce(TrackableQR.__table__.c.visit_count, 0) + sa.bindparam('n')))
+        db.session.execute(stmt, [{'code': code, 'n': n} for code, n in counts.items()])
+    if events: db.session.execute(sa.insert(VisitEvent.__table__), list(events))
+    db.session.commit()
+
+def _flush_visit_counts(app, counts, events):
+    with app.app_context(): # El volcado corre en su propio hilo y sesión
+        try: add_visit_counts(counts, events)
+        except Exception:
+            db.session.rollback()
+            raise
+
+# Rollup de eventos a VisitRollup y retención de los eventos crudos ya agregados
+DEFAULT_CONFIG.setdefault('VISIT_ROLLUP_INTERVAL', 60.0) # Segundos entre rollups en segundo plano (0 = solo manual)
+DEFAULT_CONFIG.setdefault('VISIT_ROLLUP_BATCH_SIZE', 10000) # Eventos por transacción de rollup
+DEFAULT_CONFIG.setdefault('VISIT_EVENT_RETENTION_DAYS', 30)
+ROLLUP_BUCKETS = {
+    'hour': lambda moment: moment.replace(minute=0, second=0, microsecond=0),
+    'day': lambda moment: moment.replace(hour=0, minute=0, second=0, microsecond=0),
 }
-WIFI_SECURITY_TYPES = {'': 'None (Open)', 'WPA': 'WPA/WPA2', 'WEP': 'WEP'}
-
-def is_valid_color_hex(s):
-    return s and re.match(r'^#[0-9a-fA-F]{6}$', s)
 
-@app.route('/', methods=['GET'])
+def _dialect_insert(conn):
+    # INSERT con on_conflict_do_update para el motor en uso (mismo API en SQLite y PostgreSQL). El
+    # dialecto de PostgreSQL se importa aquí: cargarlo al importar la app cuesta ~40 ms.
+    if conn.dialect.name == 'postgresql':
+        from sqlalchemy.dialects import postgresql
+        return postgresql.insert
+    from sqlalchemy.dialects import sqlite
+    return sqlite.insert
+
+def _rollup_visit_batch(batch_size):
+    # Agrega el siguiente lote de eventos y avanza la marca en la misma transacción: un evento
+    # nunca se cuenta dos veces aunque dos procesos lancen el rollup a la vez.
+    state = RollupState.__table__; events = VisitEvent.__table__; rollup = VisitRollup.__table__
+    with db.engine.begin() as conn:
+        conn.execute(_dialect_insert(conn)(state).values(name='visit_events', last_event_id=0)
+                     .on_conflict_do_nothing(index_elements=['name']))
+        # UPDATE sin cambios para tomar el bloqueo de escritura antes de leer la marca
+        conn.execute(sa.update(state).where(state.c.name == 'visit_events').values(last_event_id=state.c.last_event_id))
+        watermark = conn.execute(sa.select(state.c.last_event_id).where(state.c.name == 'visit_events')).scalar_one()
+        rows = conn.execute(sa.select(events.c.id, events.c.short_code, events.c.occurred_at)
+                            .where(events.c.id > watermark).order_by(events.c.id).limit(batch_size)).all()
+        if not rows: return 0
+        buckets = {}
+        for _, short_code, occurred_at in rows:
+            for bucket, truncate in ROLLUP_BUCKETS.items():
+                key = (short_code, bucket, truncate(occurred_at))
+                buckets[key] = buckets.get(key, 0) + 1
+        insert = _dialect_insert(conn)(rollup)
+        conn.execute(insert.on_conflict_do_update(index_elements=['short_code', 'bucket', 'bucket_start'],
+                                                  set_={'visits': rollup.c.visits + insert.excluded.visits}),
+                     [{'short_code': code, 'bucket': bucket, 'bucket_start': start, 'visits': n}
+                      for (code, bucket, start), n in buckets.items()])
+        conn.execute(sa.update(state).where(state.c.name == 'visit_events').values(last_event_id=rows[-1][0]))
+    return len(rows)
+
+def rollup_visit_events(batch_size=None):
+    # Agrega todos los eventos pendientes; devuelve cuántos se procesaron
+    batch_size = batch_size or current_app.config['VISIT_ROLLUP_BATCH_SIZE']
+    total = 0
+    while True:
+        processed = _rollup_visit_batch(batch_size)
+        total += processed
+        if processed < batch_size: return total
+
+def purge_visit_events(retention_days=None, now=None):
+    # Borra los eventos crudos más antiguos que la retención, solo si ya están agregados
+    retention_days = current_app.config['VISIT_EVENT_RETENTION_DAYS'] if retention_days is None else retention_days
+    cutoff = (now or datetime.datetime.utcnow()) - datetime.timedelta(days=retention_days)
+    state = RollupState.__table__; events = VisitEvent.__table__
+    with db.engine.begin() as conn:
+        watermark = conn.execute(sa.select(state.c.last_event_id).where(state.c.name == 'visit_events')).scalar()
+        if not watermark: return 0
+        return conn.execute(sa.delete(events).where(events.c.id <= watermark, events.c.occurred_at < cutoff)).rowcount
+
+def _maintain_visit_events(app):
+    with app.app_context():
+        rollup_visit_events()
+        purge_visit_events()
+
+@bp.cli.command('rollup-visits')
+def rollup_visits_command():
+    """Agrega los eventos de visita pendientes y aplica la retención de eventos crudos."""
+    visit_counter.flush()
+    print(f"Eventos agregados: {rollup_visit_events()}; eventos crudos eliminados: {purge_visit_events()}")
+
+# Caché short_code -> original_url delante de la consulta de /track (la URL no cambia tras crearse)
+DEFAULT_CONFIG.setdefault('TRACKING_CACHE_MAX_ENTRIES', 100000)
+DEFAULT_CONFIG.setdefault('TRACKING_CACHE_TTL', 300.0)
+DEFAULT_CONFIG.setdefault('TRACKING_CACHE_NEGATIVE_TTL', 30.0)
+
+# Invalidación: los short_codes creados, modificados o borrados vía ORM se anotan en la sesión y se
+# invalidan al hacer commit (también los creados, para descartar una entrada negativa previa).
+# Los borrados masivos con query.delete() no pasan por aquí: los cubre el TTL.
+def _mark_short_code_changed(mapper, connection, target):
+    session = sa.orm.object_session(target)
+    if session is not None: session.info.setdefault('changed_short_codes', set()).add(target.short_code)
+    else: short_code_cache.invalidate(target.short_code)
+
+for _event in ('after_insert', 'after_update', 'after_delete'):
+    sa.event.listen(TrackableQR, _event, _mark_short_code_changed)
+
+@sa.event.listens_for(db.session, 'after_commit')
+def _invalidate_changed_short_codes(session):
+    for short_code in session.info.pop('changed_short_codes', ()): short_code_cache.invalidate(short_code)
+
+@sa.event.listens_for(db.session, 'after_soft_rollback')
+def _discard_changed_short_codes(session, previous_transaction):
+    session.info.pop('changed_short_codes', None)
+
+# Short codes sin sondeo: secuencia permutada en base62, reservada por bloques por proceso
+DEFAULT_CONFIG.setdefault('SHORT_CODE_BLOCK_SIZE', 100)
+DEFAULT_CONFIG.setdefault('SHORT_CODE_WIDEN_THRESHOLD', 0.5) # Fracción del espacio de una longitud antes de ampliarla
+
+def _reserve_short_code_values(count):
+    # Reserva `count` valores consecutivos de la secuencia en una transacción propia y devuelve el primero
+    table = ShortCodeSequence.__table__
+    for _ in range(2):
+        with db.engine.begin() as conn:
+            updated = conn.execute(sa.update(table).where(table.c.name == 'trackable_qr')
+                                   .values(next_value=table.c.next_value + count)).rowcount
+            if updated:
+                return conn.execute(sa.select(table.c.next_value).where(table.c.name == 'trackable_qr')).scalar_one() - count
+        try:
+            with db.engine.begin() as conn:
+                conn.execute(sa.insert(table).values(name='trackable_qr', next_value=count))
+            return 0
+        except sa.exc.IntegrityError:
+            continue # Otro proceso creó la fila a la vez: reintentar el UPDATE
+    raise RuntimeError("No se pudo reservar un bloque de short_codes.")
+
+def resolve_short_code(short_code):
+    # Devuelve la URL original o None si no existe; en régimen estable no toca la BD
+    original_url = short_code_cache.get(short_code)
+    if original_url is ShortCodeCache.NOT_FOUND: return None
+    if original_url is None:
+        row = db.session.execute(sa.select(TrackableQR.original_url)
+                                 .where(TrackableQR.short_code == short_code), **storage.read_bind(db)).first()
+        if row is None:
+            short_code_cache.put_not_found(short_code)
+            return None
+        original_url = row[0]
+        short_code_cache.put(short_code, original_url)
+    return original_url
+
+def get_render_pool():
+    state = current_app.extensions['qr']
+    if state['render_pool'] is None:
+        state['render_pool'] = qr_pool.RenderPool(
+            workers=current_app.config['RENDER_POOL_WORKERS'], max_queue=current_app.config['RENDER_POOL_MAX_QUEUE'],
+            timeout=current_app.config['RENDER_POOL_TIMEOUT'], max_jobs_per_worker=current_app.config['RENDER_POOL_MAX_JOBS_PER_WORKER'],
+            inline_max_cost=current_app.config['RENDER_POOL_INLINE_MAX_PIXELS'], retry_after=current_app.config['RENDER_POOL_RETRY_AFTER'],
+            kind=current_app.config['RENDER_POOL_EXECUTOR'])
+    return state['render_pool']
+
+def get_artifact_store():
+    state = current_app.extensions['qr']
+    if state['artifact_store'] is None: state['artifact_store'] = ArtifactStore(current_app.config['ARTIFACT_DIR'])
+    return state['artifact_store']
+
+def artifact_tracking_url(short_code):
+    # URL de seguimiento canónica (ARTIFACT_BASE_URL o SERVER_NAME); None si no hay ninguna configurada
+    config = current_app.config
+    base = config['ARTIFACT_BASE_URL']
+    if not base and config.get('SERVER_NAME'): base = f"{config['PREFERRED_URL_SCHEME']}://{config['SERVER_NAME']}"
+    if not base: return None
+    return base.rstrip('/') + url_for('qr.track_qr_visit', short_code=short_code)
+
+def tracked_qr_artifact(short_code, fmt):
+    # Render canónico del QR rastreable (codifica su URL de seguimiento canónica)
+    payload = artifact_tracking_url(short_code)
+    if payload is None: raise RuntimeError("Configure ARTIFACT_BASE_URL o SERVER_NAME para renderizar artefactos.")
+
+    def render():
+        options = dict(current_app.config['ARTIFACT_RENDER_OPTIONS'])
+        with qr_metrics.stage('matrix'): matrix = get_matrix(payload, options.pop('error', 'M'))
+        return get_render_pool().render(matrix, dict(options, output_format=fmt, png_compression='best'))
+    return get_artifact_store().get_or_render(short_code, fmt, render)
+
+def get_batch_executor():
+    state = current_app.extensions['qr']
+    if state['batch_executor'] is None:
+        state['batch_executor'] = qr_batch.make_executor(current_app.config['BATCH_EXECUTOR'], current_app.config['BATCH_WORKERS'])
+    return state['batch_executor']
+
+def shutdown_workers(app, wait=True):
+    # Cierra el pool de renders y el executor de lotes de la app; se recrean si se vuelven a usar
+    state = app.extensions['qr']
+    pool, executor = state['render_pool'], state['batch_executor']
+    state['render_pool'] = state['batch_executor'] = None
+    if pool is not None: pool.shutdown(wait=wait)
+    if executor is not None: executor.shutdown(wait=wait)
+
+@bp.route('/', methods=['GET'])
 def index():
     return render_template('index.html', content_types=CONTENT_TYPES, error_levels=ERROR_LEVELS,
-                           output_formats=OUTPUT_FORMATS, wifi_security_types=WIFI_SECURITY_TYPES)
-
-@app.route('/generate', methods=['POST'])
-def generate():
-    errors = {}
-    form_data = request.form
-
-    content_type = form_data.get('content_type', 'url')
-    data_from_form = "" # Para URL y Texto
-    if content_type == 'url': data_from_form = form_data.get('data_url', '')
-    elif content_type == 'text': data_from_form = form_data.get('data_text', '')
-
-
-    # --- Validación de Parámetros Comunes ---
-    error_correction = form_data.get('error_correction', 'M')
-    if error_correction not in ERROR_LEVELS: errors['error_correction'] = "Nivel de error inválido."
-
-    try: scale = int(form_data.get('scale', '20'))
-    except ValueError: errors['scale'] = "La escala debe ser un número."; scale = 20
-    if not 1 <= scale <= 200: errors['scale'] = "La escala debe estar entre 1 y 200."
-
-    try: border = int(form_data.get('border', '4'))
-    except ValueError: errors['border'] = "El borde debe ser un número."; border = 4
-    if not 0 <= border <= 20: errors['border'] = "El borde debe estar entre 0 y 20."
-
-    dark_color = form_data.get('dark_color', '#000000')
-    if not is_valid_color_hex(dark_color): errors['dark_color'] = "Formato de color oscuro inválido (ej: #RRGGBB)."
-
-    light_color_input = form_data.get('light_color', '#ffffff')
-    is_transparent = form_data.get('transparent_bg') == 'on'
-    light_color = "transparent" if is_transparent else light_color_input
-    if not is_transparent and not is_valid_color_hex(light_color):
-        errors['light_color'] = "Formato de color claro inválido (ej: #RRGGBB)."
-
-    output_format = form_data.get('output_format', 'png')
-    if output_format not in OUTPUT_FORMATS: errors['output_format'] = "Formato de salida inválido."
+                           output_formats=OUTPUT_FORMATS, wifi_security_types=WIFI_SECURITY_TYPES,
+                           text_styles=TEXT_STYLES)
+
+def create_trackable_qrs(original_urls):
+    # Crea los registros TrackableQR en una sola transacción y devuelve sus URLs de seguimiento.
+    # Los short_codes salen del allocator (únicos por construcción, sin consultas de comprobación).
+    # Si falla la BD hace rollback y relanza la excepción.
+    short_codes = short_code_allocator.allocate_many(len(original_urls))
+    db.session.add_all([TrackableQR(original_url=url, short_code=code) for url, code in zip(original_urls, short_codes)])
+    try:
+        db.session.commit()
+    except Exception:
+        db.session.rollback()
+        raise
+    return [url_for('qr.track_qr_visit', short_code=code, _external=True) for code in short_codes]
 
-    # --- Parámetros y Validación Específicos del Tipo de Contenido ---
-    kwargs_for_generator = {}
+def create_trackable_qr(original_url):
+    return create_trackable_qrs([original_url])[0]
 
-    if content_type == 'url':
-        if not data_from_form or not (data_from_form.startswith('http://') or data_from_form.startswith('https://')):
-            errors['data_url'] = "Se requiere una URL válida (http:// o https://)."
-    elif content_type == 'text':
-        if not data_from_form.strip(): errors['data_text'] = "El texto no puede estar vacío."
-    # No se necesita validación extra para 'enable_tracking' aquí, se maneja en la lógica de generación.
-    elif content_type == 'wifi':
-        kwargs_for_generator['wifi_ssid'] = form_data.get('wifi_ssid')
-        if not kwargs_for_generator['wifi_ssid']: errors['wifi_ssid'] = "SSID es obligatorio."
-        kwargs_for_generator['wifi_password'] = form_data.get('wifi_password')
-        kwargs_for_generator['wifi_security'] = form_data.get('wifi_security')
-        if kwargs_for_generator['wifi_security'] not in WIFI_SECURITY_TYPES: errors['wifi_security'] = "Tipo de seguridad WiFi inválido."
-        kwargs_for_generator['wifi_hidden'] = form_data.get('wifi_hidden') == 'on'
-        if not kwargs_for_generator['wifi_password'] and kwargs_for_generator['wifi_security'] in ['WPA', 'WEP']:
-             errors['wifi_password'] = "Se requiere contraseña para seguridad WPA/WEP."
-
-    elif content_type == 'vcard':
-        vcard_p = {
-            'firstname': form_data.get('vcard_firstname'), 'lastname': form_data.get('vcard_lastname'),
-            'displayname': form_data.get('vcard_displayname'), 'email': form_data.get('vcard_email'),
-            'phone': form_data.get('vcard_phone_work'), 'mobile': form_data.get('vcard_phone_mobile'),
-            'homephone': form_data.get('vcard_phone_home'), 'fax': form_data.get('vcard_fax'),
-            'org': form_data.get('vcard_company'), 'title': form_data.get('vcard_jobtitle'),
-            'address': form_data.get('vcard_address_full'), # Un solo campo para dirección simple
-            'street': form_data.get('vcard_street'), 'city': form_data.get('vcard_city'),
-            'region': form_data.get('vcard_region'), 'zipcode': form_data.get('vcard_postcode'),
-            'country': form_data.get('vcard_country'), 'url': form_data.get('vcard_website'),
-            'birthday': form_data.get('vcard_birthday'), 'note': form_data.get('vcard_note'),
-            'nickname': form_data.get('vcard_nickname')
-        }
-        vcard_p = {k: v for k, v in vcard_p.items() if v} # Limpiar vacíos
-        if not (vcard_p.get('firstname') or vcard_p.get('lastname') or vcard_p.get('displayname')):
-            errors['vcard_name'] = "Se requiere Nombre, Apellido o Nombre a Mostrar para vCard."
-        kwargs_for_generator['vcard_params'] = vcard_p
-
-    elif content_type == 'mecard':
-        mecard_p = {
-            'firstname': form_data.get('mecard_firstname'), 'lastname': form_data.get('mecard_lastname'),
-            'reading': form_data.get('mecard_reading'), 'nickname': form_data.get('mecard_nickname'),
-            'email': form_data.get('mecard_email'), 'phone': form_data.get('mecard_phone'),
-            'address': form_data.get('mecard_address'),
-            'birthday': form_data.get('mecard_birthday_formatted'), # YYYYMMDD
-            'url': form_data.get('mecard_url'), 'memo': form_data.get('mecard_memo')
-        }
-        mecard_p = {k: v for k, v in mecard_p.items() if v}
-        if not (mecard_p.get('firstname') or mecard_p.get('lastname')):
-             errors['mecard_name'] = "Se requiere Nombre o Apellido para MeCard."
-        kwargs_for_generator['mecard_params'] = mecard_p
-
-    elif content_type == 'email':
-        kwargs_for_generator['email_to'] = form_data.get('email_to')
-        if not kwargs_for_generator['email_to']: errors['email_to'] = "Email 'Para' es obligatorio."
-        kwargs_for_generator['email_subject'] = form_data.get('email_subject')
-        kwargs_for_generator['email_body'] = form_data.get('email_body')
-
-    elif content_type == 'sms':
-        kwargs_for_generator['sms_to'] = form_data.get('sms_to')
-        if not kwargs_for_generator['sms_to']: errors['sms_to'] = "Número SMS 'Para' es obligatorio."
-        kwargs_for_generator['sms_body'] = form_data.get('sms_body')
-
-    elif content_type == 'tel':
-        kwargs_for_generator['tel_number'] = form_data.get('tel_number')
-        if not kwargs_for_generator['tel_number']: errors['tel_number'] = "Número de teléfono es obligatorio."
-
-    elif content_type == 'geo':
-        try:
-            kwargs_for_generator['geo_latitude'] = float(form_data.get('geo_latitude','0'))
-            kwargs_for_generator['geo_longitude'] = float(form_data.get('geo_longitude','0'))
-        except ValueError: errors['geo_coords'] = "Latitud y Longitud deben ser números."
-        if not form_data.get('geo_latitude') or not form_data.get('geo_longitude'):
-             errors['geo_coords'] = "Latitud y Longitud son obligatorios."
-
-
-    elif content_type == 'event':
-        kwargs_for_generator['event_summary'] = form_data.get('event_summary')
-        kwargs_for_generator['event_start'] = form_data.get('event_start_datetime') # Formato ISO de datetime-local
-        kwargs_for_generator['event_end'] = form_data.get('event_end_datetime')
-        if not kwargs_for_generator['event_summary']: errors['event_summary'] = "Título del evento es obligatorio."
-        if not kwargs_for_generator['event_start']: errors['event_start_datetime'] = "Fecha/hora de inicio es obligatoria."
-        if not kwargs_for_generator['event_end']: errors['event_end_datetime'] = "Fecha/hora de fin es obligatoria."
-        # Validar que end > start
-        if kwargs_for_generator['event_start'] and kwargs_for_generator['event_end']:
-            try:
-                start_dt = datetime.datetime.fromisoformat(kwargs_for_generator['event_start'])
-                end_dt = datetime.datetime.fromisoformat(kwargs_for_generator['event_end'])
-                if end_dt <= start_dt: errors['event_end_datetime'] = "La fecha de fin debe ser posterior a la de inicio."
-            except ValueError: errors['event_dates'] = "Formato de fecha/hora de evento inválido."
-
-        kwargs_for_generator['event_description'] = form_data.get('event_description')
-        kwargs_for_generator['event_location'] = form_data.get('event_location')
-        kwargs_for_generator['event_allday'] = form_data.get('event_allday') == 'on'
-
-    elif content_type == 'epc':
-        kwargs_for_generator['epc_name'] = form_data.get('epc_name')
-        kwargs_for_generator['epc_iban'] = form_data.get('epc_iban')
-        kwargs_for_generator['epc_amount'] = form_data.get('epc_amount')
-        if not kwargs_for_generator['epc_name']: errors['epc_name'] = "Nombre del beneficiario EPC es obligatorio."
-        if not kwargs_for_generator['epc_iban']: errors['epc_iban'] = "IBAN EPC es obligatorio." # Podría añadir validación de formato IBAN
-        if not kwargs_for_generator['epc_amount']: errors['epc_amount'] = "Importe EPC es obligatorio."
-        else:
-            try: float(kwargs_for_generator['epc_amount'])
-            except ValueError: errors['epc_amount'] = "Importe EPC debe ser un número."
-        kwargs_for_generator['epc_currency'] = form_data.get('epc_currency', 'EUR')
-        kwargs_for_generator['epc_bic'] = form_data.get('epc_bic')
-        kwargs_for_generator['epc_purpose'] = form_data.get('epc_purpose')
-        kwargs_for_generator['epc_reference'] = form_data.get('epc_reference')
-        kwargs_for_generator['epc_remittance'] = form_data.get('epc_remittance')
+@bp.route('/generate', methods=['POST'])
+def generate():
+    # Mide la petición completa (histograma por tipo de contenido y formato) y recoge los tiempos por
+    # etapa que registran validación, payload, BD, matriz, rasterizado y codificación (ver qr_metrics.py)
+    if not qr_metrics.is_enabled(): return _generate()
+    start = time.perf_counter()
+    with qr_metrics.collect_timings() as timings:
+        response = current_app.make_response(_generate())
+    elapsed = time.perf_counter() - start
+    content_type = request.form.get('content_type', 'url')
+    output_format = request.form.get('output_format', 'png')
+    qr_metrics.GENERATE_SECONDS.observe(elapsed, content_type if content_type in CONTENT_TYPES else 'other',
+                                        output_format if output_format in OUTPUT_FORMATS else 'other')
+    qr_metrics.GENERATE_REQUESTS.inc(str(response.status_code))
+    if current_app.config['SERVER_TIMING']:
+        cached = response.status_code == 200 and not any(name == 'matrix' for name, _ in timings)
+        response.headers['Server-Timing'] = qr_metrics.server_timing(
+            timings, elapsed, extra=['cache;desc="hit"'] if cached else ())
+    return response
+
+def _generate():
+    with qr_metrics.stage('validate'): params, errors = validate_generation_form(request.form)
+    content_type = params['content_type']; data_from_form = params['data']
+    error_correction = params['error_correction']; scale = params['scale']; border = params['border']
+    dark_color = params['dark_color']; light_color = params['light_color']
+    output_format = params['output_format']; kwargs_for_generator = params['generator_kwargs']
+    text_style = params['text_style']; version = params['version']; mask = params['mask']
 
     if errors:
+        qr_metrics.count_error('validate')
         # Si 'is_preview' es un parámetro en la request, devolver JSON. Sino, ¿redirigir con errores?
         # Por ahora, la UI siempre usa fetch, así que JSON está bien.
         return jsonify({"success": False, "error": "Datos inválidos.", "field_errors": errors}), 400
 
     # --- Llamada a la Lógica de Generación ---
     data_for_qr = data_from_form
-    enable_tracking = form_data.get('enable_tracking') == 'on'
 
-    if content_type == 'url' and enable_tracking:
+    if params['enable_tracking']:
         if not data_from_form or not (data_from_form.startswith('http://') or data_from_form.startswith('https://')):
             # Este error ya debería haber sido capturado antes, pero por si acaso.
             return jsonify({"success": False, "error": "Se requiere una URL válida para el seguimiento.", "field_errors": {'data_url': 'URL inválida.'}}), 400
-
-        # Generar un short_code único
-        short_code = uuid.uuid4().hex[:6] # Un código corto, podría necesitar lógica para asegurar unicidad si hay colisiones
-        while TrackableQR.query.filter_by(short_code=short_code).first() is not None:
-            short_code = uuid.uuid4().hex[:6]
-
-        new_qr_record = TrackableQR(original_url=data_from_form, short_code=short_code)
-        db.session.add(new_qr_record)
         try:
-            db.session.commit()
             # La URL que se codificará en el QR será la URL de seguimiento
-            data_for_qr = url_for('track_qr_visit', short_code=short_code, _external=True)
+            with qr_metrics.stage('track_db'): data_for_qr = create_trackable_qr(data_from_form)
         except Exception as e: # Podría ser por colisión de short_code si no se maneja bien o error de BD
-            db.session.rollback()
-            app.logger.error(f"Error al guardar QR rastreable: {e}")
+            current_app.logger.error(f"Error al guardar QR rastreable: {e}")
             return jsonify({"success": False, "error": "No se pudo crear el QR rastreable en la base de datos."}), 500
+        for fmt in current_app.config['ARTIFACT_PRERENDER']:
+            try: tracked_qr_artifact(data_for_qr.rsplit('/', 1)[-1], fmt)
+            except Exception as e: # Se renderizará en la primera petición a /qr/
+                current_app.logger.warning(f"No se pudo pre-renderizar el artefacto {fmt} del QR rastreable: {e}")
 
     try:
-        qr_result = generate_qr_code(
-            data=data_for_qr, # Usar data_for_qr que puede ser la URL de seguimiento
-            error=error_correction, scale=scale, border=border,
-            dark_color=dark_color, light_color=light_color,
-            output_format=output_format, content_type=content_type, # content_type sigue siendo 'url' para la lógica de formato
-            **kwargs_for_generator
-        )
+        with qr_metrics.stage('build'): payload = construir_payload(data_for_qr, content_type, **kwargs_for_generator) # data_for_qr puede ser la URL de seguimiento
     except ValueError as ve:
          return jsonify({"success": False, "error": str(ve)}), 400
+
+    # El hash del payload + opciones es a la vez la clave de caché y un ETag fuerte
+    etag = render_key(payload, error=error_correction, scale=scale, border=border,
+                      dark_color=dark_color, light_color=light_color, output_format=output_format,
+                      text_style=text_style, version=version, mask=mask, png_compression=current_app.config['PNG_COMPRESSION'])
+    if request.if_none_match.contains(etag):
+        not_modified = current_app.response_class(status=304)
+        not_modified.set_etag(etag)
+        return not_modified
+
+    try:
+        rendered = render_cache.get(etag)
+        if rendered is None:
+            # La matriz no depende de la escala: con ella se sabe el tamaño final antes de rasterizar nada
+            with qr_metrics.stage('matrix'): matrix = get_matrix(payload, error_correction, version, mask)
+            scale = render_budget().admit(matrix, scale, border, output_format, light_color)
+            if output_format == 'png' and ((matrix.size + 2 * border) * scale) ** 2 >= current_app.config['QR_STREAM_MIN_PIXELS']:
+                # Imagen grande: se envía según se comprime (memoria de dos scanlines) y no se cachea
+                streamed = current_app.response_class(iter_png(matrix, scale, border, dark_color, light_color,
+                                                       current_app.config['PNG_COMPRESSION']), mimetype='image/png',
+                                              headers={'Content-Disposition': 'attachment; filename=qrcode_gen.png'})
+                streamed.set_etag(etag)
+                return streamed
+            options = {'output_format': output_format, 'scale': scale, 'border': border,
+                       'dark_color': dark_color, 'light_color': light_color, 'text_style': text_style,
+                       'png_compression': current_app.config['PNG_COMPRESSION']}
+            rendered = get_render_pool().render(matrix, options) # Ya se consultó la caché: un solo fallo por petición
+            render_cache.put(etag, rendered)
+    except ValueError as ve:
+         return jsonify({"success": False, "error": str(ve)}), 400
+    except qr_pool.PoolBusyError as busy:
+         return jsonify({"success": False, "error": str(busy)}), 503, {'Retry-After': str(busy.retry_after)}
     except NotImplementedError as nie:
          return jsonify({"success": False, "error": str(nie)}), 501 # Not Implemented
-
-    if qr_result is None:
+    except Exception as e:
+        current_app.logger.error(f"Error generando QR ({content_type}, format {output_format}): {e}")
         return jsonify({"success": False, "error": "Fallo al generar el código QR. Verifique los datos de entrada."}), 500
 
     filename = f"qrcode_gen.{output_format}"
     mimetype_map = {
-        'png': 'image/png', 'svg': 'image/svg+xml',
+        'png': 'image/png', 'svg': 'image/svg+xml', 'svgz': 'image/svg+xml',
         'txt': 'text/plain', 'pdf': 'application/pdf', 'eps': 'application/postscript'
     }
     mimetype = mimetype_map.get(output_format, 'application/octet-stream')
 
-    return send_file(qr_result, mimetype=mimetype, as_attachment=True, download_name=filename)
+    return send_file(BytesIO(rendered), mimetype=mimetype, as_attachment=True, download_name=filename, etag=etag)
 
-@app.route('/track/<short_code>')
+def _preview_payload():
+    # Formulario de /generate -> (params, payload, None) o (params, None, respuesta de error), sin efectos:
+    # con seguimiento no se crea el QR rastreable, se codifica una URL de seguimiento de ejemplo con un
+    # short_code de la longitud mínima, así que la versión es la del QR final.
+    params, errors = validate_generation_form(request.form)
+    if errors:
+        return params, None, (jsonify({"success": False, "error": "Datos inválidos.", "field_errors": errors}), 400)
+    data_for_qr = params['data']
+    if params['enable_tracking']:
+        if not data_for_qr or not (data_for_qr.startswith('http://') or data_for_qr.startswith('https://')):
+            return params, None, (jsonify({"success": False, "error": "Se requiere una URL válida para el seguimiento.", "field_errors": {'data_url': 'URL inválida.'}}), 400)
+        data_for_qr = url_for('qr.track_qr_visit', short_code='0' * short_code_allocator.min_length, _external=True)
+    try:
+        return params, construir_payload(data_for_qr, params['content_type'], **params['generator_kwargs']), None
+    except ValueError as ve:
+        return params, None, (jsonify({"success": False, "error": str(ve)}), 400)
+
+@bp.route('/generate/matrix', methods=['POST'])
+def generate_matrix():
+    # Previsualización: solo la matriz de módulos (filas empaquetadas a bits en base64, unos cientos de
+    # bytes) y el navegador la dibuja en un canvas con los colores y la escala del formulario. No se
+    # rasteriza nada ni se crean QRs rastreables.
+    params, payload, error_response = _preview_payload()
+    if error_response is not None: return error_response
+    etag = render_key(payload, error=params['error_correction'], scale=params['scale'], border=params['border'],
+                      output_format='matrix', version=params['version'], mask=params['mask'])
+    if request.if_none_match.contains(etag):
+        not_modified = current_app.response_class(status=304)
+        not_modified.set_etag(etag)
+        return not_modified
+    try:
+        matrix = get_matrix(payload, params['error_correction'], params['version'], params['mask'])
+    except ValueError as ve:
+         return jsonify({"success": False, "error": str(ve)}), 400
+    response = jsonify(dict(matrix.to_dict(), success=True, scale=params['scale'], border=params['border']))
+    response.set_etag(etag)
+    return response
+
+@bp.route('/generate/plan', methods=['POST'])
+def generate_plan():
+    # Planificador de capacidad (qr_capacity.py): versión, módulos, margen por nivel ECC y tamaño estimado
+    # de cada formato, sin construir la matriz ni la imagen. Sirve para avisar antes de generar.
+    params, payload, error_response = _preview_payload()
+    if error_response is not None: return error_response
+    try:
+        plan = plan_capacity(payload, params['error_correction'], params['version'], params['scale'],
+                             params['border'], params['text_style'], render_budget())
+    except ValueError as ve:
+         return jsonify({"success": False, "error": str(ve)}), 400
+    return jsonify(dict(plan, success=True)) # 'fits' indica si /generate podrá generarlo con estas opciones
+
+def _cacheable_render(output_format, data):
+    # Mismo criterio que /generate: los PNG de QR_STREAM_MIN_PIXELS o más se envían en streaming y no se cachean
+    if output_format != 'png': return True
+    width, height = struct.unpack('>II', data[16:24]) # IHDR
+    return width * height < current_app.config['QR_STREAM_MIN_PIXELS']
+
+@bp.route('/generate/batch', methods=['POST'])
+def generate_batch():
+    # Acepta NDJSON (por defecto) o CSV, en el cuerpo o como fichero 'file', con los mismos campos que
+    # /generate por fila. Devuelve un ZIP en streaming con una entrada por fila válida y manifest.json.
+    upload = request.files.get('file')
+    source = upload.stream if upload else request.stream
+    input_format = request.args.get('format')
+    if not input_format:
+        name = (upload.filename if upload else '') or ''
+        is_csv = name.lower().endswith('.csv') or (upload.mimetype if upload else request.mimetype) == 'text/csv'
+        input_format = 'csv' if is_csv else 'ndjson'
+    if input_format not in ('csv', 'ndjson', 'jsonl'):
+        return jsonify({"success": False, "error": "Formato de entrada inválido (csv o ndjson)."}), 400
+
+    # La entrada se copia antes de empezar a responder (a disco si es grande): así no se lee el cuerpo
+    # de la petición mientras se escribe la respuesta.
+    spooled = tempfile.SpooledTemporaryFile(max_size=current_app.config['BATCH_SPOOL_MAX_BYTES'])
+    shutil.copyfileobj(source, spooled)
+    spooled.seek(0)
+
+    def entries():
+        manifest = {'rows': 0, 'generated': 0, 'errors': []}
+        used_names = set()
+
+        def add_error(row_number, error, field_errors=None):
+            entry = {'row': row_number, 'error': error}
+            if field_errors: entry['field_errors'] = field_errors
+            manifest['errors'].append(entry)
+
+        def jobs():
+            budget = render_budget()
+            for row_number, row, row_error in qr_batch.iter_rows(spooled, input_format):
+                manifest['rows'] += 1
+                if row_error:
+                    add_error(row_number, row_error); continue
+                params, errors = validate_generation_form(row)
+                if errors:
+                    add_error(row_number, "Datos inválidos.", errors); continue
+                data_for_qr = params['data']
+                try:
+                    if params['enable_tracking']: data_for_qr = create_trackable_qr(data_for_qr)
+                    payload = construir_payload(data_for_qr, params['content_type'], **params['generator_kwargs'])
+                except ValueError as ve:
+                    add_error(row_number, str(ve)); continue
+                except Exception as e:
+                    current_app.logger.error(f"Error al guardar QR rastreable (fila {row_number}): {e}")
+                    add_error(row_number, "No se pudo crear el QR rastreable en la base de datos."); continue
+
+                options = qr_batch.render_options(params, current_app.config['PNG_COMPRESSION'])
+                name = qr_batch.entry_name(row_number, row, options['output_format'], used_names)
+                yield (row_number, name, render_key(payload, **options), options['output_format']), qr_batch.render_job, (payload, options, budget)
+
+        def cached_or_submitted():
+            # Las filas ya presentes en la caché de renders no pasan por el pool
+            for tag, fn, args in jobs():
+                cached = render_cache.get(tag[2])
+                yield ((*tag, True), None, cached) if cached is not None else ((*tag, False), fn, args)
+
+        for (row_number, name, key, output_format, cached), future in qr_batch.run_bounded(
+                get_batch_executor(), cached_or_submitted(), current_app.config['BATCH_MAX_IN_FLIGHT']):
+            try: data = future.result()
+            except ValueError as ve: # p. ej. RenderBudgetError: la fila pide una imagen demasiado grande
+                add_error(row_number, str(ve)); continue
+            except Exception as e:
+                current_app.logger.error(f"Error generando QR en lote (fila {row_number}): {e}")
+                add_error(row_number, "Fallo al generar el código QR."); continue
+            if not cached and _cacheable_render(output_format, data): render_cache.put(key, data)
+            manifest['generated'] += 1
+            yield name, data
+        manifest['errors'].sort(key=lambda entry: entry['row'])
+        yield 'manifest.json', json.dumps(manifest, ensure_ascii=False, indent=2).encode('utf-8')
+        spooled.close()
+
+    return current_app.response_class(stream_with_context(qr_batch.stream_zip(entries())), mimetype='application/zip',
+                              headers={'Content-Disposition': 'attachment; filename=qrcodes_batch.zip'})
+
+@bp.route('/qr/<short_code>.<any(png, svg):fmt>')
+def tracked_qr_image(short_code, fmt):
+    # Imagen estable de un QR rastreable. Tras el primer render es un fichero estático: la app solo
+    # lo envía (sendfile vía wsgi.file_wrapper, o X-Accel-Redirect), o el proxy lo sirve sin pasar por aquí.
+    artifact = get_artifact_store().get(short_code, fmt)
+    if artifact is None:
+        if resolve_short_code(short_code) is None: abort(404)
+        if artifact_tracking_url(short_code) is None:
+            return jsonify({"success": False, "error": "Imágenes de QR rastreables no disponibles: falta ARTIFACT_BASE_URL."}), 503
+        try:
+            artifact = tracked_qr_artifact(short_code, fmt)
+        except qr_pool.PoolBusyError as busy:
+            return jsonify({"success": False, "error": str(busy)}), 503, {'Retry-After': str(busy.retry_after)}
+    accel_prefix = current_app.config['ARTIFACT_ACCEL_REDIRECT']
+    if accel_prefix:
+        response = current_app.response_class(mimetype=artifact.mimetype)
+        response.headers['X-Accel-Redirect'] = accel_prefix.rstrip('/') + '/' + artifact.link
+        response.set_etag(artifact.digest)
+    else:
+        response = send_file(artifact.path, mimetype=artifact.mimetype, etag=artifact.digest,
+                             max_age=current_app.config['ARTIFACT_MAX_AGE'], conditional=True)
+    response.cache_control.public = True
+    response.cache_control.max_age = current_app.config['ARTIFACT_MAX_AGE']
+    response.cache_control.immutable = True
+    return response
+
+def gc_artifacts(grace=None):
+    # Borra los enlaces de códigos que ya no están en la BD y los blobs sin enlaces (ver ArtifactStore)
+    def existing(short_codes):
+        return set(db.session.execute(sa.select(TrackableQR.short_code).where(TrackableQR.short_code.in_(short_codes))).scalars())
+    return get_artifact_store().collect_garbage(existing, current_app.config['ARTIFACT_GC_GRACE'] if grace is None else grace)
+
+@bp.cli.command('gc-artifacts')
+def gc_artifacts_command():
+    """Elimina artefactos de QRs rastreables borrados y blobs huérfanos."""
+    stats = gc_artifacts()
+    print(f"Enlaces eliminados: {stats['links_removed']}; blobs eliminados: {stats['blobs_removed']} "
+          f"({stats['bytes_freed']} bytes)")
+
+@bp.route('/track/<short_code>')
 def track_qr_visit(short_code):
-    qr_record = TrackableQR.query.filter_by(short_code=short_code).first_or_404()
+    original_url = resolve_short_code(short_code)
+    if original_url is None: abort(404)
+
+    # Incrementar el contador de visitas y registrar el evento sin bloquear la redirección (salvo en modo síncrono)
+    event = {'short_code': short_code, 'occurred_at': datetime.datetime.utcnow(),
+             'ua_class': classify_user_agent(request.headers.get('User-Agent')),
+             'referrer_class': classify_referrer(request.referrer, request.host)}
+    if current_app.config['TRACKING_SYNC_COUNTS']:
+        try:
+            add_visit_counts({short_code: 1}, [event])
+        except Exception as e:
+            db.session.rollback()
+            current_app.logger.error(f"Error al actualizar el contador de visitas para {short_code}: {e}")
+            # Por ahora, redirigimos para no interrumpir al usuario
+    else:
+        visit_counter.record(short_code, event=event)
+    if current_app.config['VISIT_ROLLUP_INTERVAL']: visit_rollup_task.start()
+
+    return redirect(original_url)
+
+STATS_SORTS = {'created': 'created_at', 'visits': 'visit_count'}
+STATS_PAGE_SIZE = 50
+STATS_MAX_PAGE_SIZE = 500
+
+def _encode_stats_cursor(sort, record):
+    value = record.created_at.isoformat() if sort == 'created' else record.visit_count
+    return base64.urlsafe_b64encode(json.dumps([value, record.id]).encode('utf-8')).decode('ascii')
+
+def _decode_stats_cursor(sort, cursor):
+    value, record_id = json.loads(base64.urlsafe_b64decode(cursor.encode('ascii')))
+    if sort == 'created': value = datetime.datetime.fromisoformat(value)
+    elif not isinstance(value, int): raise ValueError("Cursor inválido.")
+    return value, str(record_id)
+
+def _url_prefix_filter(prefix):
+    # Rango [prefijo, prefijo con el último carácter incrementado): a diferencia de LIKE, usa el índice.
+    # U+10FFFF no se puede incrementar: se incrementa el carácter anterior (o no hay cota superior).
+    stem = prefix.rstrip(chr(sys.maxunicode))
+    if not stem: return TrackableQR.original_url >= prefix
+    upper = stem[:-1] + chr(ord(stem[-1]) + 1)
+    return sa.and_(TrackableQR.original_url >= prefix, TrackableQR.original_url < upper)
+
+def query_stats(sort='created', order='desc', cursor=None, limit=STATS_PAGE_SIZE, url_prefix=None, min_visits=None):
+    # Página de TrackableQR por clave (sort, id) + resumen con agregados SQL sobre el conjunto filtrado.
+    # El coste es el mismo en la primera página que en la número mil.
+    sort_column = getattr(TrackableQR, STATS_SORTS[sort])
+    filters = []
+    if url_prefix: filters.append(_url_prefix_filter(url_prefix))
+    if min_visits is not None: filters.append(TrackableQR.visit_count >= min_visits)
+
+    page_query = sa.select(TrackableQR).where(*filters)
+    if cursor:
+        value, record_id = _decode_stats_cursor(sort, cursor)
+        key = sa.tuple_(sort_column, TrackableQR.id)
+        bound = sa.tuple_(sa.literal(value, type_=sort_column.type), sa.literal(record_id, type_=TrackableQR.id.type))
+        page_query = page_query.where(key < bound if order == 'desc' else key > bound)
+    if order == 'desc': page_query = page_query.order_by(sort_column.desc(), TrackableQR.id.desc())
+    else: page_query = page_query.order_by(sort_column.asc(), TrackableQR.id.asc())
+    records = db.session.execute(page_query.limit(limit + 1), **storage.read_bind(db)).scalars().all()
+    next_cursor = _encode_stats_cursor(sort, records[limit - 1]) if len(records) > limit else None
+
+    summary = db.session.execute(sa.select(
+        sa.func.count(TrackableQR.id), sa.func.coalesce(sa.func.sum(TrackableQR.visit_count), 0),
+        sa.func.max(TrackableQR.visit_count), sa.func.count(TrackableQR.id).filter(TrackableQR.visit_count > 0),
+    ).where(*filters), **storage.read_bind(db)).one()
+    total, total_visits, max_visits, visited = summary
+    return {
+        'items': records[:limit], 'next_cursor': next_cursor,
+        'summary': {'total_codes': total, 'total_visits': total_visits, 'max_visits': max_visits or 0,
+                    'visited_codes': visited, 'avg_visits': (total_visits / total) if total else 0.0},
+    }
 
-    # Incrementar el contador de visitas
-    qr_record.visit_count += 1
+def _stats_request_args():
+    # Devuelve (kwargs para query_stats, error)
+    args = request.args
+    sort = args.get('sort', 'created')
+    order = args.get('order', 'desc')
+    if sort not in STATS_SORTS or order not in ('asc', 'desc'): return None, "Orden inválido."
     try:
-        db.session.commit()
-    except Exception as e:
-        db.session.rollback()
-        app.logger.error(f"Error al actualizar el contador de visitas para {short_code}: {e}")
-        # Opcionalmente, redirigir igualmente o mostrar un error diferente
-        # Por ahora, redirigimos para no interrumpir al usuario
-
-    return redirect(qr_record.original_url)
-
-@app.route('/stats')
+        limit = min(max(int(args.get('limit', STATS_PAGE_SIZE)), 1), STATS_MAX_PAGE_SIZE)
+        min_visits = int(args['min_visits']) if args.get('min_visits') else None
+        cursor = args.get('cursor') or None
+        if cursor: _decode_stats_cursor(sort, cursor)
+    except (ValueError, TypeError, KeyError):
+        return None, "Parámetros de paginación inválidos."
+    return {'sort': sort, 'order': order, 'cursor': cursor, 'limit': limit,
+            'url_prefix': args.get('prefix') or None, 'min_visits': min_visits}, None
+
+@bp.route('/stats')
 def show_stats():
-    tracked_qrs = TrackableQR.query.order_by(TrackableQR.created_at.desc()).all()
-    return render_template('stats.html', qrs=tracked_qrs)
+    stats_args, error = _stats_request_args()
+    if error: return error, 400
+    page = query_stats(**stats_args)
+    return render_template('stats.html', qrs=page['items'], summary=page['summary'],
+                           next_cursor=page['next_cursor'], filters=stats_args)
+
+@bp.route('/stats.json')
+def show_stats_json():
+    stats_args, error = _stats_request_args()
+    if error: return jsonify({"success": False, "error": error}), 400
+    page = query_stats(**stats_args)
+    items = [{'short_code': qr.short_code, 'original_url': qr.original_url, 'visit_count': qr.visit_count,
+              'created_at': qr.created_at.isoformat() if qr.created_at else None,
+              'tracking_url': url_for('qr.track_qr_visit', short_code=qr.short_code, _external=True)}
+             for qr in page['items']]
+    return jsonify({"success": True, "items": items, "next_cursor": page['next_cursor'], "summary": page['summary']})
+
+TIMESERIES_DEFAULT_DAYS = {'hour': 7, 'day': 90}
+
+def _parse_timeseries_moment(value):
+    moment = datetime.datetime.fromisoformat(value)
+    if moment.tzinfo is not None: moment = moment.astimezone(datetime.timezone.utc).replace(tzinfo=None)
+    return moment
+
+@bp.route('/stats/<short_code>/timeseries')
+def show_visit_timeseries(short_code):
+    # Serie de visitas por hora o por día de un short_code, leída de los agregados (UTC).
+    # Los eventos aún no agregados por el rollup no aparecen hasta la siguiente pasada.
+    bucket = request.args.get('bucket', 'hour')
+    if bucket not in ROLLUP_BUCKETS: return jsonify({"success": False, "error": "Bucket inválido (hour o day)."}), 400
+    try:
+        end = _parse_timeseries_moment(request.args['end']) if request.args.get('end') else datetime.datetime.utcnow()
+        start = (_parse_timeseries_moment(request.args['start']) if request.args.get('start')
+                 else end - datetime.timedelta(days=TIMESERIES_DEFAULT_DAYS[bucket]))
+    except ValueError:
+        return jsonify({"success": False, "error": "Fechas inválidas (formato ISO 8601)."}), 400
+    if resolve_short_code(short_code) is None:
+        return jsonify({"success": False, "error": "Código no encontrado."}), 404
+
+    rows = db.session.execute(sa.select(VisitRollup.bucket_start, VisitRollup.visits).where(
+        VisitRollup.short_code == short_code, VisitRollup.bucket == bucket,
+        VisitRollup.bucket_start >= ROLLUP_BUCKETS[bucket](start), VisitRollup.bucket_start < end,
+    ).order_by(VisitRollup.bucket_start), **storage.read_bind(db)).all()
+    points = [{'start': bucket_start.isoformat(), 'visits': visits} for bucket_start, visits in rows]
+    return jsonify({"success": True, "short_code": short_code, "bucket": bucket,
+                    "start": start.isoformat(), "end": end.isoformat(),
+                    "total_visits": sum(point['visits'] for point in points), "points": points})
+
+# Métricas en formato Prometheus (ver qr_metrics.py). SERVER_TIMING añade la cabecera Server-Timing
+# con los tiempos por etapa a las respuestas de /generate (útil en las herramientas del navegador).
+DEFAULT_CONFIG.setdefault('METRICS_ENABLED', os.environ.get('QR_METRICS', '1') != '0')
+DEFAULT_CONFIG.setdefault('SERVER_TIMING', os.environ.get('QR_SERVER_TIMING') == '1')
+DB_STATEMENTS = qr_metrics.REGISTRY.counter('qr_db_statements_total', "Sentencias SQL ejecutadas por engine.", ['bind'])
+
+def _collect_app_metrics():
+    # Contadores que ya llevan las cachés, el VisitCounter y los pools: se leen al exportar
+    render, codes, matrix = render_cache.stats(), short_code_cache.stats(), matrix_cache_info()
+    render_pool = current_app.extensions['qr']['render_pool'] if has_app_context() else None
+    pool = render_pool.stats() if render_pool is not None else dict.fromkeys(
+        ('in_flight', 'inline', 'submitted', 'rejected', 'timeouts', 'recycles', 'restarts'), 0)
+    pools = []
+    if has_app_context(): # /metrics; fuera de una petición no hay engines que leer
+        for bind, engine in db.engines.items():
+            checked_out = getattr(engine.pool, 'checkedout', None)
+            if checked_out is not None: pools.append(({'bind': bind or 'default'}, checked_out()))
+    return [
+        ('qr_render_cache_requests_total', 'counter', "Consultas a la caché de renders por resultado.",
+         [({'result': 'hit'}, render['hits']), ({'result': 'disk_hit'}, render['disk_hits']),
+          ({'result': 'miss'}, render['misses'])]),
+        ('qr_render_cache_evictions_total', 'counter', "Renders expulsados de la caché en memoria.", [({}, render['evictions'])]),
+        ('qr_render_cache_bytes', 'gauge', "Bytes en la caché de renders en memoria.", [({}, render['size_bytes'])]),
+        ('qr_matrix_cache_requests_total', 'counter', "Consultas a la caché de matrices por resultado.",
+         [({'result': 'hit'}, matrix.hits), ({'result': 'miss'}, matrix.misses)]),
+        ('qr_short_code_cache_requests_total', 'counter', "Resoluciones de short_code por resultado.",
+         [({'result': 'hit'}, codes['hits']), ({'result': 'negative_hit'}, codes['negative_hits']),
+          ({'result': 'miss'}, codes['misses'])]),
+        ('qr_visits_flushed_total', 'counter', "Visitas volcadas a la BD.", [({}, visit_counter.flushed_visits)]),
+        ('qr_visit_flush_errors_total', 'counter', "Volcados de visitas fallidos.", [({}, visit_counter.flush_errors)]),
+        ('qr_visit_events_dropped_total', 'counter', "Eventos de visita descartados por volcados fallidos.",
+         [({}, visit_counter.events_dropped)]),
+        ('qr_visits_pending', 'gauge', "Visitas en memoria pendientes de volcar.", [({}, sum(visit_counter.pending().values()))]),
+        ('qr_db_pool_checked_out', 'gauge', "Conexiones del pool en uso por engine.", pools),
+        ('qr_render_pool_jobs_total', 'counter', "Renders de /generate por destino o rechazo.",
+         [({'result': result}, pool[result]) for result in ('inline', 'submitted', 'rejected', 'timeouts')]),
+        ('qr_render_pool_in_flight', 'gauge', "Renders aceptados por el pool sin terminar.", [({}, pool['in_flight'])]),
+        ('qr_render_pool_recycles_total', 'counter', "Pools de workers reciclados o reiniciados.",
+         [({'reason': 'max_jobs'}, pool['recycles']), ({'reason': 'broken'}, pool['restarts'])]),
+    ]
+
+qr_metrics.REGISTRY.add_collector(_collect_app_metrics)
+
+@bp.route('/metrics')
+def metrics():
+    if not current_app.config['METRICS_ENABLED']: abort(404)
+    return current_app.response_class(qr_metrics.REGISTRY.expose(), content_type='text/plain; version=0.0.4; charset=utf-8')
+
+# Precarga (QR_PRELOAD=1) para servidores que cargan la app en el maestro y hacen fork de los workers
+# (gunicorn --preload): ver warm_up.
+DEFAULT_CONFIG.setdefault('PRELOAD', os.environ.get('QR_PRELOAD') == '1')
+
+def warm_up(app):
+    # Carga en el proceso actual lo que cada worker pagaría en sus primeras peticiones: python-qrcode, las
+    # zonas de datos y máscaras de las 40 versiones, un render de cada formato y las plantillas. Con fork
+    # los workers lo heredan compartido (copy-on-write). No abre conexiones a la BD ni arranca hilos o
+    # pools, que no sobreviven al fork; gc.freeze() evita que el GC de cada worker toque (y copie) esas páginas.
+    qr_matrix.warm_up()
+    matrix = build_matrix('https://example.com/', 'M') # Fuera de get_matrix: no ocupa la caché de matrices
+    for output_format in OUTPUT_FORMATS: render_matrix(matrix, output_format, scale=1, border=0)
+    for template in ('index.html', 'stats.html'): app.jinja_env.get_template(template)
+    gc.freeze()
+
+def create_app(config=None):
+    app = Flask(__name__)
+    app.config.update(config or {})
+    for key, value in DEFAULT_CONFIG.items(): app.config.setdefault(key, value)
+    app.extensions['qr'] = dict.fromkeys(QR_EXTENSION_KEYS) # Ver get_render_pool y compañía
+    storage.configure_app(app) # WAL, busy_timeout, pool y engine de solo lectura (ver storage.py)
+    db.init_app(app) # Los engines se crean aquí, pero no conectan hasta la primera consulta
+    storage.init_engines(app, db)
+    with app.app_context():
+        for bind, engine in db.engines.items():
+            sa.event.listen(engine, 'after_cursor_execute', lambda *args, bind=bind or 'default': DB_STATEMENTS.inc(bind))
+
+    global render_cache, visit_counter, visit_rollup_task, short_code_cache, short_code_allocator
+    config = app.config
+    render_cache = RenderCache(max_bytes=config['QR_RENDER_CACHE_MAX_BYTES'], disk_dir=config['QR_RENDER_CACHE_DIR'])
+    visit_counter = VisitCounter(lambda counts, events: _flush_visit_counts(app, counts, events),
+                                 interval=config['TRACKING_FLUSH_INTERVAL'], threshold=config['TRACKING_FLUSH_THRESHOLD'],
+                                 max_events=config['TRACKING_MAX_PENDING_EVENTS'])
+    visit_rollup_task = PeriodicTask(lambda: _maintain_visit_events(app), interval=config['VISIT_ROLLUP_INTERVAL'],
+                                     name='visit-rollup')
+    short_code_cache = ShortCodeCache(max_entries=config['TRACKING_CACHE_MAX_ENTRIES'], ttl=config['TRACKING_CACHE_TTL'],
+                                      negative_ttl=config['TRACKING_CACHE_NEGATIVE_TTL'])
+    short_code_allocator = ShortCodeAllocator(_reserve_short_code_values, block_size=config['SHORT_CODE_BLOCK_SIZE'],
+                                              threshold=config['SHORT_CODE_WIDEN_THRESHOLD'],
+                                              max_length=TrackableQR.__table__.c.short_code.type.length)
+    qr_metrics.set_enabled(config['METRICS_ENABLED'])
+    app.register_blueprint(bp)
+    if config['PRELOAD']:
+        with app.app_context(): warm_up(app)
+    return app
+
+app = create_app()
 
 if __name__ == '__main__':
+    with app.app_context(): init_db() # Servidor de desarrollo; en despliegues, flask --app app init-db
     app.run(debug=True, host='0.0.0.0', port=8080)
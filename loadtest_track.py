@@ -0,0 +1,70 @@
+import argparse
+import asyncio
+import sys
+import time
+from urllib.parse import urlsplit
+
+# Prueba de carga de redirecciones /track: N conexiones keep-alive concurrentes que piden la misma
+# URL en bucle y miden peticiones/s y latencias. Sirve para comparar la ruta Flask con redirect_server.py:
+#
+#   python loadtest_track.py http://127.0.0.1:8080/track/abc1234 http://127.0.0.1:8081/track/abc1234
+
+async def _read_response(reader):
+    status_line = await reader.readline()
+    if not status_line: raise ConnectionError("Conexión cerrada por el servidor")
+    length, close = 0, False
+    while True:
+        line = await reader.readline()
+        if line in (b'\r\n', b'\n', b''): break
+        name, _, value = line.decode('latin-1').partition(':')
+        name = name.strip().lower()
+        if name == 'content-length': length = int(value)
+        elif name == 'connection' and value.strip().lower() == 'close': close = True
+    if length: await reader.readexactly(length)
+    return int(status_line.split()[1]), close
+
+async def _client(host, port, request, deadline, latencies, statuses):
+    reader = writer = None
+    while time.perf_counter() < deadline:
+        if writer is None: reader, writer = await asyncio.open_connection(host, port)
+        start = time.perf_counter()
+        writer.write(request)
+        status, close = await _read_response(reader)
+        latencies.append(time.perf_counter() - start)
+        statuses[status] = statuses.get(status, 0) + 1
+        if close:
+            writer.close(); writer = None
+    if writer is not None: writer.close()
+
+async def run_load(url, concurrency=32, duration=5.0):
+    parts = urlsplit(url)
+    host, port = parts.hostname, parts.port or 80
+    path = parts.path + (f"?{parts.query}" if parts.query else '')
+    request = (f"GET {path} HTTP/1.1\r\nHost: {parts.netloc}\r\nUser-Agent: loadtest_track\r\n\r\n").encode('latin-1')
+    latencies, statuses = [], {}
+    started = time.perf_counter()
+    deadline = started + duration
+    await asyncio.gather(*(_client(host, port, request, deadline, latencies, statuses) for _ in range(concurrency)))
+    elapsed = time.perf_counter() - started
+    latencies.sort()
+    percentile = lambda p: latencies[min(len(latencies) - 1, int(len(latencies) * p))] * 1000 if latencies else 0.0
+    return {'url': url, 'requests': len(latencies), 'rps': len(latencies) / elapsed, 'statuses': statuses,
+            'p50_ms': percentile(0.50), 'p99_ms': percentile(0.99)}
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(prog='loadtest_track', description="Prueba de carga de redirecciones /track.")
+    parser.add_argument('urls', nargs='+', help="URLs /track/<short_code> a comparar")
+    parser.add_argument('-c', '--concurrency', type=int, default=32)
+    parser.add_argument('-d', '--duration', type=float, default=5.0, help="Segundos por URL")
+    args = parser.parse_args(argv)
+    results = [asyncio.run(run_load(url, args.concurrency, args.duration)) for url in args.urls]
+    for result in results:
+        print(f"{result['url']}: {result['rps']:.0f} req/s, p50 {result['p50_ms']:.2f} ms, "
+              f"p99 {result['p99_ms']:.2f} ms, estados {result['statuses']}")
+    if len(results) > 1 and results[0]['rps']:
+        for result in results[1:]:
+            print(f"{result['url']}: x{result['rps'] / results[0]['rps']:.1f} respecto a {results[0]['url']}")
+    return 0 if all(set(r['statuses']) <= {301, 302, 303, 307} for r in results) else 1
+
+if __name__ == '__main__':
+    sys.exit(main())
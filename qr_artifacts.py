@@ -0,0 +1,112 @@
+import hashlib
+import os
+import time
+import uuid
+
+from qr_cache import atomic_write
+
+# Almacén en disco, direccionado por contenido, de las imágenes de los QR rastreables:
+# - blobs/<aa>/<sha256>.<fmt>: los bytes del render; el sha256 es a la vez el nombre y el ETag.
+# - codes/<short_code>.<fmt>: enlace simbólico relativo al blob. Un proxy delante de la app puede
+#   servir /qr/<short_code>.<fmt> directamente desde codes/ (try_files o X-Accel-Redirect), así que
+#   tras el primer render no hay trabajo de Python.
+# Blobs y enlaces se escriben de forma atómica (temporal + os.replace): varios workers o máquinas
+# pueden compartir el directorio. collect_garbage borra enlaces de códigos que ya no existen y blobs
+# que ningún enlace referencia.
+
+ARTIFACT_FORMATS = {'png': 'image/png', 'svg': 'image/svg+xml'}
+
+class Artifact:
+    __slots__ = ('short_code', 'fmt', 'digest', 'path', 'link')
+
+    def __init__(self, short_code, fmt, digest, path, link):
+        self.short_code = short_code
+        self.fmt = fmt
+        self.digest = digest
+        self.path = path # Blob (ruta real)
+        self.link = link # Ruta del enlace relativa a la raíz del almacén (para X-Accel-Redirect)
+
+    @property
+    def mimetype(self):
+        return ARTIFACT_FORMATS[self.fmt]
+
+class ArtifactStore:
+    def __init__(self, root):
+        self.root = root
+        self.blobs_dir = os.path.join(root, 'blobs')
+        self.codes_dir = os.path.join(root, 'codes')
+        os.makedirs(self.blobs_dir, exist_ok=True)
+        os.makedirs(self.codes_dir, exist_ok=True)
+
+    def _blob_path(self, digest, fmt):
+        return os.path.join(self.blobs_dir, digest[:2], f"{digest}.{fmt}")
+
+    def get(self, short_code, fmt):
+        # Artifact del código o None si no se ha renderizado (o el enlace apunta a un blob borrado)
+        link = f"codes/{short_code}.{fmt}"
+        try: target = os.readlink(os.path.join(self.root, link))
+        except OSError: return None
+        path = os.path.normpath(os.path.join(self.codes_dir, target))
+        if not os.path.exists(path): return None
+        return Artifact(short_code, fmt, os.path.basename(path).rsplit('.', 1)[0], path, link)
+
+    def put(self, short_code, fmt, data):
+        if fmt not in ARTIFACT_FORMATS: raise ValueError(f"Formato de artefacto no soportado: {fmt}")
+        digest = hashlib.sha256(data).hexdigest()
+        path = self._blob_path(digest, fmt)
+        if os.path.exists(path):
+            os.utime(path) # Blob compartido: renueva el margen de gracia frente a collect_garbage
+        elif not atomic_write(path, data):
+            raise OSError(f"No se pudo escribir el artefacto {path}")
+        link = os.path.join(self.codes_dir, f"{short_code}.{fmt}")
+        tmp_link = os.path.join(self.codes_dir, f".{short_code}.{fmt}.{uuid.uuid4().hex}")
+        os.symlink(os.path.relpath(path, self.codes_dir), tmp_link)
+        os.replace(tmp_link, link)
+        return Artifact(short_code, fmt, digest, path, f"codes/{short_code}.{fmt}")
+
+    def get_or_render(self, short_code, fmt, render):
+        artifact = self.get(short_code, fmt)
+        return artifact if artifact is not None else self.put(short_code, fmt, render())
+
+    def collect_garbage(self, existing=None, grace=3600.0, batch_size=500, now=None):
+        # existing(short_codes) -> conjunto de los que siguen existiendo (p. ej. una consulta a la BD por
+        # lotes); None conserva todos los enlaces válidos. Los blobs sin enlaces y los temporales se borran
+        # solo si son más antiguos que `grace` segundos, para no competir con un put en curso.
+        now = time.time() if now is None else now
+        stats = {'links_removed': 0, 'blobs_removed': 0, 'bytes_freed': 0}
+        referenced = set()
+
+        def remove(path, key):
+            try: os.unlink(path)
+            except OSError: return False
+            stats[key] += 1
+            return True
+
+        def check(batch):
+            alive = existing([code for code, _ in batch]) if existing is not None else None
+            for code, path in batch:
+                if alive is not None and code not in alive: remove(path, 'links_removed')
+                else: referenced.add(os.path.basename(os.readlink(path)))
+
+        batch = []
+        with os.scandir(self.codes_dir) as entries:
+            for entry in entries:
+                if entry.name.startswith('.'): # Enlace temporal de un put interrumpido
+                    if now - entry.stat(follow_symlinks=False).st_mtime > grace: remove(entry.path, 'links_removed')
+                    continue
+                if not os.path.exists(entry.path): # Enlace roto
+                    remove(entry.path, 'links_removed'); continue
+                batch.append((entry.name.rsplit('.', 1)[0], entry.path))
+                if len(batch) >= batch_size:
+                    check(batch); batch = []
+        if batch: check(batch)
+
+        for prefix in os.listdir(self.blobs_dir):
+            directory = os.path.join(self.blobs_dir, prefix)
+            with os.scandir(directory) as entries:
+                for entry in entries:
+                    if entry.name in referenced: continue
+                    info = entry.stat()
+                    if now - info.st_mtime <= grace: continue
+                    if remove(entry.path, 'blobs_removed'): stats['bytes_freed'] += info.st_size
+        return stats
@@ -0,0 +1,164 @@
+import concurrent.futures
+import csv
+import io
+import json
+import os
+import re
+import time
+import zipfile
+
+from werkzeug.utils import secure_filename
+
+from qr_forms import validate_generation_form
+from qr_generator_logic import construir_payload, render_qr_payload
+
+# Utilidades compartidas por la generación masiva (/generate/batch y la CLI): lectura de filas
+# NDJSON/CSV con los mismos nombres de campo que el formulario de /generate, render en un pool
+# de workers con un número acotado de trabajos en vuelo y escritura de ZIP en streaming.
+
+STORED_FORMATS = {'png', 'jpeg', 'jpg', 'gif', 'svgz'} # Ya comprimidos: no vale la pena deflate
+
+def normalize_row(row):
+    # Las filas CSV traen '' para columnas vacías y las NDJSON pueden traer números o booleanos;
+    # se normaliza todo a strings como en un formulario (True -> 'on') y se descartan los vacíos.
+    normalized = {}
+    for key, value in row.items():
+        if key is None or value is None or value == '': continue
+        if value is True: value = 'on'
+        elif value is False: continue
+        normalized[key] = value if isinstance(value, str) else str(value)
+    return normalized
+
+def iter_ndjson_rows(stream, start=1):
+    # Genera (número de fila, fila, error) sin cargar la entrada completa en memoria
+    text = io.TextIOWrapper(stream, encoding='utf-8', newline='') if not isinstance(stream, io.TextIOBase) else stream
+    row_number = start - 1
+    for line in text:
+        if not line.strip(): continue
+        row_number += 1
+        try: row = json.loads(line)
+        except ValueError as e:
+            yield row_number, None, f"JSON inválido: {e}"; continue
+        if not isinstance(row, dict):
+            yield row_number, None, "Cada línea debe ser un objeto JSON."; continue
+        yield row_number, normalize_row(row), None
+
+def iter_csv_rows(stream, start=1):
+    text = io.TextIOWrapper(stream, encoding='utf-8-sig', newline='') if not isinstance(stream, io.TextIOBase) else stream
+    for row_number, row in enumerate(csv.DictReader(text), start):
+        yield row_number, normalize_row(row), None
+
+def iter_rows(stream, input_format='ndjson', start=1):
+    if input_format == 'csv': return iter_csv_rows(stream, start)
+    if input_format in ('ndjson', 'jsonl', 'json'): return iter_ndjson_rows(stream, start)
+    raise ValueError(f"Formato de entrada no soportado: {input_format}")
+
+def render_options(params, png_compression='default'):
+    # Opciones de render_qr_payload a partir de los params de validate_generation_form
+    return {'error': params['error_correction'], 'scale': params['scale'], 'border': params['border'],
+            'dark_color': params['dark_color'], 'light_color': params['light_color'],
+            'output_format': params['output_format'], 'text_style': params['text_style'],
+            'version': params['version'], 'mask': params['mask'], 'png_compression': png_compression}
+
+DEFAULT_NAME = re.compile(r'qrcode_\d+')
+
+def entry_name(row_number, row, output_format, used_names):
+    # Usa la columna opcional 'filename' si es válida y no está repetida; si no, qrcode_<fila>.<formato>.
+    # Los nombres con la forma de los de por defecto se ignoran, así que estos son únicos por fila y
+    # used_names solo guarda los de 'filename' (su memoria crece con las filas que lo traen, no con todas).
+    stem = os.path.splitext(secure_filename(row.get('filename', '')))[0]
+    name = f"{stem}.{output_format}" if stem and not DEFAULT_NAME.fullmatch(stem) else ''
+    if not name or name in used_names: return f"qrcode_{row_number:06d}.{output_format}"
+    used_names.add(name)
+    return name
+
+def process_rows(rows, png_compression='default'):
+    # Trabajo completo de una fila fuera del proceso principal (CLI): validación, payload y render.
+    # Filas con seguimiento no se admiten aquí porque requieren la base de datos de la app.
+    # rows: [(número de fila, fila, error de lectura)] tal como los genera iter_rows.
+    # Devuelve [(número de fila, fila, bytes | None, error | None, tiempos por etapa)].
+    results = []
+    for row_number, row, row_error in rows:
+        timings = {}
+        if row_error:
+            results.append((row_number, {}, None, {'error': row_error}, timings)); continue
+        start = time.perf_counter()
+        params, errors = validate_generation_form(row)
+        timings['validate'] = time.perf_counter() - start
+        if not errors and params['enable_tracking']:
+            errors = {'enable_tracking': "El seguimiento no está disponible en la generación por lotes sin servidor."}
+        if errors:
+            results.append((row_number, row, None, {'error': "Datos inválidos.", 'field_errors': errors}, timings)); continue
+        try:
+            start = time.perf_counter()
+            payload = construir_payload(params['data'], params['content_type'], **params['generator_kwargs'])
+            timings['build'] = time.perf_counter() - start
+            start = time.perf_counter()
+            data = render_job(payload, render_options(params, png_compression))
+            timings['render'] = time.perf_counter() - start
+        except Exception as e:
+            results.append((row_number, row, None, {'error': str(e) or type(e).__name__}, timings)); continue
+        results.append((row_number, row, data, None, timings))
+    return results
+
+def render_job(payload, options, budget=None):
+    # Se ejecuta en el worker: solo viajan el payload ya construido, las opciones y el presupuesto
+    # de render (RenderBudget), y vuelven bytes
+    return render_qr_payload(payload, budget=budget, **options).getvalue()
+
+def make_executor(kind='process', workers=None):
+    workers = workers or os.cpu_count() or 1
+    if kind == 'thread': return concurrent.futures.ThreadPoolExecutor(max_workers=workers)
+    return concurrent.futures.ProcessPoolExecutor(max_workers=workers)
+
+def completed_future(result):
+    future = concurrent.futures.Future()
+    future.set_result(result)
+    return future
+
+def run_bounded(executor, jobs, max_in_flight):
+    # jobs: iterable de (tag, fn, args). Genera (tag, future) a medida que terminan, sin tener
+    # nunca más de max_in_flight trabajos (y por tanto resultados) pendientes a la vez.
+    # Si fn es None, args ya es el resultado (p. ej. un acierto de caché) y se entrega sin pasar por el pool.
+    pending = {}
+    for tag, fn, args in jobs:
+        if fn is None:
+            yield tag, completed_future(args); continue
+        pending[executor.submit(fn, *args)] = tag
+        if len(pending) >= max_in_flight:
+            done, _ = concurrent.futures.wait(pending, return_when=concurrent.futures.FIRST_COMPLETED)
+            for future in done: yield pending.pop(future), future
+    while pending:
+        done, _ = concurrent.futures.wait(pending, return_when=concurrent.futures.FIRST_COMPLETED)
+        for future in done: yield pending.pop(future), future
+
+def entry_compression(output_format):
+    return zipfile.ZIP_STORED if output_format.lower() in STORED_FORMATS else zipfile.ZIP_DEFLATED
+
+class _ChunkSink:
+    # Destino no "seekable" para ZipFile: acumula lo escrito hasta que el generador lo vacía
+    def __init__(self):
+        self._chunks = []
+
+    def write(self, data):
+        self._chunks.append(bytes(data))
+        return len(data)
+
+    def flush(self):
+        pass
+
+    def drain(self):
+        data = b''.join(self._chunks)
+        self._chunks = []
+        return data
+
+def stream_zip(entries):
+    # entries: iterable de (nombre, bytes). Genera trozos del ZIP a medida que llegan las entradas.
+    sink = _ChunkSink()
+    with zipfile.ZipFile(sink, 'w') as zf:
+        for name, data in entries:
+            zf.writestr(name, data, compress_type=entry_compression(os.path.splitext(name)[1][1:]))
+            chunk = sink.drain()
+            if chunk: yield chunk
+    chunk = sink.drain()
+    if chunk: yield chunk
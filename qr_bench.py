@@ -0,0 +1,351 @@
+import argparse
+import datetime
+import json
+import os
+import platform
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+import tracemalloc
+
+import qr_metrics
+
+# Benchmarks reproducibles del generador: constructores de payload, planificador de capacidad,
+# construcción de la matriz
+# (versiones 1-40 x niveles ECC), cada formato de salida a escala pequeña/mediana/grande, el coste de
+# la instrumentación de qr_metrics y las rutas /generate y /track de punta a punta con el cliente de
+# pruebas de Flask. Cada resultado guarda el tiempo por llamada (mínimo y mediana de varias
+# repeticiones), el pico de memoria de una llamada (tracemalloc: memoria de Python y NumPy, no los
+# buffers internos de Pillow) y, si la llamada devuelve bytes (renders), su tamaño.
+#
+#   python qr_bench.py run -o base.json                 # antes del cambio / actualización
+#   python qr_bench.py run -o nuevo.json -k render/
+#   python qr_bench.py compare base.json nuevo.json --threshold 0.10
+
+RESULTS_VERSION = 1
+BENCH_PAYLOAD = 'BENCH' # Cabe en la versión 1 con ECC H, así que sirve para fijar cualquier versión
+ERROR_LEVELS = ('L', 'M', 'Q', 'H')
+BENCHMARK_GROUPS = ('payload', 'plan', 'matrix', 'render', 'metrics', 'http', 'startup')
+QUICK_VERSIONS = (1, 5, 10, 20, 30, 40)
+RENDER_SIZES = {'small': (2, 4), 'medium': (10, 10), 'large': (40, 20)} # tamaño -> (versión, escala)
+
+BUILDER_SAMPLES = {
+    'url': {'data': 'https://example.com/landing?utm_source=qr'},
+    'text': {'data': 'Texto de prueba para el benchmark de payloads.'},
+    'wifi': {'wifi_ssid': 'Oficina', 'wifi_password': 'clave-segura', 'wifi_security': 'WPA', 'wifi_hidden': True},
+    'vcard': {'vcard_params': {'firstname': 'Ana', 'lastname': 'García', 'email': 'ana@example.com',
+                               'phone': '+34 600 000 000', 'org': 'ACME', 'title': 'CTO', 'street': 'Calle Mayor 1',
+                               'city': 'Madrid', 'zipcode': '28013', 'country': 'España', 'birthday': '19900203',
+                               'url': 'https://example.com', 'note': 'Contacto de prueba'}},
+    'mecard': {'mecard_params': {'firstname': 'Ana', 'lastname': 'García', 'phone': '+34600000000',
+                                 'email': 'ana@example.com', 'birthday': '1990-02-03', 'address': 'Calle Mayor 1'}},
+    'email': {'email_to': 'ana@example.com', 'email_subject': 'Hola desde el QR', 'email_body': 'Cuerpo del mensaje.'},
+    'sms': {'sms_to': '+34600000000', 'sms_body': 'Mensaje de prueba'},
+    'tel': {'tel_number': '+34600000000'},
+    'event': {'event_summary': 'Reunión', 'event_start': '2024-05-01T10:00', 'event_end': '2024-05-01T11:30',
+              'event_description': 'Revisión\ntrimestral', 'event_location': 'Sala 2'},
+    'geo': {'geo_latitude': '40.4168', 'geo_longitude': '-3.7038'},
+    'epc': {'epc_name': 'ACME S.L.', 'epc_iban': 'DE89370400440532013000', 'epc_amount': '12.50',
+            'epc_bic': 'COBADEFFXXX', 'epc_remittance': 'Factura 2024-001'},
+}
+
+def builder_benchmarks():
+    from qr_generator_logic import construir_payload
+    from qr_payloads import PAYLOAD_TYPES
+    for content_type in PAYLOAD_TYPES:
+        sample = dict(BUILDER_SAMPLES.get(content_type, {}))
+        if not sample: continue # Tipos registrados sin muestra (p. ej. añadidos por una extensión)
+        data = sample.pop('data', None)
+        yield f"payload/{content_type}", lambda ct=content_type, d=data, kw=sample: construir_payload(d, ct, **kw)
+
+def plan_benchmarks():
+    # Planificador de capacidad sobre el payload ya construido de cada muestra (sin matriz ni imagen)
+    from qr_capacity import plan_capacity
+    from qr_generator_logic import construir_payload
+    for content_type, sample in BUILDER_SAMPLES.items():
+        sample = dict(sample)
+        payload = construir_payload(sample.pop('data', None), content_type, **sample)
+        yield f"plan/{content_type}", lambda p=payload: plan_capacity(p, 'M')
+
+def matrix_benchmarks(versions):
+    # Sin caché: ajuste de versión fijado, codificación, Reed-Solomon y búsqueda de máscara completos
+    from qr_matrix import build_matrix
+    for version in versions:
+        for error in ERROR_LEVELS:
+            yield f"matrix/v{version:02d}-{error}", lambda v=version, e=error: build_matrix(BENCH_PAYLOAD, e, version=v)
+
+def render_benchmarks():
+    from qr_forms import OUTPUT_FORMATS
+    from qr_matrix import build_matrix
+    from qr_render import render_matrix, iter_png, PNG_COMPRESSION
+    for size, (version, scale) in RENDER_SIZES.items():
+        matrix = build_matrix(BENCH_PAYLOAD, 'M', version=version, mask=0)
+        for output_format in OUTPUT_FORMATS:
+            yield (f"render/{output_format}-{size}",
+                   lambda m=matrix, f=output_format, s=scale: render_matrix(m, f, scale=s).getvalue())
+        # PNG de paleta (colores propios) y los demás niveles de compresión
+        yield (f"render/png-palette-{size}",
+               lambda m=matrix, s=scale: render_matrix(m, 'png', scale=s, dark_color='#336699').getvalue())
+        for compression in PNG_COMPRESSION:
+            if compression == 'default': continue
+            yield (f"render/png-{compression}-{size}",
+                   lambda m=matrix, s=scale, c=compression: render_matrix(m, 'png', scale=s, png_compression=c).getvalue())
+    # PNG de ~18.500 px de lado consumido por chunks, como en la respuesta en streaming de /generate
+    huge = build_matrix(BENCH_PAYLOAD, 'M', version=40, mask=0)
+    yield "render/png-stream-huge", lambda: sum(len(chunk) for chunk in iter_png(huge, 100, 4, '#000000', '#ffffff'))
+
+def http_benchmarks(db_path):
+    # La app se importa aquí y se crea sobre una BD temporal (aunque el módulo ya estuviera importado)
+    from app import create_app, db, init_db, TrackableQR
+    app = create_app({'SQLALCHEMY_DATABASE_URI': 'sqlite:///' + db_path, 'TESTING': True,
+                      'SERVER_NAME': 'localhost:5000', 'VISIT_ROLLUP_INTERVAL': 0})
+    with app.app_context(): init_db()
+    client = app.test_client()
+    form = {'content_type': 'url', 'data_url': 'https://example.com/bench', 'output_format': 'png', 'scale': '10'}
+    counter = iter(range(10 ** 9))
+
+    def generate(fields):
+        response = client.post('/generate', data=fields)
+        assert response.status_code == 200, response.status_code
+        return response.data
+
+    def uninstrumented(fn):
+        # Misma petición con la instrumentación de qr_metrics desactivada, para medir su coste
+        def run():
+            qr_metrics.set_enabled(False)
+            try: return fn()
+            finally: qr_metrics.set_enabled(True)
+        return run
+
+    yield "http/generate-cached", lambda: generate(form)
+    yield "http/generate-cached-nometrics", uninstrumented(lambda: generate(form))
+    yield "http/generate-uncached", lambda: generate({**form, 'data_url': f"https://example.com/bench/{next(counter)}"})
+    yield "http/generate-svg-uncached", lambda: generate({**form, 'output_format': 'svg',
+                                                          'data_url': f"https://example.com/bench/{next(counter)}"})
+    generate({**form, 'enable_tracking': 'on'})
+    with app.app_context(): short_code = db.session.execute(db.select(TrackableQR.short_code)).scalar()
+
+    def track():
+        response = client.get(f"/track/{short_code}")
+        assert response.status_code == 302, response.status_code
+
+    yield "http/track", track
+
+# Arranque de la app en un proceso nuevo. Cada script imprime una línea JSON con sus segundos, su RSS
+# máximo y su memoria privada (páginas no compartidas con otros procesos, de /proc/self/smaps_rollup):
+# con precarga y fork los workers comparten con el maestro lo que este ya cargó.
+_STARTUP_PRELUDE = """
+import json, os, resource, time
+def report(start):
+    private = None
+    try:
+        with open('/proc/self/smaps_rollup') as f:
+            private = 1024 * sum(int(line.split()[1]) for line in f if line.startswith(('Private_Clean', 'Private_Dirty')))
+    except OSError: pass
+    print(json.dumps({'seconds': time.perf_counter() - start, 'private_bytes': private,
+                      'rss_bytes': resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * 1024}), flush=True)
+def first_requests(flask_app):
+    # Renders pequeños: se hacen en línea, sin arrancar el pool de procesos
+    client = flask_app.test_client()
+    for output_format in ('png', 'svg'):
+        response = client.post('/generate', data={'content_type': 'url', 'data_url': 'https://example.com/startup',
+                                                  'output_format': output_format, 'scale': '4'})
+        assert response.status_code == 200, response.status_code
+"""
+STARTUP_SCRIPTS = {
+    # Importar app.py (lo que paga cada worker, prueba o comando de la CLI)
+    'startup/import-app': "start = time.perf_counter()\nimport app\nreport(start)",
+    # Worker sin precarga: importa la app y atiende sus primeras peticiones
+    'startup/worker': "start = time.perf_counter()\nimport app\nfirst_requests(app.app)\nreport(start)",
+    # Worker de un maestro con precarga (QR_PRELOAD=1): solo sus primeras peticiones tras el fork
+    'startup/preload-worker': ("os.environ['QR_PRELOAD'] = '1'\nimport app\npid = os.fork()\n"
+                               "if pid == 0:\n    start = time.perf_counter()\n    first_requests(app.app)\n"
+                               "    report(start)\n    os._exit(0)\nos.waitpid(pid, 0)"),
+}
+
+def measure_startup(script, db_path, repeat=5):
+    # Mismo formato que measure(); cada repetición es un proceso nuevo y peak_bytes es la memoria privada
+    env = dict(os.environ, QR_DB_PATH=db_path)
+    env.pop('QR_RENDER_CACHE_DIR', None)
+    runs = []
+    for _ in range(repeat):
+        completed = subprocess.run([sys.executable, '-c', _STARTUP_PRELUDE + script], env=env, capture_output=True,
+                                   text=True, check=True, cwd=os.path.dirname(os.path.abspath(__file__)))
+        runs.append(json.loads(completed.stdout.strip().splitlines()[-1]))
+    times = [run['seconds'] for run in runs]
+    rss = statistics.median(run['rss_bytes'] for run in runs)
+    private = [run['private_bytes'] for run in runs if run['private_bytes'] is not None]
+    return {'time': min(times), 'median': statistics.median(times), 'number': 1, 'repeat': repeat,
+            'peak_bytes': int(statistics.median(private)) if private else int(rss), 'rss_bytes': int(rss)}
+
+def startup_benchmarks(db_path):
+    for name, script in STARTUP_SCRIPTS.items():
+        yield name, lambda repeat, s=script: measure_startup(s, db_path, repeat)
+
+def metrics_benchmarks():
+    # Coste de una etapa instrumentada (con y sin recogida de Server-Timing) frente a un bloque vacío
+    def empty():
+        pass
+
+    def instrumented():
+        with qr_metrics.stage('bench'): pass
+
+    def collected():
+        with qr_metrics.collect_timings():
+            with qr_metrics.stage('bench'): pass
+
+    yield "metrics/baseline", empty
+    yield "metrics/stage", instrumented
+    yield "metrics/stage-server-timing", collected
+
+def measure(fn, repeat=5, min_time=0.05):
+    # Tiempo por llamada con el número de llamadas por repetición calibrado para durar >= min_time,
+    # y pico de memoria de una llamada adicional bajo tracemalloc (fuera de las mediciones de tiempo)
+    output = fn() # Calentamiento: imports perezosos, cachés de módulo, etc.
+    number, elapsed = 1, 0.0
+    while True:
+        start = time.perf_counter()
+        for _ in range(number): fn()
+        elapsed = time.perf_counter() - start
+        if elapsed >= min_time: break
+        number = max(number * 2, int(number * min_time / elapsed * 1.1) if elapsed > 0 else number * 10)
+    times = [elapsed / number]
+    for _ in range(repeat - 1):
+        start = time.perf_counter()
+        for _ in range(number): fn()
+        times.append((time.perf_counter() - start) / number)
+    tracemalloc.start()
+    try:
+        tracemalloc.reset_peak()
+        base = tracemalloc.get_traced_memory()[0]
+        fn()
+        peak = tracemalloc.get_traced_memory()[1] - base
+    finally:
+        tracemalloc.stop()
+    result = {'time': min(times), 'median': statistics.median(times), 'peak_bytes': peak,
+              'number': number, 'repeat': repeat}
+    if isinstance(output, (bytes, bytearray)): result['output_bytes'] = len(output)
+    return result
+
+def environment():
+    import importlib.metadata as metadata
+    versions = {}
+    for package in ('qrcode', 'Pillow', 'numpy', 'Flask', 'SQLAlchemy'):
+        try: versions[package] = metadata.version(package)
+        except metadata.PackageNotFoundError: versions[package] = None
+    return {'python': platform.python_version(), 'implementation': platform.python_implementation(),
+            'machine': platform.machine(), 'system': platform.system(), 'cpu_count': os.cpu_count(),
+            'packages': versions}
+
+def run_benchmarks(groups=None, pattern=None, versions=range(1, 41), repeat=5, min_time=0.05, progress=None):
+    # Devuelve el documento de resultados (el mismo que se guarda como JSON)
+    groups = groups or BENCHMARK_GROUPS
+    results = {}
+    with tempfile.TemporaryDirectory(prefix='qr-bench-') as tmp:
+        sources = {'payload': builder_benchmarks, 'plan': plan_benchmarks, 'matrix': lambda: matrix_benchmarks(versions),
+                   'render': render_benchmarks, 'metrics': metrics_benchmarks,
+                   'http': lambda: http_benchmarks(os.path.join(tmp, 'bench.db')),
+                   'startup': lambda: startup_benchmarks(os.path.join(tmp, 'startup.db'))}
+        for group in groups:
+            if pattern and '/' in pattern and not pattern.startswith(group + '/'):
+                continue # El filtro apunta a otro grupo: no se prepara este (p. ej. no se importa la app)
+            for name, fn in sources[group]():
+                if pattern and pattern not in name: continue
+                results[name] = fn(repeat) if group == 'startup' else measure(fn, repeat, min_time)
+                if progress: progress(name, results[name])
+        if 'http' in groups and 'app' in sys.modules:
+            sys.modules['app'].visit_counter.flush() # Antes de borrar la BD temporal
+    return {'version': RESULTS_VERSION, 'created': datetime.datetime.now(datetime.timezone.utc).isoformat(),
+            'environment': environment(), 'results': results}
+
+def compare_results(baseline, current, threshold=0.10, memory_threshold=0.20):
+    # Devuelve [(nombre, tiempo base, tiempo actual, ratio, memoria base, memoria actual, avisos)] para
+    # los benchmarks comunes. Un aviso 'time'/'memory' indica una regresión mayor que el umbral; 'size',
+    # una salida (bytes del render) más grande que la base en más del umbral de tiempo.
+    rows = []
+    for name in sorted(set(baseline['results']) & set(current['results'])):
+        old, new = baseline['results'][name], current['results'][name]
+        ratio = new['time'] / old['time'] if old['time'] else float('inf')
+        flags = []
+        if ratio > 1 + threshold: flags.append('time')
+        if new['peak_bytes'] > old['peak_bytes'] * (1 + memory_threshold) + 1024: flags.append('memory')
+        if 'output_bytes' in old and new.get('output_bytes', 0) > old['output_bytes'] * (1 + threshold): flags.append('size')
+        rows.append((name, old['time'], new['time'], ratio, old['peak_bytes'], new['peak_bytes'], flags))
+    return rows
+
+def format_time(seconds):
+    if seconds >= 1: return f"{seconds:.2f} s"
+    if seconds >= 1e-3: return f"{seconds * 1e3:.2f} ms"
+    return f"{seconds * 1e6:.1f} µs"
+
+def format_bytes(size):
+    if size < 1024: return f"{size} B"
+    if size < 1024 ** 2: return f"{size / 1024:.1f} KiB"
+    return f"{size / 1024 ** 2:.1f} MiB"
+
+def _load(path):
+    with open(path, encoding='utf-8') as f: results = json.load(f)
+    if results.get('version') != RESULTS_VERSION:
+        raise SystemExit(f"{path}: versión de resultados no soportada ({results.get('version')}).")
+    return results
+
+def _parse_versions(value):
+    if '-' in value:
+        first, last = (int(part) for part in value.split('-'))
+        versions = range(first, last + 1)
+    else:
+        versions = [int(part) for part in value.split(',')]
+    if not versions or not all(1 <= v <= 40 for v in versions):
+        raise argparse.ArgumentTypeError("Versiones entre 1 y 40 (ej: 1-40 o 1,10,40).")
+    return versions
+
+def build_parser():
+    parser = argparse.ArgumentParser(prog='qr_bench', description="Benchmarks del generador de QR.")
+    commands = parser.add_subparsers(dest='command', required=True)
+    run = commands.add_parser('run', help="Ejecuta los benchmarks y guarda los resultados en JSON")
+    run.add_argument('-o', '--output', help="Fichero JSON de resultados (por defecto solo se imprimen)")
+    run.add_argument('-g', '--group', action='append', choices=BENCHMARK_GROUPS,
+                     help="Grupo a ejecutar (repetible; por defecto todos)")
+    run.add_argument('-k', '--filter', help="Solo benchmarks cuyo nombre contenga este texto")
+    run.add_argument('--versions', type=_parse_versions, default=range(1, 41), help="Versiones de matriz (1-40)")
+    run.add_argument('--quick', action='store_true', help=f"Versiones de matriz {QUICK_VERSIONS} y menos repeticiones")
+    run.add_argument('--repeat', type=int, default=5)
+    run.add_argument('--min-time', type=float, default=0.05, help="Segundos mínimos por repetición")
+    compare = commands.add_parser('compare', help="Compara dos ficheros de resultados y marca regresiones")
+    compare.add_argument('baseline')
+    compare.add_argument('current')
+    compare.add_argument('--threshold', type=float, default=0.10, help="Regresión de tiempo tolerada (0.10 = +10%%)")
+    compare.add_argument('--memory-threshold', type=float, default=0.20, help="Regresión de memoria tolerada")
+    return parser
+
+def main(argv=None):
+    args = build_parser().parse_args(argv)
+    if args.command == 'run':
+        versions, repeat = (QUICK_VERSIONS, min(args.repeat, 3)) if args.quick else (args.versions, args.repeat)
+        report = lambda name, r: print(f"{name:32} {format_time(r['time']):>12} {format_bytes(r['peak_bytes']):>12}"
+                                       + (f" {format_bytes(r['output_bytes']):>12}" if 'output_bytes' in r else ''), flush=True)
+        results = run_benchmarks(args.group, args.filter, versions, repeat, args.min_time, progress=report)
+        if args.output:
+            with open(args.output, 'w', encoding='utf-8') as f: json.dump(results, f, indent=2, sort_keys=True)
+            print(f"{len(results['results'])} resultados en {args.output}")
+        return 0
+
+    baseline, current = _load(args.baseline), _load(args.current)
+    rows = compare_results(baseline, current, args.threshold, args.memory_threshold)
+    for name, old_time, new_time, ratio, old_peak, new_peak, flags in rows:
+        print(f"{name:32} {format_time(old_time):>12} -> {format_time(new_time):>12} x{ratio:5.2f} "
+              f"{format_bytes(old_peak):>11} -> {format_bytes(new_peak):>11} {' '.join(f'REGRESIÓN:{f}' for f in flags)}")
+    for label, names in (("Solo en la base", set(baseline['results']) - set(current['results'])),
+                         ("Nuevos", set(current['results']) - set(baseline['results']))):
+        if names: print(f"{label}: {', '.join(sorted(names))}")
+    if baseline.get('environment') != current.get('environment'):
+        print("Aviso: los entornos difieren (Python/paquetes/máquina); compare con cuidado.")
+    regressions = [row for row in rows if row[-1]]
+    print(f"{len(rows)} comparados, {len(regressions)} regresiones (umbral tiempo +{args.threshold:.0%}, "
+          f"memoria +{args.memory_threshold:.0%})")
+    return 1 if regressions else 0
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,122 @@
+import hashlib
+import os
+import tempfile
+import threading
+from collections import OrderedDict
+
+# Caché de renders direccionada por contenido: la clave es un hash del payload final
+# más las opciones de render, así que dos peticiones idénticas comparten los mismos bytes.
+
+RENDER_KEY_VERSION = 4 # Incrementar si cambia la salida de los renderers para invalidar la caché
+
+def render_key(payload, error='M', scale=10, border=4, dark_color='#000000',
+               light_color='#ffffff', output_format='png', text_style='unicode', version=None, mask=None,
+               png_compression='default'):
+    h = hashlib.sha256()
+    options = (RENDER_KEY_VERSION, error.upper(), int(scale), int(border),
+               (dark_color or '').lower(), (light_color or '').lower(), output_format.lower())
+    if output_format.lower() == 'txt': options += (text_style,) # Solo afecta a la salida de texto
+    if output_format.lower() == 'png' and png_compression != 'default': options += (('png', png_compression),)
+    if version is not None or mask is not None: options += (('version', version), ('mask', mask))
+    h.update(repr(options).encode('utf-8'))
+    h.update(b'\0')
+    h.update(str(payload).encode('utf-8'))
+    return h.hexdigest()
+
+def atomic_write(path, data):
+    # Escritura atómica: otro proceso nunca debe leer un fichero a medio escribir. Devuelve False si falla.
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    fd, tmp_path = tempfile.mkstemp(dir=os.path.dirname(path))
+    try:
+        with os.fdopen(fd, 'wb') as f: f.write(data)
+        os.replace(tmp_path, path)
+        return True
+    except OSError:
+        try: os.unlink(tmp_path)
+        except OSError: pass
+        return False
+
+class RenderCache:
+    def __init__(self, max_bytes=64 * 1024 * 1024, disk_dir=None):
+        self.max_bytes = max_bytes
+        self.disk_dir = disk_dir
+        self._entries = OrderedDict() # key -> bytes, en orden LRU (el más reciente al final)
+        self._size = 0
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.disk_hits = 0
+        self.misses = 0
+        self.evictions = 0
+        if disk_dir: os.makedirs(disk_dir, exist_ok=True)
+
+    def __len__(self):
+        return len(self._entries)
+
+    @property
+    def size_bytes(self):
+        return self._size
+
+    def _disk_path(self, key):
+        return os.path.join(self.disk_dir, key[:2], key)
+
+    def _read_disk(self, key):
+        if not self.disk_dir: return None
+        try:
+            with open(self._disk_path(key), 'rb') as f: return f.read()
+        except OSError: return None
+
+    def _write_disk(self, key, data):
+        path = self._disk_path(key)
+        if os.path.exists(path): return
+        atomic_write(path, data)
+
+    def _store_memory(self, key, data):
+        # Requiere tener self._lock
+        if len(data) > self.max_bytes: return
+        old = self._entries.pop(key, None)
+        if old is not None: self._size -= len(old)
+        self._entries[key] = data
+        self._size += len(data)
+        while self._size > self.max_bytes:
+            _, evicted = self._entries.popitem(last=False)
+            self._size -= len(evicted)
+            self.evictions += 1
+
+    def get(self, key):
+        with self._lock:
+            data = self._entries.get(key)
+            if data is not None:
+                self._entries.move_to_end(key)
+                self.hits += 1
+                return data
+        data = self._read_disk(key)
+        with self._lock:
+            if data is None:
+                self.misses += 1
+                return None
+            self.disk_hits += 1
+            self._store_memory(key, data)
+        return data
+
+    def put(self, key, data):
+        data = bytes(data)
+        with self._lock: self._store_memory(key, data)
+        if self.disk_dir: self._write_disk(key, data)
+
+    def get_or_render(self, key, render):
+        data = self.get(key)
+        if data is None:
+            data = render()
+            self.put(key, data)
+        return data
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self._size = 0
+
+    def stats(self):
+        with self._lock:
+            return {'hits': self.hits, 'disk_hits': self.disk_hits, 'misses': self.misses,
+                    'evictions': self.evictions, 'entries': len(self._entries),
+                    'size_bytes': self._size, 'max_bytes': self.max_bytes}
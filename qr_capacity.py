@@ -0,0 +1,97 @@
+import bisect
+
+from qr_matrix import ERROR_CORRECTION, normalize_error
+from qr_render import TEXT_STYLES
+
+# Planificador de capacidad sin render: a partir del payload ya construido (construir_payload) hace la
+# misma segmentación por modos que QRCode.add_data y el mismo ajuste de versión que QRCode.best_fit,
+# pero contando bits en lugar de escribirlos. Nunca construye la matriz ni la imagen, así que sirve
+# para control de admisión y avisos en la interfaz (microsegundos frente a milisegundos del render).
+#
+# Los tamaños de salida son estimaciones: las dimensiones en píxeles son exactas; los bytes de PNG,
+# SVG y SVGZ dependen del contenido de la matriz y salen de un ajuste sobre renders reales (±25 %).
+# Las tablas y la segmentación de qrcode.util se importan en la primera llamada (como en qr_matrix.py,
+# el paquete qrcode carga PIL).
+
+MODE_NUMBER, MODE_ALPHA_NUM, MODE_8BIT_BYTE = 1, 2, 4 # Valores de qrcode.util.MODE_*
+MODE_NAMES = {MODE_NUMBER: 'numeric', MODE_ALPHA_NUM: 'alphanumeric', MODE_8BIT_BYTE: 'byte'}
+ERROR_LEVELS = tuple(ERROR_CORRECTION)
+PNG_HEADER_BYTES = 70 # Firma, IHDR, PLTE/tRNS, cabecera zlib e IEND
+
+def segments(payload):
+    # [(modo, longitud)], con el mismo criterio que QRCode.add_data(payload) (optimize=20)
+    from qrcode.util import optimal_data_chunks
+    return [(chunk.mode, len(chunk)) for chunk in optimal_data_chunks(str(payload), minimum=20)]
+
+def _segment_bits(mode, length):
+    if mode == MODE_NUMBER: return 10 * (length // 3) + (0, 4, 7)[length % 3]
+    if mode == MODE_ALPHA_NUM: return 11 * (length // 2) + 6 * (length % 2)
+    return 8 * length
+
+def data_bits(segs, version):
+    # Bits del flujo de datos: indicador de modo (4) + contador (según versión) + datos de cada segmento
+    from qrcode.util import mode_sizes_for_version
+    sizes = mode_sizes_for_version(version)
+    return sum(4 + sizes[mode] + _segment_bits(mode, length) for mode, length in segs)
+
+def fit_version(segs, error='M', start=1):
+    # Versión mínima que admite los segmentos (None si no caben en la 40); mismo algoritmo que best_fit
+    from qrcode.util import BIT_LIMIT_TABLE, mode_sizes_for_version
+    limits = BIT_LIMIT_TABLE[ERROR_CORRECTION[normalize_error(error)]]
+    version = bisect.bisect_left(limits, data_bits(segs, start), start)
+    if version == 41: return None
+    if mode_sizes_for_version(start) is not mode_sizes_for_version(version): return fit_version(segs, error, version)
+    return version
+
+def _level_plan(segs, error, version):
+    # Versión de un nivel ECC (la fijada o la mínima) con sus bits de datos y el margen que queda
+    from qrcode.util import BIT_LIMIT_TABLE
+    limits = BIT_LIMIT_TABLE[ERROR_CORRECTION[error]]
+    if version is None: version = fit_version(segs, error)
+    max_headroom = limits[40] - data_bits(segs, 40)
+    if version is None or data_bits(segs, version) > limits[version]:
+        return {'fits': False, 'version': None, 'size': None, 'data_bits': None, 'capacity_bits': None,
+                'headroom_bits': None, 'max_headroom_bits': max_headroom}
+    bits = data_bits(segs, version)
+    return {'fits': True, 'version': version, 'size': 17 + 4 * version, 'data_bits': bits,
+            'capacity_bits': limits[version], 'headroom_bits': limits[version] - bits,
+            'max_headroom_bits': max_headroom}
+
+def estimate_outputs(size, scale=10, border=4, text_style='unicode', budget=None):
+    # Tamaño estimado de cada formato para una matriz de size x size módulos
+    dimension = size + 2 * border
+    modules = size * size
+    pixels = (dimension * scale) ** 2
+    if text_style.startswith('unicode'):
+        # Medios bloques: ' ' (NBSP, 2 bytes UTF-8) en el borde, ~2,75 bytes por carácter en el símbolo
+        lines = (dimension + 1) // 2
+        txt_bytes = lines * (2 * dimension + 1) + round(0.75 * modules / 2)
+    else:
+        txt_bytes = dimension * (2 * dimension + 1) # Dos caracteres ASCII por módulo: exacto
+    outputs = {
+        'png': {'width': dimension * scale, 'height': dimension * scale, 'pixels': pixels,
+                'raw_bytes': dimension * scale * (1 + (dimension * scale + 7) // 8),
+                'bytes': PNG_HEADER_BYTES + round(dimension * dimension * (0.0275 * scale + 0.08))},
+        'svg': {'bytes': 300 + round(1.6 * modules)},
+        'svgz': {'bytes': 250 + round(0.23 * modules)},
+        'txt': {'bytes': txt_bytes},
+    }
+    if budget is not None:
+        # Igual que RenderBudget.admit: solo el PNG depende de la escala
+        for output_format, estimate in outputs.items():
+            estimate['within_budget'] = output_format != 'png' or budget.fits(dimension, scale, output_format)
+    return outputs
+
+def plan_capacity(payload, error='M', version=None, scale=10, border=4, text_style='unicode', budget=None):
+    # Versión, módulos y margen de capacidad por nivel ECC, y tamaño estimado de cada formato
+    error = normalize_error(error)
+    if version is not None and not 1 <= version <= 40: raise ValueError("La versión debe estar entre 1 y 40.")
+    if text_style not in TEXT_STYLES: raise ValueError(f"Estilo de texto no soportado: {text_style}")
+    segs = segments(payload)
+    levels = {level: _level_plan(segs, level, version) for level in ERROR_LEVELS}
+    chosen = levels[error]
+    return {'payload_bytes': len(str(payload).encode('utf-8')),
+            'segments': [{'mode': MODE_NAMES[mode], 'length': length} for mode, length in segs],
+            'error': error, 'fits': chosen['fits'], 'version': chosen['version'], 'size': chosen['size'],
+            'levels': levels,
+            'outputs': estimate_outputs(chosen['size'], scale, border, text_style, budget) if chosen['fits'] else {}}
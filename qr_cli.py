@@ -0,0 +1,269 @@
+import argparse
+import io
+import json
+import os
+import signal
+import sys
+import tarfile
+import tempfile
+import time
+import zipfile
+
+import qr_batch
+from qr_render import PNG_COMPRESSION
+
+# Generador masivo por línea de comandos: lee filas CSV/NDJSON con los mismos campos que el
+# formulario de /generate, reparte el trabajo en un pool de procesos y escribe los ficheros en
+# un directorio, un .zip o un .tar. Un checkpoint permite reanudar una ejecución interrumpida.
+#
+#   python qr_cli.py filas.csv -o salida/ --shard 0/4
+#   python qr_generator_logic.py filas.ndjson -o codigos.zip --workers 8
+
+CHECKPOINT_EVERY = 500 # Filas completadas entre escrituras del checkpoint
+ARCHIVE_CHECKPOINT_EVERY = 10000 # En .zip/.tar cada checkpoint cierra una parte (ver ArchiveSink)
+
+def parse_shard(value):
+    try:
+        index, total = (int(part) for part in value.split('/'))
+    except ValueError:
+        raise argparse.ArgumentTypeError("El shard debe tener la forma i/n (ej: 0/4).")
+    if total < 1 or not 0 <= index < total:
+        raise argparse.ArgumentTypeError("El shard debe cumplir 0 <= i < n.")
+    return index, total
+
+class DirectorySink:
+    def __init__(self, path, part):
+        self.path = path
+        self.last_part = part
+        os.makedirs(path, exist_ok=True)
+
+    def write(self, name, data):
+        # Escritura atómica: una fila nunca queda a medio escribir si se interrumpe la ejecución
+        fd, tmp_path = tempfile.mkstemp(dir=self.path, prefix='.tmp-')
+        with os.fdopen(fd, 'wb') as f: f.write(data)
+        os.replace(tmp_path, os.path.join(self.path, name))
+
+    def commit(self):
+        pass # Cada fichero ya está completo en disco al terminar write
+
+    def close(self):
+        pass
+
+class ArchiveSink:
+    # Un ZIP solo es legible cuando se escribe su directorio central al cerrarlo (y un TAR truncado pierde
+    # su última entrada), así que antes de guardar el checkpoint commit() cierra la parte en curso y la
+    # siguiente fila abre otra: el checkpoint nunca cuenta filas de una parte sin cerrar. Si el proceso
+    # muere entre el cierre y el checkpoint, al reanudar esas filas se repiten en una parte nueva.
+    # Al reanudar también se empieza una parte nueva: un archivo no se puede ampliar de forma segura.
+    def __init__(self, path, part):
+        self.base_path = path
+        self.part = part
+        self.last_part = part
+        self.path = None
+        self._open() # La primera parte siempre existe, aunque no se escriba ninguna fila
+
+    def _open(self):
+        self.last_part = self.part
+        self.path = _part_path(self.base_path, self.part)
+        self._archive = self._create(self.path)
+
+    def write(self, name, data):
+        if self._archive is None: self._open()
+        self._add(name, data)
+
+    def commit(self):
+        if self._archive is None: return
+        self._archive.close()
+        self._archive = None
+        self.part += 1
+
+    def close(self):
+        if self._archive is not None: self._archive.close()
+        self._archive = None
+
+class ZipSink(ArchiveSink):
+    def _create(self, path):
+        return zipfile.ZipFile(path, 'w')
+
+    def _add(self, name, data):
+        self._archive.writestr(name, data, compress_type=qr_batch.entry_compression(os.path.splitext(name)[1][1:]))
+
+class TarSink(ArchiveSink):
+    def _create(self, path):
+        return tarfile.open(path, 'w')
+
+    def _add(self, name, data):
+        info = tarfile.TarInfo(name)
+        info.size = len(data)
+        info.mtime = int(time.time())
+        self._archive.addfile(info, io.BytesIO(data))
+
+def _part_path(path, part):
+    if not part: return path
+    root, ext = os.path.splitext(path)
+    return f"{root}.part{part}{ext}"
+
+def open_sink(path, part=0):
+    lower = path.lower()
+    if lower.endswith('.zip'): return ZipSink(path, part)
+    if lower.endswith('.tar'): return TarSink(path, part)
+    return DirectorySink(path, part)
+
+class Checkpoint:
+    # Guarda la "marca de agua" (todas las filas <= watermark están terminadas) más las filas
+    # terminadas por encima de ella, que como mucho son las que estaban en vuelo.
+    def __init__(self, path, input_path, shard):
+        self.path = path
+        self.input_path = os.path.abspath(input_path)
+        self.shard = shard
+        self.watermark = 0
+        self.done = set()
+        self.max_seen = 0
+        self.part = 0
+        self.generated = 0
+        self.failed = 0
+
+    def owns(self, row_number):
+        index, total = self.shard
+        return (row_number - 1) % total == index
+
+    def is_done(self, row_number):
+        return row_number <= self.watermark or row_number in self.done
+
+    def seen(self, row_number):
+        self.max_seen = max(self.max_seen, row_number)
+        self._advance()
+
+    def mark_done(self, row_number):
+        self.done.add(row_number)
+        self._advance()
+
+    def _advance(self):
+        while self.watermark < self.max_seen:
+            next_row = self.watermark + 1
+            if next_row in self.done: self.done.discard(next_row)
+            elif self.owns(next_row): break
+            self.watermark = next_row
+
+    def load(self):
+        if not os.path.exists(self.path): return False
+        with open(self.path, encoding='utf-8') as f: state = json.load(f)
+        if state.get('input') != self.input_path or tuple(state.get('shard', ())) != tuple(self.shard):
+            raise SystemExit(f"El checkpoint {self.path} corresponde a otra entrada o shard.")
+        self.watermark = state['watermark']; self.done = set(state['done'])
+        self.part = state['part'] + 1 # Las salidas de archivo se escriben en una parte nueva
+        self.generated = state['generated']; self.failed = state['failed']
+        return True
+
+    def save(self):
+        state = {'input': self.input_path, 'shard': list(self.shard), 'watermark': self.watermark,
+                 'done': sorted(self.done), 'part': self.part, 'generated': self.generated, 'failed': self.failed}
+        tmp_path = self.path + '.tmp'
+        with open(tmp_path, 'w', encoding='utf-8') as f: json.dump(state, f)
+        os.replace(tmp_path, self.path)
+
+def _chunks(rows, checkpoint, chunk_size, stats, names):
+    # names: {fila: nombre de la entrada}. Se asignan aquí, en orden de lectura y también a las filas ya
+    # hechas o de otros shards, para que un 'filename' repetido sea siempre de la primera fila que lo usa,
+    # sin depender del orden en que terminan los workers ni de reanudar desde un checkpoint.
+    chunk = []
+    used_names = set()
+    read_start = time.perf_counter()
+    for row_number, row, row_error in rows:
+        checkpoint.seen(row_number)
+        if row_error is None: name = qr_batch.entry_name(row_number, row, row.get('output_format', 'png'), used_names)
+        if not checkpoint.owns(row_number) or checkpoint.is_done(row_number): continue
+        if row_error is None: names[row_number] = name
+        chunk.append((row_number, row, row_error))
+        if len(chunk) >= chunk_size:
+            stats['read'] += time.perf_counter() - read_start
+            yield chunk
+            chunk = []
+            read_start = time.perf_counter()
+    stats['read'] += time.perf_counter() - read_start
+    if chunk: yield chunk
+
+def _raise_interrupt(signum, frame):
+    raise KeyboardInterrupt
+
+def build_parser():
+    parser = argparse.ArgumentParser(prog='qr_cli', description="Generación masiva de códigos QR desde CSV o NDJSON.")
+    parser.add_argument('input', help="Fichero de entrada (.csv, .ndjson o .jsonl)")
+    parser.add_argument('-o', '--output', required=True, help="Directorio, fichero .zip o fichero .tar de salida")
+    parser.add_argument('--input-format', choices=['csv', 'ndjson'], help="Por defecto se deduce de la extensión")
+    parser.add_argument('--workers', type=int, default=os.cpu_count() or 1)
+    parser.add_argument('--png-compression', choices=sorted(PNG_COMPRESSION), default='default',
+                        help="Compresión de los PNG: fast, default o best (ver qr_render.py)")
+    parser.add_argument('--chunk-size', type=int, default=64, help="Filas por trabajo enviado a cada worker")
+    parser.add_argument('--shard', type=parse_shard, default=(0, 1), help="Procesar solo el shard i de n (i/n)")
+    parser.add_argument('--checkpoint', help="Fichero de checkpoint (por defecto <salida>.checkpoint.json)")
+    parser.add_argument('--errors', help="Fichero NDJSON de errores por fila (por defecto <salida>.errors.ndjson)")
+    parser.add_argument('--checkpoint-every', type=int,
+                        help=f"Filas entre checkpoints (por defecto {CHECKPOINT_EVERY}; {ARCHIVE_CHECKPOINT_EVERY} en .zip/.tar, "
+                             "donde cada checkpoint cierra una parte)")
+    parser.add_argument('--no-resume', action='store_true', help="Ignorar un checkpoint existente")
+    return parser
+
+def main(argv=None):
+    args = build_parser().parse_args(argv)
+    input_format = args.input_format or ('csv' if args.input.lower().endswith('.csv') else 'ndjson')
+    base = args.output.rstrip('/\\') or args.output
+    checkpoint = Checkpoint(args.checkpoint or base + '.checkpoint.json', args.input, args.shard)
+    resumed = False if args.no_resume else checkpoint.load()
+    errors_path = args.errors or base + '.errors.ndjson'
+
+    stats = {'read': 0.0, 'validate': 0.0, 'build': 0.0, 'render': 0.0, 'write': 0.0}
+    processed = 0
+    names = {}
+    previous_handler = signal.signal(signal.SIGTERM, _raise_interrupt)
+    sink = open_sink(args.output, checkpoint.part)
+    checkpoint_every = args.checkpoint_every or (CHECKPOINT_EVERY if isinstance(sink, DirectorySink) else ARCHIVE_CHECKPOINT_EVERY)
+    started = time.perf_counter()
+    interrupted = False
+    executor = qr_batch.make_executor('process', args.workers)
+    try:
+        with open(args.input, 'rb') as stream, open(errors_path, 'a' if resumed else 'w', encoding='utf-8') as errors_file:
+            jobs = ((chunk[0][0], qr_batch.process_rows, (chunk, args.png_compression))
+                    for chunk in _chunks(qr_batch.iter_rows(stream, input_format), checkpoint, args.chunk_size, stats, names))
+            for _, future in qr_batch.run_bounded(executor, jobs, max_in_flight=2 * args.workers):
+                for row_number, row, data, error, timings in future.result():
+                    name = names.pop(row_number, None)
+                    for stage, seconds in timings.items(): stats[stage] += seconds
+                    start = time.perf_counter()
+                    if error:
+                        errors_file.write(json.dumps({'row': row_number, **error}, ensure_ascii=False) + '\n')
+                        checkpoint.failed += 1
+                    else:
+                        sink.write(name, data)
+                        checkpoint.generated += 1
+                    stats['write'] += time.perf_counter() - start
+                    checkpoint.mark_done(row_number)
+                    processed += 1
+                    if processed % checkpoint_every == 0:
+                        sink.commit(); errors_file.flush()
+                        checkpoint.part = sink.last_part
+                        checkpoint.save()
+    except KeyboardInterrupt:
+        interrupted = True
+        executor.shutdown(wait=False, cancel_futures=True)
+    finally:
+        sink.close()
+        checkpoint.part = sink.last_part
+        checkpoint.save()
+        signal.signal(signal.SIGTERM, previous_handler)
+    executor.shutdown()
+
+    elapsed = time.perf_counter() - started
+    rate = processed / elapsed if elapsed > 0 else 0.0
+    print(f"{'Interrumpido' if interrupted else 'Completado'}: {processed} filas en {elapsed:.2f}s ({rate:.1f} filas/s); "
+          f"generados {checkpoint.generated}, con error {checkpoint.failed} (acumulado).", file=sys.stderr)
+    print("Tiempo por etapa (los de worker suman el CPU de todos los procesos):", file=sys.stderr)
+    for stage, seconds in stats.items():
+        print(f"  {stage:<9} {seconds:9.3f}s", file=sys.stderr)
+    if interrupted:
+        print(f"Reanude con el mismo comando; checkpoint en {checkpoint.path}.", file=sys.stderr)
+        return 130
+    return 0
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,69 @@
+from qr_payloads import PAYLOAD_TYPES, WIFI_SECURITY_TYPES, is_valid_color_hex
+
+# Campos del formulario de generación y su validación. Sin dependencias de Flask: lo usan
+# tanto las rutas de app.py como la generación masiva (qr_batch.py / qr_cli.py). Los campos de cada
+# tipo de contenido se declaran en qr_payloads.py.
+
+ERROR_LEVELS = {'L': 'L (Low ~7%)', 'M': 'M (Medium ~15%)', 'Q': 'Q (Quartile ~25%)', 'H': 'H (High ~30%)'}
+OUTPUT_FORMATS = {'png': 'PNG', 'svg': 'SVG', 'svgz': 'SVGZ (SVG comprimido)', 'txt': 'TXT (Text Art)'} # HTML no soportado por ahora
+CONTENT_TYPES = {content_type: spec.label for content_type, spec in PAYLOAD_TYPES.items()}
+TEXT_STYLES = {'unicode': 'Unicode (medios bloques)', 'unicode-invert': 'Unicode invertido (terminal oscuro)',
+               'ascii': 'ASCII (##)', 'ascii-invert': 'ASCII invertido'} # Solo para TXT
+
+def validate_generation_form(form_data):
+    # Valida los campos del formulario de /generate (o una fila de /generate/batch o de la CLI, con los
+    # mismos nombres) y devuelve (params, errors). form_data puede ser cualquier mapping con .get().
+    errors = {}
+
+    content_type = form_data.get('content_type', 'url')
+
+    # --- Validación de Parámetros Comunes ---
+    error_correction = form_data.get('error_correction', 'M')
+    if error_correction not in ERROR_LEVELS: errors['error_correction'] = "Nivel de error inválido."
+
+    try: scale = int(form_data.get('scale', '20'))
+    except ValueError: errors['scale'] = "La escala debe ser un número."; scale = 20
+    if not 1 <= scale <= 200: errors['scale'] = "La escala debe estar entre 1 y 200."
+
+    try: border = int(form_data.get('border', '4'))
+    except ValueError: errors['border'] = "El borde debe ser un número."; border = 4
+    if not 0 <= border <= 20: errors['border'] = "El borde debe estar entre 0 y 20."
+
+    dark_color = form_data.get('dark_color', '#000000')
+    if not is_valid_color_hex(dark_color): errors['dark_color'] = "Formato de color oscuro inválido (ej: #RRGGBB)."
+
+    light_color_input = form_data.get('light_color', '#ffffff')
+    is_transparent = form_data.get('transparent_bg') == 'on'
+    light_color = "transparent" if is_transparent else light_color_input
+    if not is_transparent and not is_valid_color_hex(light_color):
+        errors['light_color'] = "Formato de color claro inválido (ej: #RRGGBB)."
+
+    output_format = form_data.get('output_format', 'png')
+    if output_format not in OUTPUT_FORMATS: errors['output_format'] = "Formato de salida inválido."
+
+    text_style = form_data.get('text_style', 'unicode')
+    if text_style not in TEXT_STYLES: errors['text_style'] = "Estilo de texto inválido."
+
+    # Versión y máscara opcionales (vacías = búsqueda automática), p. ej. para lotes de maquetación fija
+    version = mask = None
+    try: version = int(form_data['version']) if form_data.get('version') else None
+    except ValueError: errors['version'] = "La versión debe ser un número."
+    if version is not None and not 1 <= version <= 40: errors['version'] = "La versión debe estar entre 1 y 40."
+    try: mask = int(form_data['mask']) if form_data.get('mask') else None
+    except ValueError: errors['mask'] = "La máscara debe ser un número."
+    if mask is not None and not 0 <= mask <= 7: errors['mask'] = "La máscara debe estar entre 0 y 7."
+
+    # --- Parámetros y Validación Específicos del Tipo de Contenido (ver qr_payloads.py) ---
+    spec = PAYLOAD_TYPES.get(content_type)
+    data_from_form, kwargs_for_generator = '', {}
+    if spec is None: errors['content_type'] = "Tipo de contenido inválido."
+    else: data_from_form, kwargs_for_generator = spec.from_form(form_data, errors)
+
+    enable_tracking = spec is not None and spec.trackable and form_data.get('enable_tracking') == 'on'
+    params = {
+        'content_type': content_type, 'data': data_from_form, 'error_correction': error_correction,
+        'scale': scale, 'border': border, 'dark_color': dark_color, 'light_color': light_color,
+        'output_format': output_format, 'text_style': text_style, 'version': version, 'mask': mask,
+        'enable_tracking': enable_tracking, 'generator_kwargs': kwargs_for_generator
+    }
+    return params, errors
@@ -0,0 +1,208 @@
+import base64
+import functools
+try:
+    import numpy as np
+except ImportError: # Sin NumPy la máscara se elige con best_mask_pattern de python-qrcode
+    np = None
+
+# Matriz de módulos QR separada del rasterizado: se calcula una vez (ajuste de versión,
+# codificación y búsqueda de máscara) y se reutiliza para cualquier formato, escala o color.
+# La versión y la máscara se pueden fijar para saltarse la búsqueda (p. ej. al volver a
+# renderizar una matriz conocida o en un lote de maquetación fija).
+
+# Valores de qrcode.constants.ERROR_CORRECT_*. python-qrcode se importa al construir la primera matriz:
+# su paquete carga PIL, que solo hace falta para renderizar.
+ERROR_CORRECTION = {'L': 1, 'M': 0, 'Q': 3, 'H': 2}
+MATRIX_CACHE_SIZE = 4096
+
+def normalize_error(error):
+    # Mismo criterio que generate_qr_code: niveles desconocidos caen a 'M'
+    error = (error or 'M').upper()
+    return error if error in ERROR_CORRECTION else 'M'
+
+class QRMatrix:
+    # Matriz inmutable y empaquetada a bits: cada fila ocupa (size + 7) // 8 bytes, MSB primero.
+    __slots__ = ('version', 'error', 'mask', 'size', 'bits', '_hash')
+
+    def __init__(self, version, error, mask, size, bits):
+        if len(bits) != size * ((size + 7) // 8):
+            raise ValueError("Longitud de bits incoherente con el tamaño de la matriz.")
+        set_attr = object.__setattr__
+        set_attr(self, 'version', version); set_attr(self, 'error', error); set_attr(self, 'mask', mask)
+        set_attr(self, 'size', size); set_attr(self, 'bits', bytes(bits))
+        set_attr(self, '_hash', hash((version, error, mask, size, self.bits)))
+
+    def __setattr__(self, name, value):
+        raise AttributeError("QRMatrix es inmutable.")
+
+    def __delattr__(self, name):
+        raise AttributeError("QRMatrix es inmutable.")
+
+    def __reduce__(self):
+        # pickle (p. ej. para enviarla a un worker de RenderPool) pasa por __init__, no por __setattr__
+        return (QRMatrix, (self.version, self.error, self.mask, self.size, self.bits))
+
+    @classmethod
+    def from_modules(cls, modules, version, error, mask):
+        size = len(modules)
+        stride = (size + 7) // 8
+        pad = stride * 8 - size
+        packed = bytearray()
+        for row in modules:
+            value = 0
+            for cell in row: value = (value << 1) | (1 if cell else 0)
+            packed += (value << pad).to_bytes(stride, 'big')
+        return cls(version, error, mask, size, packed)
+
+    @property
+    def stride(self):
+        return (self.size + 7) // 8
+
+    def row_bytes(self, r):
+        stride = self.stride
+        return self.bits[r * stride:(r + 1) * stride]
+
+    def is_dark(self, r, c):
+        return bool(self.bits[r * self.stride + (c >> 3)] & (0x80 >> (c & 7)))
+
+    def row(self, r):
+        value = int.from_bytes(self.row_bytes(r), 'big') >> (self.stride * 8 - self.size)
+        size = self.size
+        return [bool(value >> (size - 1 - c) & 1) for c in range(size)]
+
+    def to_modules(self):
+        return [self.row(r) for r in range(self.size)]
+
+    def to_dict(self):
+        # Forma compacta para el cliente (previsualización): las filas empaquetadas tal cual, en base64
+        return {'version': self.version, 'error': self.error, 'mask': self.mask, 'size': self.size,
+                'stride': self.stride, 'bits': base64.b64encode(self.bits).decode('ascii')}
+
+    def __eq__(self, other):
+        if not isinstance(other, QRMatrix): return NotImplemented
+        return (self.version, self.error, self.mask, self.size, self.bits) == \
+               (other.version, other.error, other.mask, other.size, other.bits)
+
+    def __hash__(self):
+        return self._hash
+
+    def __repr__(self):
+        return f'<QRMatrix v{self.version}-{self.error} mask={self.mask} {self.size}x{self.size}>'
+
+# --- Penalización de máscaras (ISO/IEC 18004, 7.8.3) vectorizada ---
+# Mismas reglas y puntuación que qrcode.util.lost_point, pero sobre arrays NumPy completos y con las
+# 8 máscaras derivadas de una sola colocación de datos en lugar de 8 llamadas a makeImpl.
+
+_FINDER_LIKE = ((1, 0, 1, 1, 1, 0, 1, 0, 0, 0, 0), (0, 0, 0, 0, 1, 0, 1, 1, 1, 0, 1))
+
+def _mask_grids(size):
+    # Array (8, size, size): True donde cada máscara invierte el módulo (mismas fórmulas que qrcode.util.mask_func)
+    i, j = np.indices((size, size))
+    return np.stack([(i + j) % 2 == 0, i % 2 == 0, j % 3 == 0, (i + j) % 3 == 0,
+                     (i // 2 + j // 3) % 2 == 0, (i * j) % 2 + (i * j) % 3 == 0,
+                     ((i * j) % 2 + (i * j) % 3) % 2 == 0, ((i * j) % 3 + (i + j) % 2) % 2 == 0])
+
+@functools.lru_cache(maxsize=40)
+def _data_area(version):
+    # (máscaras, zona de datos): la zona de datos son los módulos que ni los patrones fijos ni la
+    # información de formato/versión ocupan, es decir, los únicos a los que se aplica la máscara.
+    import qrcode
+    qr = qrcode.QRCode(version=version)
+    size = qr.modules_count = version * 4 + 17
+    qr.modules = [[None] * size for _ in range(size)]
+    qr.setup_position_probe_pattern(0, 0)
+    qr.setup_position_probe_pattern(size - 7, 0)
+    qr.setup_position_probe_pattern(0, size - 7)
+    qr.setup_position_adjust_pattern()
+    qr.setup_timing_pattern()
+    qr.setup_type_info(True, 0)
+    if version >= 7: qr.setup_type_number(True)
+    data_area = np.array([[cell is None for cell in row] for row in qr.modules])
+    masks = _mask_grids(size)
+    return masks & data_area, data_area
+
+def _run_penalty(modules):
+    # Regla 1 por filas: cada tramo de >= 5 módulos del mismo color suma (longitud - 2)
+    rows, size = modules.shape
+    boundaries = np.ones((rows, size + 1), dtype=bool)
+    boundaries[:, 1:size] = modules[:, 1:] != modules[:, :-1]
+    # El salto entre filas aporta un "tramo" de longitud 1, que nunca puntúa
+    lengths = np.diff(np.flatnonzero(boundaries))
+    long_runs = lengths[lengths >= 5]
+    return int((long_runs - 2).sum())
+
+def _finder_penalty(modules):
+    # Regla 3 por filas: 40 por cada ventana de 11 módulos igual a 1011101 con 4 claros a un lado
+    if modules.shape[1] < 11: return 0
+    windows = np.lib.stride_tricks.sliding_window_view(modules, 11, axis=1)
+    return 40 * int(sum((windows == np.array(pattern, dtype=bool)).all(axis=2).sum() for pattern in _FINDER_LIKE))
+
+def mask_penalty(modules):
+    # Penalización total de una matriz (array booleano); igual que qrcode.util.lost_point
+    modules = np.asarray(modules, dtype=bool)
+    size = len(modules)
+    penalty = _run_penalty(modules) + _run_penalty(modules.T)
+    top_left = modules[:-1, :-1]
+    blocks = (top_left == modules[:-1, 1:]) & (top_left == modules[1:, :-1]) & (top_left == modules[1:, 1:])
+    penalty += 3 * int(blocks.sum())
+    penalty += _finder_penalty(modules) + _finder_penalty(modules.T)
+    percent = float(int(modules.sum())) / (size ** 2)
+    return penalty + int(abs(percent * 100 - 50) / 5) * 10
+
+def best_mask(unmasked, masks):
+    # Máscara de menor penalización (la primera en caso de empate, como best_mask_pattern) a partir
+    # de la colocación de datos sin máscara y las máscaras de _data_area
+    penalties = [mask_penalty(unmasked ^ masks[k]) for k in range(8)]
+    return penalties.index(min(penalties))
+
+def _place(qr, mask):
+    # Equivale a makeImpl(False, mask) (+ la búsqueda de máscara si mask es None) con una sola
+    # colocación de datos en Python; devuelve (array booleano, máscara)
+    qr.makeImpl(True, 0) # Información de formato/versión en blanco, como en best_mask_pattern
+    masks, _ = _data_area(qr.version)
+    unmasked = np.array(qr.modules, dtype=bool) ^ masks[0]
+    if mask is None: mask = best_mask(unmasked, masks)
+    qr.modules = (unmasked ^ masks[mask]).tolist()
+    qr.setup_type_info(False, mask)
+    if qr.version >= 7: qr.setup_type_number(False)
+    return np.array(qr.modules, dtype=bool), mask
+
+def build_matrix(payload, error='M', version=None, mask=None):
+    # Equivale a QRCode.make(fit=True), pero conservando la máscara elegida. Con version y/o mask
+    # fijados se salta el ajuste de versión y/o la búsqueda de máscara.
+    import qrcode
+    from qrcode.exceptions import DataOverflowError
+    error = normalize_error(error)
+    if version is not None and not 1 <= version <= 40: raise ValueError("La versión debe estar entre 1 y 40.")
+    if mask is not None and not 0 <= mask <= 7: raise ValueError("La máscara debe estar entre 0 y 7.")
+    qr = qrcode.QRCode(version=version, error_correction=ERROR_CORRECTION[error], border=0)
+    qr.add_data(payload)
+    try:
+        if version is None: qr.best_fit()
+        if np is None:
+            if mask is None: mask = qr.best_mask_pattern()
+            qr.makeImpl(False, mask)
+            return QRMatrix.from_modules(qr.modules, qr.version, error, mask)
+        modules, mask = _place(qr, mask)
+    except DataOverflowError:
+        raise ValueError(f"El contenido no cabe en la versión {version} con corrección {error}." if version
+                         else "El contenido es demasiado largo para un código QR.")
+    return QRMatrix(qr.version, error, mask, len(modules), np.packbits(modules, axis=1).tobytes())
+
+@functools.lru_cache(maxsize=MATRIX_CACHE_SIZE)
+def _cached_matrix(payload, error, version, mask):
+    return build_matrix(payload, error, version, mask)
+
+def get_matrix(payload, error='M', version=None, mask=None):
+    # Versión cacheada de build_matrix, con clave (payload, nivel ECC, versión, máscara)
+    return _cached_matrix(str(payload), normalize_error(error), version, mask)
+
+def matrix_cache_info():
+    return _cached_matrix.cache_info()
+
+def clear_matrix_cache():
+    _cached_matrix.cache_clear()
+
+def warm_up(versions=range(1, 41)):
+    # Precalcula las zonas de datos y máscaras (~200 ms y ~3,4 MB para las 40 versiones); ver app.warm_up
+    for version in versions: _data_area(version)
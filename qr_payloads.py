@@ -0,0 +1,360 @@
+import datetime
+import re
+import urllib.parse
+
+# Registro de tipos de contenido (content_type). Cada tipo se declara una sola vez con un PayloadSpec:
+# sus campos (nombre en la API de biblioteca, parámetro del constructor y nombre en el formulario),
+# los validadores y el constructor del string a codificar. A partir de esa declaración:
+# - qr_forms.validate_generation_form valida el formulario de /generate y las filas de lote;
+# - qr_generator_logic.construir_payload construye el payload desde los kwargs de la biblioteca.
+# Los validadores (expresiones regulares, fechas, IBAN) se compilan al importar el módulo.
+# Un tipo nuevo solo necesita su constructor y un register_payload_type(PayloadSpec(...)).
+
+_HEX_COLOR_RE = re.compile(r'#[0-9a-fA-F]{6}')
+_DATE_RE = re.compile(r'(\d{4})-?(\d{2})-?(\d{2})') # YYYY-MM-DD o YYYYMMDD
+_IBAN_RE = re.compile(r'[A-Z]{2}[0-9]{2}[A-Z0-9]{11,30}')
+_IBAN_CLEANUP = str.maketrans('', '', ' -')
+_IBAN_DIGITS = str.maketrans({c: str(n) for n, c in enumerate('ABCDEFGHIJKLMNOPQRSTUVWXYZ', 10)})
+
+def is_valid_color_hex(s):
+    return bool(s) and _HEX_COLOR_RE.fullmatch(s) is not None
+
+def parse_date(value):
+    # datetime.date desde YYYY-MM-DD o YYYYMMDD; None si no es una fecha válida
+    match = _DATE_RE.fullmatch(value) if value else None
+    if match is None: return None
+    try: return datetime.date(*map(int, match.groups()))
+    except ValueError: return None
+
+def normalize_iban(value):
+    # IBAN sin espacios ni guiones, en mayúsculas, con formato y dígitos de control (mod 97) válidos
+    iban = value.translate(_IBAN_CLEANUP).upper()
+    if not _IBAN_RE.fullmatch(iban): raise ValueError(value)
+    if int((iban[4:] + iban[:4]).translate(_IBAN_DIGITS)) % 97 != 1: raise ValueError(value)
+    return iban
+
+# --- Funciones para construir strings de datos estructurados ---
+def construir_vcard_string(**kwargs):
+    lines = ["BEGIN:VCARD", "VERSION:3.0"]
+    n_parts = []
+    lastname = kwargs.get('lastname')
+    firstname = kwargs.get('firstname')
+    if lastname: n_parts.append(lastname)
+    if firstname: n_parts.append(firstname)
+
+    displayname = kwargs.get('displayname')
+    final_fn = None
+    # FN es obligatorio. Si no se da displayname, construirlo.
+    if displayname: final_fn = displayname
+    elif firstname and lastname: final_fn = f"{firstname} {lastname}".strip()
+    elif firstname: final_fn = firstname
+    elif lastname: final_fn = lastname
+    elif kwargs.get('name'): final_fn = kwargs.get('name').replace(';', ' ').strip()
+
+    if not final_fn: raise ValueError("vCard requiere FN (displayname o firstname/lastname).")
+    lines.append(f"FN:{final_fn}")
+
+    final_n = None
+    if kwargs.get('name'): final_n = kwargs.get('name')
+    elif lastname or firstname: final_n = f"{lastname or ''};{firstname or ''}"
+
+    if final_n: lines.append(f"N:{final_n}")
+    elif final_fn: lines.append(f"N:{final_fn.replace(' ',';',1)}")
+
+    if kwargs.get('org'): lines.append(f"ORG:{kwargs.get('org')}")
+    if kwargs.get('title'): lines.append(f"TITLE:{kwargs.get('title')}")
+    if kwargs.get('nickname'): lines.append(f"NICKNAME:{kwargs.get('nickname')}")
+    if kwargs.get('email'): lines.append(f"EMAIL;TYPE=INTERNET:{kwargs.get('email')}")
+    if kwargs.get('url'): lines.append(f"URL:{kwargs.get('url')}")
+    if kwargs.get('phone'): lines.append(f"TEL;TYPE=WORK,VOICE:{kwargs.get('phone')}")
+    if kwargs.get('mobile'): lines.append(f"TEL;TYPE=CELL,VOICE:{kwargs.get('mobile')}")
+    if kwargs.get('homephone'): lines.append(f"TEL;TYPE=HOME,VOICE:{kwargs.get('homephone')}")
+    if kwargs.get('fax'): lines.append(f"TEL;TYPE=FAX:{kwargs.get('fax')}")
+
+    adr_str_parts = []
+    if kwargs.get('street'): adr_str_parts.append(kwargs.get('street'))
+    if kwargs.get('city'): adr_str_parts.append(kwargs.get('city'))
+    if kwargs.get('region'): adr_str_parts.append(kwargs.get('region'))
+    if kwargs.get('zipcode'): adr_str_parts.append(kwargs.get('zipcode'))
+    if kwargs.get('country'): adr_str_parts.append(kwargs.get('country'))
+    final_adr = kwargs.get('address')
+    if not final_adr and adr_str_parts:
+        final_adr = ";".join(["", "", *adr_str_parts])
+    if final_adr: lines.append(f"ADR;TYPE=WORK:{final_adr if isinstance(final_adr, str) else ';'.join(filter(None,final_adr))}")
+
+    bday = parse_date(kwargs.get('birthday'))
+    if bday: lines.append(f"BDAY:{bday.isoformat()}")
+    if kwargs.get('note'): lines.append(f"NOTE:{kwargs.get('note')}")
+    lines.append("END:VCARD")
+    return "\r\n".join(lines)
+
+def construir_mecard_string(**kwargs):
+    lines = ["MECARD:"]
+    name_val = None; firstname = kwargs.get('firstname'); lastname = kwargs.get('lastname')
+    if kwargs.get('name'): name_val = kwargs.get('name')
+    elif lastname and firstname: name_val = f"{lastname},{firstname}"
+    elif lastname: name_val = lastname
+    elif firstname: name_val = firstname
+    if not name_val: raise ValueError("MeCard requiere 'name' (o firstname/lastname).")
+    lines.append(f"N:{name_val};")
+
+    if kwargs.get('reading'): lines.append(f"SOUND:{kwargs.get('reading')};")
+    if kwargs.get('nickname'): lines.append(f"NICKNAME:{kwargs.get('nickname')};")
+    if kwargs.get('phone'): lines.append(f"TEL:{kwargs.get('phone')};")
+    if kwargs.get('email'): lines.append(f"EMAIL:{kwargs.get('email')};")
+    if kwargs.get('url'): lines.append(f"URL:{kwargs.get('url')};")
+    if kwargs.get('memo'): lines.append(f"NOTE:{kwargs.get('memo')};")
+
+    adr_str_parts = [];
+    if kwargs.get('street'): adr_str_parts.append(kwargs.get('street'))
+    if kwargs.get('city'): adr_str_parts.append(kwargs.get('city'))
+    if kwargs.get('address'): adr_str_parts = [kwargs.get('address')]
+    elif adr_str_parts: adr_str_parts = [", ".join(filter(None,adr_str_parts))]
+    if adr_str_parts: lines.append(f"ADR:{adr_str_parts[0]};")
+
+    bday = parse_date(kwargs.get('birthday'))
+    if bday: lines.append(f"BDAY:{bday:%Y%m%d};")
+    lines.append(";")
+    return "".join(lines)
+
+def construir_wifi_string(ssid, password, security, hidden=False):
+    if not ssid: raise ValueError("SSID no puede ser vacío para WiFi QR.")
+    sec_type = "WPA";
+    if security and security.upper() in ["WPA", "WPA2", "WEP"]: sec_type = security.upper()
+    elif not password: sec_type = "nopass"
+    elements = [f"S:{ssid}", f"T:{sec_type}"]
+    if password: elements.append(f"P:{password}")
+    if hidden: elements.append("H:true")
+    return "WIFI:" + ";".join(elements) + ";;"
+
+def construir_email_string(to, subject=None, body=None):
+    if not to: raise ValueError("Email 'to' no puede ser vacío.")
+    actual_data = f"mailto:{to}"; params = {}
+    if subject: params['subject'] = subject
+    if body: params['body'] = body
+    if params: actual_data += f"?{urllib.parse.urlencode(params, quote_via=urllib.parse.quote)}"
+    return actual_data
+
+def construir_sms_string(to, body=None):
+    if not to: raise ValueError("SMS 'to' no puede ser vacío.")
+    actual_data = f"SMSTO:{to}"
+    if body: actual_data += f":{body}"
+    return actual_data
+
+def construir_tel_string(number):
+    if not number: raise ValueError("Número de teléfono no puede ser vacío.")
+    return f"tel:{number}"
+
+def construir_geo_string(latitude, longitude, query=None):
+    try: lat = float(latitude); lon = float(longitude)
+    except ValueError: raise ValueError("Latitud y longitud deben ser números.")
+    actual_data = f"geo:{lat},{lon}"
+    if query: actual_data += f"?q={urllib.parse.quote(query)}"
+    return actual_data
+
+def construir_event_string(summary, dtstart, dtend, description=None, location=None, allday=False):
+    def format_ical_datetime(dt, is_allday_event):
+        dt_obj = None
+        if isinstance(dt, str):
+            try: dt_obj = datetime.datetime.fromisoformat(dt)
+            except ValueError:
+                try: dt_obj = datetime.datetime.strptime(dt, '%Y%m%dT%H%M%S')
+                except ValueError:
+                    try: dt_obj = datetime.datetime.strptime(dt, '%Y%m%d')
+                    except ValueError: raise ValueError(f"Formato de fecha/hora no reconocido: {dt}")
+        elif isinstance(dt, datetime.datetime): dt_obj = dt
+        elif isinstance(dt, datetime.date): dt_obj = datetime.datetime.combine(dt, datetime.time.min)
+        else: raise ValueError(f"Tipo de fecha/hora no válido: {type(dt)}")
+        if is_allday_event: return dt_obj.strftime('%Y%m%d')
+        return dt_obj.strftime('%Y%m%dT%H%M%S')
+
+    if not summary or not dtstart or not dtend: raise ValueError("Evento requiere summary, dtstart y dtend.")
+    event_lines = ["BEGIN:VEVENT", f"SUMMARY:{summary}"]
+    dtstart_formatted = format_ical_datetime(dtstart, allday)
+    dtend_formatted = format_ical_datetime(dtend, allday)
+    dt_start_obj_for_end_calc = datetime.datetime.strptime(dtstart_formatted[:8], '%Y%m%d')
+    if allday:
+        event_lines.append(f"DTSTART;VALUE=DATE:{dtstart_formatted}")
+        dt_end_obj_for_allday = datetime.datetime.strptime(dtend_formatted[:8], '%Y%m%d')
+        if dt_end_obj_for_allday <= dt_start_obj_for_end_calc:
+             dt_end_obj_for_allday = dt_start_obj_for_end_calc + datetime.timedelta(days=1)
+        event_lines.append(f"DTEND;VALUE=DATE:{dt_end_obj_for_allday.strftime('%Y%m%d')}")
+    else:
+        event_lines.append(f"DTSTART:{dtstart_formatted}"); event_lines.append(f"DTEND:{dtend_formatted}")
+    if description: event_lines.append(f"DESCRIPTION:{description.replace(chr(10), chr(92)+'n')}")
+    if location: event_lines.append(f"LOCATION:{location.replace(chr(10), chr(92)+'n')}")
+    event_lines.append("END:VEVENT"); ical_content = "\r\n".join(event_lines)
+    return f"BEGIN:VCALENDAR\r\nVERSION:2.0\r\nPRODID:-//QR Generator//EN\r\n{ical_content}\r\nEND:VCALENDAR"
+
+def construir_epc_string(name, iban, amount, currency='EUR', bic=None, purpose=None, reference=None, remittance=None):
+    if not name or not iban or not amount: raise ValueError("EPC requiere name, iban y amount.")
+    elements = [ "BCD", "002", "1", "SCT", bic or "", name, iban, f"{currency.upper()}{amount}",
+                 purpose or "", reference or "", remittance or "", "" ]
+    return "\n".join(elements).replace("\n\n","\n").strip()
+
+# --- Registro de tipos de contenido ---
+
+WIFI_SECURITY_TYPES = {'': 'None (Open)', 'WPA': 'WPA/WPA2', 'WEP': 'WEP'}
+
+class Field:
+    # `key`: nombre en los kwargs de la biblioteca (o dentro del dict `params_key` del tipo),
+    # `arg`: parámetro del constructor, `form_key`: nombre en el formulario y en las filas de lote.
+    # `required` es el mensaje de error si falta (None = opcional); `parse` convierte/valida el valor
+    # del formulario y lanza ValueError (mensaje `invalid`) si no es válido.
+    __slots__ = ('key', 'arg', 'form_key', 'required', 'parse', 'invalid', 'default', 'error_key')
+
+    def __init__(self, key, arg=None, form_key=None, required=None, parse=None, invalid=None, default=None,
+                 error_key=None):
+        self.key = key
+        self.arg = arg or key
+        self.form_key = form_key or key
+        self.required = required
+        self.parse = parse
+        self.invalid = invalid
+        self.default = default
+        self.error_key = error_key or self.form_key
+
+    def from_form(self, form_data, errors):
+        value = form_data.get(self.form_key)
+        if not value or (self.required and not value.strip()):
+            if self.required: errors[self.error_key] = self.required
+            return self.default
+        if self.parse is None: return value
+        try: return self.parse(value)
+        except ValueError:
+            errors[self.error_key] = self.invalid
+            return self.default
+
+class PayloadSpec:
+    # Un tipo de contenido. Sin `builder`, el payload es el campo de datos (`data_field`) tal cual.
+    # Con `params_key`, la biblioteca recibe los campos agrupados en un dict (p. ej. vcard_params=...)
+    # y se pasan completos al constructor. `check(values, errors)` añade validaciones entre campos.
+    __slots__ = ('content_type', 'label', 'fields', 'builder', 'data_field', 'params_key', 'check', 'trackable',
+                 '_args')
+
+    def __init__(self, content_type, label, fields=(), builder=None, data_field=None, params_key=None, check=None,
+                 trackable=False):
+        self.content_type = content_type
+        self.label = label
+        self.fields = tuple(fields)
+        self.builder = builder
+        self.data_field = data_field
+        self.params_key = params_key
+        self.check = check
+        self.trackable = trackable
+        self._args = tuple((f.key, f.arg, f.default) for f in self.fields)
+
+    def from_form(self, form_data, errors):
+        # Devuelve (data, kwargs para construir_payload) y deja los errores en `errors`
+        data = self.data_field.from_form(form_data, errors) if self.data_field is not None else ''
+        values = {}
+        for field in self.fields:
+            value = field.from_form(form_data, errors)
+            if value is not None: values[field.key] = value
+        if self.check is not None: self.check(values, errors)
+        return data, ({self.params_key: values} if self.params_key else values)
+
+    def build(self, data, kwargs):
+        if self.builder is None: return data
+        if self.params_key: return self.builder(**(kwargs.get(self.params_key) or {}))
+        return self.builder(**{arg: kwargs.get(key, default) for key, arg, default in self._args})
+
+PAYLOAD_TYPES = {}
+
+def register_payload_type(spec):
+    PAYLOAD_TYPES[spec.content_type] = spec
+    return spec
+
+def get_payload_type(content_type):
+    return PAYLOAD_TYPES.get(content_type)
+
+def _http_url(value):
+    if not value.startswith(('http://', 'https://')): raise ValueError(value)
+    return value
+
+def _checked(value):
+    return value == 'on'
+
+def _choice(choices):
+    def parse(value):
+        if value not in choices: raise ValueError(value)
+        return value
+    return parse
+
+def _amount(value):
+    float(value) # Solo se valida: el EPC lleva el importe tal como se escribió
+    return value
+
+def _check_wifi(values, errors):
+    if not values.get('wifi_password') and values.get('wifi_security') in ('WPA', 'WEP'):
+        errors['wifi_password'] = "Se requiere contraseña para seguridad WPA/WEP."
+
+def _check_vcard(values, errors):
+    if not (values.get('firstname') or values.get('lastname') or values.get('displayname')):
+        errors['vcard_name'] = "Se requiere Nombre, Apellido o Nombre a Mostrar para vCard."
+
+def _check_mecard(values, errors):
+    if not (values.get('firstname') or values.get('lastname')):
+        errors['mecard_name'] = "Se requiere Nombre o Apellido para MeCard."
+
+def _check_event(values, errors):
+    start, end = values.get('event_start'), values.get('event_end')
+    if start and end and end <= start:
+        errors['event_end_datetime'] = "La fecha de fin debe ser posterior a la de inicio."
+
+def _contact_fields(prefix, names):
+    # Campos de vCard/MeCard: clave del constructor -> sufijo del nombre en el formulario
+    return [Field(key, form_key=f"{prefix}_{suffix}") for key, suffix in names]
+
+_INVALID_DATETIME = "Formato de fecha/hora de evento inválido."
+
+register_payload_type(PayloadSpec('url', 'URL', trackable=True, data_field=Field(
+    'data', form_key='data_url', default='', parse=_http_url,
+    required="Se requiere una URL válida (http:// o https://).", invalid="Se requiere una URL válida (http:// o https://).")))
+register_payload_type(PayloadSpec('text', 'Text', data_field=Field(
+    'data', form_key='data_text', default='', required="El texto no puede estar vacío.")))
+register_payload_type(PayloadSpec('wifi', 'WiFi', builder=construir_wifi_string, check=_check_wifi, fields=[
+    Field('wifi_ssid', 'ssid', required="SSID es obligatorio."),
+    Field('wifi_password', 'password'),
+    Field('wifi_security', 'security', default='', parse=_choice(WIFI_SECURITY_TYPES), invalid="Tipo de seguridad WiFi inválido."),
+    Field('wifi_hidden', 'hidden', default=False, parse=_checked)]))
+register_payload_type(PayloadSpec('vcard', 'vCard (Contact)', builder=construir_vcard_string, params_key='vcard_params',
+                                  check=_check_vcard, fields=_contact_fields('vcard', [
+    ('firstname', 'firstname'), ('lastname', 'lastname'), ('displayname', 'displayname'), ('email', 'email'),
+    ('phone', 'phone_work'), ('mobile', 'phone_mobile'), ('homephone', 'phone_home'), ('fax', 'fax'),
+    ('org', 'company'), ('title', 'jobtitle'), ('address', 'address_full'), ('street', 'street'), ('city', 'city'),
+    ('region', 'region'), ('zipcode', 'postcode'), ('country', 'country'), ('url', 'website'),
+    ('birthday', 'birthday'), ('note', 'note'), ('nickname', 'nickname')])))
+register_payload_type(PayloadSpec('mecard', 'MeCard (Contact)', builder=construir_mecard_string, params_key='mecard_params',
+                                  check=_check_mecard, fields=_contact_fields('mecard', [
+    ('firstname', 'firstname'), ('lastname', 'lastname'), ('reading', 'reading'), ('nickname', 'nickname'),
+    ('email', 'email'), ('phone', 'phone'), ('address', 'address'), ('birthday', 'birthday_formatted'),
+    ('url', 'url'), ('memo', 'memo')])))
+register_payload_type(PayloadSpec('email', 'Email', builder=construir_email_string, fields=[
+    Field('email_to', 'to', required="Email 'Para' es obligatorio."),
+    Field('email_subject', 'subject'), Field('email_body', 'body')]))
+register_payload_type(PayloadSpec('sms', 'SMS', builder=construir_sms_string, fields=[
+    Field('sms_to', 'to', required="Número SMS 'Para' es obligatorio."), Field('sms_body', 'body')]))
+register_payload_type(PayloadSpec('tel', 'Telephone', builder=construir_tel_string, fields=[
+    Field('tel_number', 'number', required="Número de teléfono es obligatorio.")]))
+register_payload_type(PayloadSpec('event', 'Event (iCalendar)', builder=construir_event_string, check=_check_event, fields=[
+    Field('event_summary', 'summary', required="Título del evento es obligatorio."),
+    Field('event_start', 'dtstart', form_key='event_start_datetime', parse=datetime.datetime.fromisoformat, # datetime-local
+          required="Fecha/hora de inicio es obligatoria.", invalid=_INVALID_DATETIME),
+    Field('event_end', 'dtend', form_key='event_end_datetime', parse=datetime.datetime.fromisoformat,
+          required="Fecha/hora de fin es obligatoria.", invalid=_INVALID_DATETIME),
+    Field('event_description', 'description'), Field('event_location', 'location'),
+    Field('event_allday', 'allday', default=False, parse=_checked)]))
+register_payload_type(PayloadSpec('geo', 'Geo Location', builder=construir_geo_string, fields=[
+    Field('geo_latitude', 'latitude', parse=float, error_key='geo_coords',
+          required="Latitud y Longitud son obligatorios.", invalid="Latitud y Longitud deben ser números."),
+    Field('geo_longitude', 'longitude', parse=float, error_key='geo_coords',
+          required="Latitud y Longitud son obligatorios.", invalid="Latitud y Longitud deben ser números."),
+    Field('geo_query', 'query')]))
+register_payload_type(PayloadSpec('epc', 'EPC (Payment)', builder=construir_epc_string, fields=[
+    Field('epc_name', 'name', required="Nombre del beneficiario EPC es obligatorio."),
+    Field('epc_iban', 'iban', parse=normalize_iban, required="IBAN EPC es obligatorio.", invalid="IBAN EPC inválido."),
+    Field('epc_amount', 'amount', parse=_amount, required="Importe EPC es obligatorio.",
+          invalid="Importe EPC debe ser un número."),
+    Field('epc_currency', 'currency', default='EUR'), Field('epc_bic', 'bic'), Field('epc_purpose', 'purpose'),
+    Field('epc_reference', 'reference'), Field('epc_remittance', 'remittance')]))
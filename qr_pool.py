@@ -0,0 +1,129 @@
+import concurrent.futures
+import os
+import threading
+
+from qr_metrics import stage
+from qr_render import render_matrix
+
+# Pool de procesos para los renders de /generate: el rasterizado y la compresión son CPU (numpy, PIL,
+# zlib y Python) y en el hilo de la petición el GIL los serializa con el resto de peticiones.
+# - Solo viajan la matriz (bits empaquetados, ~4 KB en versión 40) y las opciones; vuelven bytes.
+# - Cola acotada: como mucho workers + max_queue trabajos aceptados; el siguiente recibe PoolBusyError
+#   (la app responde 503 con Retry-After) en lugar de esperar detrás de renders lentos.
+# - Timeout por trabajo: quien espera deja de hacerlo y recibe PoolBusyError. El trabajo sigue ocupando
+#   su hueco hasta que termina, así que un worker atascado reduce la capacidad en vez de ampliar la cola.
+# - Reciclado: tras max_jobs_per_worker trabajos por worker se crea un pool nuevo y el anterior se cierra
+#   cuando acaba lo pendiente, para contener el crecimiento de memoria de los workers.
+# - Renders baratos (render_cost <= inline_max_cost) se hacen en línea: no compensan el coste del IPC.
+
+VECTOR_FORMATS = ('svg', 'svgz', 'txt')
+
+class PoolBusyError(RuntimeError):
+    def __init__(self, message, retry_after=1):
+        super().__init__(message)
+        self.retry_after = retry_after
+
+def render_cost(matrix, scale=10, border=4, output_format='png'):
+    # Estimación del trabajo de un render: píxeles de la imagen; SVG/SVGZ/TXT no dependen de la escala
+    dimension = matrix.size + 2 * border
+    if output_format in VECTOR_FORMATS: return dimension * dimension
+    return (dimension * scale) ** 2
+
+def render_job(matrix, options):
+    # Se ejecuta en el worker
+    return render_matrix(matrix, **options).getvalue()
+
+class RenderPool:
+    def __init__(self, workers=None, max_queue=None, timeout=30.0, max_jobs_per_worker=None,
+                 inline_max_cost=250_000, retry_after=1, kind='process'):
+        # workers=0 desactiva el pool: todo se renderiza en línea
+        self.workers = (os.cpu_count() or 1) if workers is None else workers
+        self.max_queue = 2 * self.workers if max_queue is None else max_queue
+        self.timeout = timeout
+        self.max_jobs_per_worker = max_jobs_per_worker
+        self.inline_max_cost = inline_max_cost
+        self.retry_after = retry_after
+        self.kind = kind
+        self._slots = threading.BoundedSemaphore(max(1, self.workers + self.max_queue))
+        self._lock = threading.Lock()
+        self._executor = None
+        self._generation_jobs = 0
+        self.inline = self.submitted = self.rejected = self.timeouts = self.recycles = self.restarts = 0
+        self.in_flight = 0
+
+    def _make_executor(self):
+        if self.kind == 'thread': return concurrent.futures.ThreadPoolExecutor(max_workers=self.workers)
+        return concurrent.futures.ProcessPoolExecutor(max_workers=self.workers)
+
+    def _submit(self, matrix, options):
+        with self._lock:
+            limit = self.max_jobs_per_worker and self.max_jobs_per_worker * self.workers
+            if self._executor is not None and limit and self._generation_jobs >= limit:
+                self._executor.shutdown(wait=False) # Los trabajos ya enviados terminan en el pool viejo
+                self._executor = None
+                self.recycles += 1
+            if self._executor is None:
+                self._executor = self._make_executor()
+                self._generation_jobs = 0
+            try:
+                future = self._executor.submit(render_job, matrix, options)
+            except concurrent.futures.BrokenExecutor:
+                # Un worker murió sin trabajo en curso (p. ej. OOM entre trabajos): el pool roto se
+                # descarta y el trabajo se reintenta una vez en uno nuevo
+                self._executor.shutdown(wait=False)
+                self._executor = self._make_executor()
+                self._generation_jobs = 0
+                self.restarts += 1
+                future = self._executor.submit(render_job, matrix, options)
+            self._generation_jobs += 1
+            self.submitted += 1
+            self.in_flight += 1
+            return self._executor, future
+
+    def _release(self, future):
+        with self._lock: self.in_flight -= 1
+        self._slots.release()
+
+    def _restart(self, executor):
+        # Un worker murió (p. ej. por OOM) durante el trabajo y el pool quedó roto: el siguiente trabajo
+        # crea uno nuevo (si muere estando ocioso, lo sustituye _submit)
+        with self._lock:
+            if self._executor is executor:
+                self._executor = None
+                self.restarts += 1
+        executor.shutdown(wait=False)
+
+    def render(self, matrix, options):
+        # options: argumentos de render_matrix (output_format, scale, border, colores, text_style)
+        cost = render_cost(matrix, options.get('scale', 10), options.get('border', 4), options.get('output_format', 'png'))
+        if self.workers == 0 or cost <= self.inline_max_cost:
+            with self._lock: self.inline += 1
+            return render_job(matrix, options)
+        if not self._slots.acquire(blocking=False):
+            with self._lock: self.rejected += 1
+            raise PoolBusyError("Servidor ocupado generando otros códigos QR; reintente en unos segundos.", self.retry_after)
+        try:
+            executor, future = self._submit(matrix, options)
+        except BaseException:
+            self._slots.release()
+            raise
+        future.add_done_callback(self._release)
+        try:
+            with stage('pool'): return future.result(timeout=self.timeout)
+        except concurrent.futures.TimeoutError:
+            future.cancel() # Si aún estaba en cola, libera su hueco
+            with self._lock: self.timeouts += 1
+            raise PoolBusyError("La generación del código QR tardó demasiado; reintente más tarde.", self.retry_after)
+        except concurrent.futures.BrokenExecutor:
+            self._restart(executor)
+            raise
+
+    def stats(self):
+        with self._lock:
+            return {'workers': self.workers, 'max_queue': self.max_queue, 'in_flight': self.in_flight,
+                    'inline': self.inline, 'submitted': self.submitted, 'rejected': self.rejected,
+                    'timeouts': self.timeouts, 'recycles': self.recycles, 'restarts': self.restarts}
+
+    def shutdown(self, wait=True):
+        with self._lock: executor, self._executor = self._executor, None
+        if executor is not None: executor.shutdown(wait=wait)
@@ -0,0 +1,323 @@
+import gzip
+import html
+import struct
+import zlib
+from io import BytesIO
+try:
+    import numpy as np
+except ImportError: # Sin NumPy se usa siempre StyledPilImage
+    np = None
+
+from qr_matrix import ERROR_CORRECTION
+from qr_metrics import stage
+
+# Renderers que trabajan sobre un QRMatrix ya calculado (ver qr_matrix.py).
+# Ninguno vuelve a ajustar versión ni a buscar máscara.
+# PIL y las image factories de python-qrcode se importan en el primer render que las usa (rasterizado
+# con PIL, module_drawer, formatos distintos de PNG): PNG en streaming, SVG, SVGZ y TXT no las cargan,
+# así que importar este módulo (y app.py) no paga su coste.
+
+PIL_FORMATS = {'png': 'PNG', 'jpeg': 'JPEG', 'jpg': 'JPEG', 'bmp': 'BMP', 'gif': 'GIF'}
+
+def _qrcode_from_matrix(matrix, scale, border):
+    # QRCode "ya compilado" para reutilizar las image factories de python-qrcode
+    import qrcode
+    qr_obj = qrcode.QRCode(version=matrix.version, error_correction=ERROR_CORRECTION[matrix.error],
+                           box_size=scale, border=border, mask_pattern=matrix.mask)
+    qr_obj.modules = matrix.to_modules()
+    qr_obj.modules_count = matrix.size
+    qr_obj.data_cache = () # Cualquier valor distinto de None evita que make_image recompile
+    return qr_obj
+
+def _row_runs(matrix):
+    # Por fila, lista de tramos oscuros (x, ancho) en coordenadas de módulo sin borde
+    if np is not None:
+        modules = _module_array(matrix, 0)
+        edges = np.diff(np.pad(modules, ((0, 0), (1, 1))).astype(np.int8), axis=1)
+        for r in range(matrix.size):
+            starts = np.flatnonzero(edges[r] == 1); ends = np.flatnonzero(edges[r] == -1)
+            yield list(zip(starts.tolist(), (ends - starts).tolist()))
+        return
+    for r in range(matrix.size):
+        runs, start = [], None
+        for c, dark in enumerate(matrix.row(r) + [False]):
+            if dark and start is None: start = c
+            elif not dark and start is not None:
+                runs.append((start, c - start)); start = None
+        yield runs
+
+def svg_path_data(matrix, border=0):
+    # Un subpath por fila con un segmento por tramo oscuro: se dibuja con trazo de 1 módulo centrado en
+    # y + 0.5 (extremos "butt"), así cada tramo es "m<salto> 0h<ancho>" en lugar de un rectángulo de 4 lados.
+    parts = []
+    for y, runs in enumerate(_row_runs(matrix)):
+        cursor = None
+        for x, width in runs:
+            parts.append(f"M{x + border} {y + border}.5h{width}" if cursor is None else f"m{x - cursor} 0h{width}")
+            cursor = x + width
+    return ''.join(parts)
+
+def _svg_length(value):
+    return f"{value:.2f}".rstrip('0').rstrip('.')
+
+def render_svg(matrix, scale=10, border=4, dark_color='#000000', light_color='#ffffff', out=None, compress=False):
+    # SVG escrito directamente en el buffer (sin DOM): un único <path> con los tramos horizontales de
+    # módulos oscuros (ver svg_path_data). Unidades del viewBox = módulos; el tamaño físico sigue el de SvgPathImage
+    # (scale / 10 mm por módulo). Con compress=True se escribe SVGZ (gzip determinista, mtime=0).
+    out = out if out is not None else BytesIO()
+    stream = gzip.GzipFile(fileobj=out, mode='wb', mtime=0) if compress else out
+    dimension = matrix.size + 2 * border
+    physical = _svg_length(dimension * scale / 10)
+    stream.write((f'<?xml version="1.0" encoding="UTF-8"?>\n<svg xmlns="http://www.w3.org/2000/svg" version="1.1" '
+                  f'width="{physical}mm" height="{physical}mm" viewBox="0 0 {dimension} {dimension}">').encode('utf-8'))
+    if light_color and light_color.lower() != 'transparent':
+        stream.write(f'<rect width="{dimension}" height="{dimension}" fill="{html.escape(light_color)}"/>'.encode('utf-8'))
+    stream.write(f'<path stroke="{html.escape(dark_color or "#000000")}" stroke-width="1" fill="none" '
+                 f'shape-rendering="crispEdges" d="'.encode('utf-8'))
+    stream.write(svg_path_data(matrix, border).encode('ascii'))
+    stream.write(b'"/></svg>\n')
+    if compress: stream.close() # Cierra solo el gzip y escribe su cola; out sigue abierto
+    return out
+
+# Texto: 'unicode' empaqueta dos filas de módulos por línea con medios bloques (mismos caracteres que
+# print_ascii, oscuro = tinta); 'ascii' usa '##' por módulo oscuro, una fila por línea. Los estilos
+# '-invert' intercambian tinta y fondo para terminales con fondo oscuro.
+TEXT_STYLES = ('unicode', 'unicode-invert', 'ascii', 'ascii-invert')
+_NEWLINE = 4 # Código de fin de línea en la cadena de códigos
+_HALF_BLOCKS = ('\xa0', '\u2580', '\u2584', '\u2588') # Índice = arriba + 2 * abajo (1 = oscuro)
+TEXT_TABLES = {
+    'unicode': str.maketrans({**dict(enumerate(_HALF_BLOCKS)), _NEWLINE: '\n'}),
+    'unicode-invert': str.maketrans({**dict(enumerate(reversed(_HALF_BLOCKS))), _NEWLINE: '\n'}),
+    'ascii': str.maketrans({0: '  ', 1: '##', _NEWLINE: '\n'}),
+    'ascii-invert': str.maketrans({0: '##', 1: '  ', _NEWLINE: '\n'}),
+}
+
+def _text_codes(matrix, border, half_blocks, pad):
+    # Cadena con un código por carácter de salida (ver TEXT_TABLES) y _NEWLINE al final de cada línea.
+    # Con medios bloques, una fila impar final se completa con `pad` (en blanco una vez traducida).
+    if np is not None:
+        modules = _module_array(matrix, border)
+        if half_blocks:
+            if len(modules) % 2: modules = np.vstack([modules, np.full((1, modules.shape[1]), pad, np.uint8)])
+            modules = modules[0::2] + 2 * modules[1::2]
+        lines = np.hstack([modules, np.full((len(modules), 1), _NEWLINE, np.uint8)])
+        return lines.tobytes().decode('latin-1')
+    width = matrix.size + 2 * border
+    rows = [[0] * width] * border + [[0] * border + [int(c) for c in matrix.row(r)] + [0] * border
+                                     for r in range(matrix.size)] + [[0] * width] * border
+    if half_blocks:
+        if len(rows) % 2: rows.append([pad] * width)
+        rows = [[top + 2 * bottom for top, bottom in zip(rows[r], rows[r + 1])] for r in range(0, len(rows), 2)]
+    return ''.join(''.join(map(chr, row)) + chr(_NEWLINE) for row in rows)
+
+def render_txt(matrix, border=4, out=None, text_style='unicode'):
+    # Sin print_ascii ni StringIO: códigos por carácter -> str.translate con la tabla del estilo -> UTF-8
+    out = out if out is not None else BytesIO()
+    if text_style not in TEXT_TABLES: raise ValueError(f"Estilo de texto no soportado: {text_style}")
+    half_blocks = text_style.startswith('unicode')
+    codes = _text_codes(matrix, border, half_blocks, pad=1 if text_style.endswith('-invert') else 0)
+    out.write(codes.translate(TEXT_TABLES[text_style]).encode('utf-8'))
+    return out
+
+def _rgb(color):
+    # '#rgb' y '#rrggbb' (los del formulario) sin PIL; el resto de notaciones pasan por ImageColor
+    if color.startswith('#') and len(color) in (4, 7):
+        try: rgb = bytes.fromhex(color[1:] if len(color) == 7 else ''.join(2 * c for c in color[1:]))
+        except ValueError: rgb = b''
+        if len(rgb) == 3: return tuple(rgb)
+    from PIL import ImageColor
+    return ImageColor.getrgb(color)[:3]
+
+def pil_colors(dark_color='#000000', light_color='#ffffff'):
+    # Devuelve (oscuro, claro) como tuplas RGB, o RGBA si el fondo es transparente
+    if light_color and light_color.lower() == 'transparent':
+        return _rgb(dark_color) + (255,), (255, 255, 255, 0)
+    return _rgb(dark_color), _rgb(light_color)
+
+def _module_array(matrix, border):
+    # Matriz booleana (como uint8, 1 = oscuro) con el borde incluido, sin bucles en Python
+    packed = np.frombuffer(matrix.bits, dtype=np.uint8).reshape(matrix.size, matrix.stride)
+    modules = np.unpackbits(packed, axis=1)[:, :matrix.size]
+    return np.pad(modules, border) if border else modules
+
+def rasterize_pil(matrix, scale=10, border=4, dark_color='#000000', light_color='#ffffff'):
+    # Camino rápido para módulos cuadrados: escalado con repeat (más rápido que np.kron) sobre
+    # un buffer de paleta (índice 0 = claro, 1 = oscuro) que PIL envuelve con frombuffer sin copiarlo.
+    from PIL import Image
+    dark, light = pil_colors(dark_color, light_color)
+    mode = 'RGBA' if len(light) == 4 else 'RGB'
+    pixels = _module_array(matrix, border).repeat(scale, axis=0).repeat(scale, axis=1)
+    height, width = pixels.shape
+    img = Image.frombuffer('P', (width, height), pixels, 'raw', 'P', 0, 1)
+    img.putpalette(light + dark, rawmode=mode)
+    return img.convert(mode) # Mismo modo que StyledPilImage
+
+PNG_SIGNATURE = b'\x89PNG\r\n\x1a\n'
+PNG_IDAT_SIZE = 256 * 1024 # Bytes comprimidos por chunk IDAT (y por trozo emitido por iter_png)
+PNG_SPLICE_MIN_BYTES = 64 * 1024 # Bytes de scanlines repetidas a partir de los que se empalma un bloque precomprimido
+
+def _png_chunk(kind, data):
+    return struct.pack('>I', len(data)) + kind + data + struct.pack('>I', zlib.crc32(data, zlib.crc32(kind)))
+
+_ADLER_MOD = 65521
+
+def _adler32_filtered_lines(adler, filter_byte, length, count):
+    # Adler-32 tras añadir `count` scanlines de `length` bytes: filter_byte seguido de ceros. Forma
+    # cerrada (los ceros no cambian A y suman A a B en cada byte), sin recorrer los datos.
+    a, b = adler & 0xffff, adler >> 16
+    b = (b + length * (count * a + filter_byte * count * (count + 1) // 2)) % _ADLER_MOD
+    a = (a + count * filter_byte) % _ADLER_MOD
+    return (b << 16) | a
+
+# Compresión de los PNG: nombre -> (nivel zlib, estrategia). Medido sobre QRs de 1 bit: Z_FILTERED da el
+# mismo tamaño que la estrategia por defecto y algo más rápido; 'best' ahorra ~15% a costa de ~4x tiempo
+# y 'fast' cuesta ~40% más de bytes con la mitad de tiempo.
+PNG_COMPRESSION = {'fast': (1, zlib.Z_FILTERED), 'default': (6, zlib.Z_FILTERED), 'best': (9, zlib.Z_FILTERED)}
+
+def png_header(width, dark, light):
+    # IHDR (+ PLTE/tRNS) de un PNG de 1 bit y los bits de (claro, oscuro): gris si los colores son blanco
+    # y negro, si no paleta de 2 entradas (0 = claro, 1 = oscuro) con tRNS si el fondo es transparente
+    if {dark, light} == {(0, 0, 0), (255, 255, 255)}:
+        bits = ('1', '0') if light == (255, 255, 255) else ('0', '1')
+        return _png_chunk(b'IHDR', struct.pack('>IIBBBBB', width, width, 1, 0, 0, 0, 0)), bits
+    header = _png_chunk(b'IHDR', struct.pack('>IIBBBBB', width, width, 1, 3, 0, 0, 0))
+    header += _png_chunk(b'PLTE', bytes(light[:3]) + bytes(dark[:3]))
+    if len(light) == 4: header += _png_chunk(b'tRNS', bytes([light[3]]))
+    return header, ('0', '1')
+
+def iter_png(matrix, scale=10, border=4, dark_color='#000000', light_color='#ffffff', compression='default'):
+    # PNG de 1 bit por píxel generado scanline a scanline desde la matriz, sin imagen completa en memoria:
+    # cada fila de módulos se expande una vez a bits y pasa por un compresor deflate incremental (filtro
+    # None; Up con la fila anterior comprime peor). Las `scale` scanlines de una fila de módulos son
+    # idénticas, así que a partir de la segunda se escriben con el filtro Up (todo ceros). En imágenes
+    # grandes cada tanda de scanlines Up se comprime una sola vez y el bloque se repite tal cual en el
+    # flujo (tras un Z_FULL_FLUSH, que corta las referencias hacia atrás), con el Adler-32 del flujo zlib
+    # calculado en forma cerrada. Memoria ~ dos scanlines.
+    # Mismos colores que rasterize_pil/StyledPilImage, con 1 bit en vez de 24/32 por píxel.
+    if compression not in PNG_COMPRESSION: raise ValueError(f"Compresión PNG no soportada: {compression}")
+    level, strategy = PNG_COMPRESSION[compression]
+    dark, light = pil_colors(dark_color, light_color)
+    dimension = matrix.size + 2 * border
+    width = dimension * scale
+    row_bytes = (width + 7) // 8
+    line_length = 1 + row_bytes
+    header, (light_bit, dark_bit) = png_header(width, dark, light)
+    yield PNG_SIGNATURE + header
+    module_bits = (light_bit * scale, dark_bit * scale)
+    quiet = module_bits[0] * border
+    padding = '0' * (row_bytes * 8 - width)
+    repeat_line = b'\x02' + bytes(row_bytes)
+    repeat_blocks = {} # repeticiones -> bloque deflate (alineado a byte) de esas scanlines Up
+    compressor = zlib.compressobj(level, zlib.DEFLATED, -15, zlib.DEF_MEM_LEVEL, strategy) # Deflate crudo: cabecera y Adler-32 van aparte
+    adler = 1
+    buffer = bytearray(b'\x78' + (b'\x01' if level < 2 else b'\x5e' if level < 6 else b'\x9c' if level == 6 else b'\xda'))
+    previous = None
+    for r in range(-border, matrix.size + border):
+        row = matrix.row(r) if 0 <= r < matrix.size else None
+        repeats = scale
+        if row != previous or r == -border:
+            bits = module_bits[0] * dimension if row is None else quiet + ''.join([module_bits[dark_module] for dark_module in row]) + quiet
+            line = b'\x00' + int(bits + padding, 2).to_bytes(row_bytes, 'big')
+            adler = zlib.adler32(line, adler)
+            buffer += compressor.compress(line)
+            repeats -= 1
+        if repeats * line_length >= PNG_SPLICE_MIN_BYTES:
+            block = repeat_blocks.get(repeats)
+            if block is None:
+                repeat_compressor = zlib.compressobj(level, zlib.DEFLATED, -15, zlib.DEF_MEM_LEVEL, strategy)
+                block = b''.join([repeat_compressor.compress(repeat_line) for _ in range(repeats)])
+                block = repeat_blocks[repeats] = block + repeat_compressor.flush(zlib.Z_SYNC_FLUSH)
+            buffer += compressor.flush(zlib.Z_FULL_FLUSH) + block
+            adler = _adler32_filtered_lines(adler, 2, line_length, repeats)
+        elif repeats:
+            buffer += compressor.compress(repeat_line * repeats)
+            adler = _adler32_filtered_lines(adler, 2, line_length, repeats)
+        previous = row
+        if len(buffer) >= PNG_IDAT_SIZE:
+            yield _png_chunk(b'IDAT', bytes(buffer))
+            buffer.clear()
+    buffer += compressor.flush() + struct.pack('>I', adler)
+    yield _png_chunk(b'IDAT', bytes(buffer)) + _png_chunk(b'IEND', b'')
+
+def render_png(matrix, scale=10, border=4, dark_color='#000000', light_color='#ffffff', out=None, compression='default'):
+    out = out if out is not None else BytesIO()
+    for chunk in iter_png(matrix, scale, border, dark_color, light_color, compression): out.write(chunk)
+    return out
+
+class RenderBudgetError(ValueError):
+    pass
+
+class RenderBudget:
+    # Límites por render que se comprueban antes de rasterizar: píxeles de la imagen y bytes del mayor
+    # buffer que el render tendría en memoria (la imagen completa con PIL, dos scanlines con iter_png).
+    # No aplica a SVG/SVGZ/TXT, cuyo coste no depende de la escala. policy='reject' lanza
+    # RenderBudgetError; policy='downscale' baja la escala a la mayor que cabe en el presupuesto.
+    __slots__ = ('max_pixels', 'max_bytes', 'policy')
+
+    def __init__(self, max_pixels=None, max_bytes=None, policy='reject'):
+        if policy not in ('reject', 'downscale'): raise ValueError(f"Política de presupuesto no soportada: {policy}")
+        self.max_pixels = max_pixels
+        self.max_bytes = max_bytes
+        self.policy = policy
+
+    @staticmethod
+    def buffer_bytes(dimension, scale, output_format, channels=3, module_drawer=None):
+        width = dimension * scale
+        if output_format == 'png' and module_drawer is None: return 2 * ((width + 7) // 8) # Dos scanlines de 1 bit
+        return width * width * channels
+
+    def fits(self, dimension, scale, output_format, channels=3, module_drawer=None):
+        if self.max_pixels is not None and (dimension * scale) ** 2 > self.max_pixels: return False
+        return self.max_bytes is None or self.buffer_bytes(dimension, scale, output_format, channels, module_drawer) <= self.max_bytes
+
+    def admit(self, matrix, scale, border, output_format='png', light_color='#ffffff', module_drawer=None):
+        # Devuelve la escala con la que renderizar (la pedida o una menor) o lanza RenderBudgetError
+        if output_format in ('svg', 'svgz', 'txt'): return scale
+        dimension = matrix.size + 2 * border
+        channels = 4 if light_color and light_color.lower() == 'transparent' else 3
+        if self.fits(dimension, scale, output_format, channels, module_drawer): return scale
+        if self.policy == 'downscale':
+            for smaller in range(scale - 1, 0, -1):
+                if self.fits(dimension, smaller, output_format, channels, module_drawer): return smaller
+        raise RenderBudgetError(f"La imagen solicitada ({dimension * scale}x{dimension * scale} px) supera el límite "
+                                f"de tamaño del servidor; reduzca la escala o el borde.")
+
+def _styled_pil(matrix, scale, border, dark_color, light_color, module_drawer):
+    from qrcode.image.styledpil import StyledPilImage
+    from qrcode.image.styles.colormasks import SolidFillColorMask
+    dark, light = pil_colors(dark_color, light_color)
+    img = _qrcode_from_matrix(matrix, scale, border).make_image(
+        image_factory=StyledPilImage, module_drawer=module_drawer,
+        color_mask=SolidFillColorMask(back_color=light, front_color=dark))
+    return img.get_image()
+
+def render_pil(matrix, scale=10, border=4, dark_color='#000000', light_color='#ffffff', output_format='png',
+               module_drawer=None, out=None, png_compression='default'):
+    # PNG y otros formatos que PilImage pueda manejar. EPS/PDF no son directos, se quedan como PNG.
+    # Solo se pasa por StyledPilImage (módulo a módulo) cuando se pide un module_drawer.
+    out = out if out is not None else BytesIO()
+    if output_format.lower() == 'png' and module_drawer is None:
+        # Sin imagen intermedia: rasterizado y compresión van juntos, por scanlines
+        with stage('encode'): return render_png(matrix, scale, border, dark_color, light_color, out, png_compression)
+    with stage('rasterize'):
+        if module_drawer is None and np is not None:
+            img = rasterize_pil(matrix, scale, border, dark_color, light_color)
+        else:
+            img = _styled_pil(matrix, scale, border, dark_color, light_color, module_drawer)
+    with stage('encode'):
+        img.save(out, format=PIL_FORMATS.get(output_format.lower(), 'PNG'))
+    return out
+
+def render_matrix(matrix, output_format='png', scale=10, border=4,
+                  dark_color='#000000', light_color='#ffffff', module_drawer=None, text_style='unicode',
+                  png_compression='default'):
+    # SVG y TXT se escriben directamente desde la matriz: todo su trabajo cuenta como etapa 'encode'
+    if output_format in ('svg', 'svgz'):
+        with stage('encode'): out = render_svg(matrix, scale, border, dark_color, light_color, compress=output_format == 'svgz')
+    elif output_format == 'txt':
+        with stage('encode'): out = render_txt(matrix, border, text_style=text_style)
+    else:
+        out = render_pil(matrix, scale, border, dark_color, light_color, output_format, module_drawer,
+                         png_compression=png_compression)
+    out.seek(0)
+    return out
@@ -0,0 +1,215 @@
+import argparse
+import asyncio
+import concurrent.futures
+import datetime
+import logging
+import os
+import re
+import signal
+import sqlite3
+import threading
+from urllib.parse import quote
+
+from tracking import VisitCounter, ShortCodeCache, classify_user_agent, classify_referrer
+
+logger = logging.getLogger(__name__)
+
+# Servidor de redirecciones independiente para /track/<short_code>: asyncio puro (y un callable ASGI
+# para uvicorn/hypercorn si están instalados), sin Flask ni SQLAlchemy en el camino de cada escaneo.
+# Comparte la base de datos y el esquema de app.py (tablas trackable_qr y visit_event):
+# - Resolución: ShortCodeCache delante de conexiones SQLite de solo lectura en un pool de hilos.
+# - Visitas: VisitCounter (write-behind) con su propia conexión de escritura, igual que la app.
+# Corre junto a la app Flask, p. ej. con el proxy enviando /track/ a este puerto:
+#
+#   python redirect_server.py --db qr_codes.db --port 8081
+
+TRACK_PATH_RE = re.compile(r'^/track/([0-9A-Za-z]{1,10})/?$')
+DATETIME_FORMAT = '%Y-%m-%d %H:%M:%S.%f' # El formato con el que SQLAlchemy guarda DateTime en SQLite
+LOCATION_SAFE = ":/?#[]@!$&'()*+,;=%~"
+MAX_HEADERS = 100
+MAX_BODY_BYTES = 8192 # Solo hay redirecciones: el cuerpo se lee y se descarta
+
+STATUS_LINES = {302: b'HTTP/1.1 302 Found\r\n', 400: b'HTTP/1.1 400 Bad Request\r\n',
+                404: b'HTTP/1.1 404 Not Found\r\n', 405: b'HTTP/1.1 405 Method Not Allowed\r\n',
+                413: b'HTTP/1.1 413 Content Too Large\r\n',
+                500: b'HTTP/1.1 500 Internal Server Error\r\n'}
+
+class RedirectServer:
+    def __init__(self, db_path, cache=None, flush_interval=1.0, flush_threshold=1000, read_threads=4,
+                 busy_timeout=5000):
+        self.db_path = db_path
+        self.busy_timeout = busy_timeout
+        # Caché negativa corta: este proceso no ve las invalidaciones de la app al crear códigos nuevos
+        self.cache = cache if cache is not None else ShortCodeCache(negative_ttl=2.0)
+        self.visit_counter = VisitCounter(self._flush_visits, interval=flush_interval, threshold=flush_threshold)
+        self._readers = concurrent.futures.ThreadPoolExecutor(max_workers=read_threads, thread_name_prefix='track-read')
+        self._local = threading.local()
+        self._write_conn = None
+        self.requests = 0
+
+    # --- Base de datos ---
+
+    def _read_conn(self):
+        conn = getattr(self._local, 'conn', None)
+        if conn is None:
+            conn = sqlite3.connect(f"file:{self.db_path}?mode=ro", uri=True)
+            conn.execute(f"PRAGMA busy_timeout={int(self.busy_timeout)}")
+            self._local.conn = conn
+        return conn
+
+    def _lookup(self, short_code):
+        row = self._read_conn().execute("SELECT original_url FROM trackable_qr WHERE short_code = ?", (short_code,)).fetchone()
+        return row[0] if row else None
+
+    def _flush_visits(self, counts, events):
+        # Corre en el hilo de VisitCounter (o en close()); VisitCounter serializa los volcados
+        if self._write_conn is None:
+            self._write_conn = sqlite3.connect(self.db_path, check_same_thread=False)
+            self._write_conn.execute("PRAGMA journal_mode=WAL")
+            self._write_conn.execute(f"PRAGMA busy_timeout={int(self.busy_timeout)}")
+        with self._write_conn: # Una transacción: contadores + eventos
+            self._write_conn.executemany(
+                "UPDATE trackable_qr SET visit_count = coalesce(visit_count, 0) + ? WHERE short_code = ?",
+                [(n, code) for code, n in counts.items()])
+            self._write_conn.executemany(
+                "INSERT INTO visit_event (short_code, occurred_at, ua_class, referrer_class) VALUES (?, ?, ?, ?)",
+                [(e['short_code'], e['occurred_at'].strftime(DATETIME_FORMAT), e['ua_class'], e['referrer_class'])
+                 for e in events])
+
+    async def resolve(self, short_code):
+        original_url = self.cache.get(short_code)
+        if original_url is ShortCodeCache.NOT_FOUND: return None
+        if original_url is None:
+            original_url = await asyncio.get_running_loop().run_in_executor(self._readers, self._lookup, short_code)
+            if original_url is None:
+                self.cache.put_not_found(short_code)
+                return None
+            self.cache.put(short_code, original_url)
+        return original_url
+
+    # --- Petición ---
+
+    async def handle(self, method, path, headers):
+        # Devuelve (estado, URL de destino o None); headers con nombres en minúsculas
+        self.requests += 1
+        if method not in ('GET', 'HEAD'): return 405, None
+        match = TRACK_PATH_RE.match(path.split('?', 1)[0])
+        if not match: return 404, None
+        short_code = match.group(1)
+        try:
+            original_url = await self.resolve(short_code)
+        except sqlite3.Error as e:
+            logger.error(f"Error al resolver {short_code}: {e}")
+            return 500, None
+        if original_url is None: return 404, None
+        self.visit_counter.record(short_code, event={
+            'short_code': short_code, 'occurred_at': datetime.datetime.utcnow(),
+            'ua_class': classify_user_agent(headers.get('user-agent')),
+            'referrer_class': classify_referrer(headers.get('referer'), headers.get('host'))})
+        return 302, original_url
+
+    @staticmethod
+    def _location(url):
+        # Sin CR/LF ni caracteres fuera de ASCII en la cabecera
+        return quote(url, safe=LOCATION_SAFE).encode('ascii')
+
+    # --- asyncio (HTTP/1.1 con keep-alive) ---
+
+    async def _serve_connection(self, reader, writer):
+        try:
+            while True:
+                request_line = await reader.readline()
+                if not request_line: break
+                headers = {}
+                for _ in range(MAX_HEADERS):
+                    line = await reader.readline()
+                    if line in (b'\r\n', b'\n', b''): break
+                    name, _, value = line.decode('latin-1').partition(':')
+                    headers[name.strip().lower()] = value.strip()
+                parts = request_line.decode('latin-1').split()
+                if len(parts) != 3:
+                    writer.write(STATUS_LINES[400] + b'Content-Length: 0\r\nConnection: close\r\n\r\n'); break
+                method, target, version = parts
+                content_length = headers.get('content-length', '0')
+                if not content_length.isascii() or not content_length.isdigit():
+                    writer.write(STATUS_LINES[400] + b'Content-Length: 0\r\nConnection: close\r\n\r\n'); break
+                if int(content_length) > MAX_BODY_BYTES: # Sin leerlo: se cierra la conexión
+                    writer.write(STATUS_LINES[413] + b'Content-Length: 0\r\nConnection: close\r\n\r\n'); break
+                if int(content_length): await reader.readexactly(int(content_length))
+                status, location = await self.handle(method, target, headers)
+                connection = headers.get('connection', '').lower()
+                keep_alive = connection != 'close' if version == 'HTTP/1.1' else connection == 'keep-alive'
+                response = STATUS_LINES[status]
+                if location is not None: response += b'Location: ' + self._location(location) + b'\r\nCache-Control: no-store\r\n'
+                response += b'Content-Length: 0\r\n' + (b'\r\n' if keep_alive else b'Connection: close\r\n\r\n')
+                writer.write(response)
+                if not keep_alive: break
+                if writer.transport.get_write_buffer_size() > 65536: await writer.drain()
+            await writer.drain()
+        except (ConnectionError, asyncio.IncompleteReadError, ValueError):
+            pass
+        finally:
+            writer.close()
+
+    async def start(self, host='127.0.0.1', port=8081):
+        return await asyncio.start_server(self._serve_connection, host, port, reuse_address=True)
+
+    # --- ASGI ---
+
+    async def __call__(self, scope, receive, send):
+        if scope['type'] == 'lifespan':
+            while True:
+                message = await receive()
+                if message['type'] == 'lifespan.startup':
+                    await send({'type': 'lifespan.startup.complete'})
+                elif message['type'] == 'lifespan.shutdown':
+                    self.close()
+                    await send({'type': 'lifespan.shutdown.complete'})
+                    return
+        if scope['type'] != 'http': return
+        headers = {name.decode('latin-1').lower(): value.decode('latin-1') for name, value in scope['headers']}
+        status, location = await self.handle(scope['method'], scope['path'], headers)
+        response_headers = [(b'content-length', b'0')]
+        if location is not None: response_headers += [(b'location', self._location(location)), (b'cache-control', b'no-store')]
+        await send({'type': 'http.response.start', 'status': status, 'headers': response_headers})
+        await send({'type': 'http.response.body', 'body': b''})
+
+    def close(self):
+        # Vuelca las visitas pendientes y cierra las conexiones
+        self.visit_counter.stop()
+        self._readers.shutdown(wait=True)
+        if self._write_conn is not None: self._write_conn.close()
+
+def create_asgi_app(db_path=None, **kwargs):
+    # Para servidores ASGI: uvicorn "redirect_server:create_asgi_app" --factory
+    return RedirectServer(db_path or os.environ.get('QR_DB_PATH') or default_db_path(), **kwargs)
+
+def default_db_path():
+    return os.path.join(os.path.abspath(os.path.dirname(__file__)), 'qr_codes.db')
+
+async def _run(server, host, port):
+    # Termina limpiamente con SIGTERM/SIGINT; close() vuelca después las visitas pendientes
+    stopped = asyncio.Event()
+    loop = asyncio.get_running_loop()
+    for signum in (signal.SIGTERM, signal.SIGINT): loop.add_signal_handler(signum, stopped.set)
+    listener = await server.start(host, port)
+    print(f"Sirviendo /track/<short_code> en http://{host}:{port} (BD {server.db_path})", flush=True)
+    async with listener: await stopped.wait()
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(prog='redirect_server', description="Servidor asyncio solo para /track/<short_code>.")
+    parser.add_argument('--db', default=os.environ.get('QR_DB_PATH') or default_db_path())
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=8081)
+    parser.add_argument('--flush-interval', type=float, default=1.0, help="Segundos entre volcados de visitas")
+    parser.add_argument('--read-threads', type=int, default=4, help="Hilos para consultas que no están en caché")
+    args = parser.parse_args(argv)
+    server = RedirectServer(args.db, flush_interval=args.flush_interval, read_threads=args.read_threads)
+    try:
+        asyncio.run(_run(server, args.host, args.port))
+    finally:
+        server.close()
+    return 0
+
+if __name__ == '__main__':
+    raise SystemExit(main())
@@ -0,0 +1,83 @@
+import os
+
+import sqlalchemy as sa
+from sqlalchemy.engine import make_url
+
+# Configuración de almacenamiento SQLite para varios workers/hilos:
+# - WAL: los lectores no bloquean al escritor ni al revés (un solo escritor a la vez).
+# - busy_timeout: un escritor espera al otro en lugar de fallar con "database is locked".
+# - Pool dimensionado por configuración y un engine de solo lectura aparte (bind 'read') para
+#   las rutas que solo consultan (/stats, resolución de /track), que no compiten por el pool de escritura.
+#
+# pysqlite abre la transacción (BEGIN diferido) justo antes de la primera sentencia de escritura, así
+# que las transacciones de escritura empiezan pidiendo el bloqueo y busy_timeout se aplica siempre; no
+# se da el caso de una lectura que intenta "ascender" a escritura y falla sin esperar.
+
+SQLITE_PRAGMAS = {
+    'journal_mode': 'WAL',
+    'synchronous': 'NORMAL', # Con WAL es seguro ante caídas del proceso; solo se arriesga el último commit si cae el SO
+    'busy_timeout': 5000, # ms
+    'cache_size': -16000, # KiB (negativo = tamaño, no páginas)
+    'temp_store': 'MEMORY',
+}
+
+READ_BIND = 'read'
+
+def is_sqlite_file(uri):
+    url = make_url(uri)
+    return url.get_backend_name() == 'sqlite' and url.database not in (None, '', ':memory:')
+
+def engine_options(uri, pool_size=5, max_overflow=10, pool_timeout=30.0):
+    # Opciones de pool para create_engine; SQLite en memoria usa su propio pool sin estos parámetros
+    if make_url(uri).get_backend_name() == 'sqlite' and not is_sqlite_file(uri): return {}
+    return {'pool_size': pool_size, 'max_overflow': max_overflow, 'pool_timeout': pool_timeout}
+
+def configure_app(app):
+    # Rellena SQLALCHEMY_ENGINE_OPTIONS y el bind de lectura a partir de la configuración
+    # (DB_POOL_SIZE, DB_MAX_OVERFLOW, DB_POOL_TIMEOUT, DB_READ_POOL_SIZE, SQLITE_PRAGMAS).
+    # Se llama antes de SQLAlchemy(app); los valores explícitos de la configuración tienen prioridad.
+    config = app.config
+    config.setdefault('DB_POOL_SIZE', int(os.environ.get('DB_POOL_SIZE', 5)))
+    config.setdefault('DB_MAX_OVERFLOW', int(os.environ.get('DB_MAX_OVERFLOW', 10)))
+    config.setdefault('DB_POOL_TIMEOUT', float(os.environ.get('DB_POOL_TIMEOUT', 30)))
+    config.setdefault('DB_READ_POOL_SIZE', int(os.environ.get('DB_READ_POOL_SIZE', 5)))
+    pragmas = dict(SQLITE_PRAGMAS)
+    if os.environ.get('SQLITE_BUSY_TIMEOUT'): pragmas['busy_timeout'] = int(os.environ['SQLITE_BUSY_TIMEOUT'])
+    pragmas.update(config.get('SQLITE_PRAGMAS') or {})
+    config['SQLITE_PRAGMAS'] = pragmas
+
+    uri = config['SQLALCHEMY_DATABASE_URI']
+    config.setdefault('SQLALCHEMY_ENGINE_OPTIONS', engine_options(
+        uri, config['DB_POOL_SIZE'], config['DB_MAX_OVERFLOW'], config['DB_POOL_TIMEOUT']))
+    binds = config.setdefault('SQLALCHEMY_BINDS', {})
+    # Solo con un fichero SQLite: con la misma URI, 'sqlite://' (memoria) sería otra BD vacía, y en otros
+    # motores la réplica de lectura, si la hay, se configura aparte. Sin el bind, read_bind usa el engine principal.
+    if is_sqlite_file(uri):
+        binds.setdefault(READ_BIND, {'url': uri, **engine_options(uri, config['DB_READ_POOL_SIZE'],
+                                                                  config['DB_MAX_OVERFLOW'], config['DB_POOL_TIMEOUT'])})
+
+def install_pragmas(engine, pragmas, read_only=False):
+    # Aplica los PRAGMA en cada conexión nueva del engine (no hace nada si no es SQLite)
+    if engine.dialect.name != 'sqlite': return
+    statements = [f"PRAGMA {name}={value}" for name, value in pragmas.items()]
+    if read_only: statements.append("PRAGMA query_only=ON")
+
+    @sa.event.listens_for(engine, 'connect')
+    def _set_pragmas(dbapi_connection, connection_record):
+        cursor = dbapi_connection.cursor()
+        try:
+            for statement in statements: cursor.execute(statement)
+        finally:
+            cursor.close()
+
+def init_engines(app, db):
+    # Tras SQLAlchemy(app): PRAGMA en el engine principal y en el de lectura (este además query_only)
+    with app.app_context():
+        pragmas = app.config['SQLITE_PRAGMAS']
+        install_pragmas(db.engine, pragmas)
+        if READ_BIND in db.engines: install_pragmas(db.engines[READ_BIND], pragmas, read_only=True)
+
+def read_bind(db):
+    # bind_arguments para ejecutar una consulta en el engine de lectura: db.session.execute(q, **read_bind(db))
+    engine = db.engines.get(READ_BIND)
+    return {'bind_arguments': {'bind': engine}} if engine is not None else {}
@@ -1,26 +1,46 @@
 import unittest
+import base64
 import os
-from app import app, db, TrackableQR # Asegúrate de que TrackableQR se pueda importar
+import app as app_module
+from app import (create_app, db, TrackableQR, VisitEvent, create_trackable_qrs, # Asegúrate de que TrackableQR se pueda importar
+                 rollup_visit_events, purge_visit_events)
+import threading
+import unittest.mock
 import tempfile
-from urllib.parse import urlparse, parse_qs
+import datetime
+import json
+import zipfile
+from io import BytesIO
+from qr_generator_logic import construir_payload
+from qr_matrix import get_matrix
+from urllib.parse import urlparse
 
 class AppTestCase(unittest.TestCase):
     def setUp(self):
         self.test_db_fd, self.test_db_path = tempfile.mkstemp()
-        app.config['SQLALCHEMY_DATABASE_URI'] = 'sqlite:///' + self.test_db_path
-        app.config['TESTING'] = True
-        app.config['WTF_CSRF_ENABLED'] = False # Deshabilitar CSRF para pruebas de formulario si se usa Flask-WTF
-        app.config['SERVER_NAME'] = 'localhost:5000' # Necesario para url_for con _external=True
-        self.app = app.test_client()
-        with app.app_context():
+        # Una app por prueba sobre su BD temporal: los engines se crean en create_app, así que cambiar la
+        # URI de la app por defecto no tendría efecto. Cachés y contador de visitas son los de esta app.
+        self.flask_app = create_app({
+            'SQLALCHEMY_DATABASE_URI': 'sqlite:///' + self.test_db_path,
+            'TESTING': True,
+            'WTF_CSRF_ENABLED': False, # Deshabilitar CSRF para pruebas de formulario si se usa Flask-WTF
+            'SERVER_NAME': 'localhost:5000', # Necesario para url_for con _external=True
+            'VISIT_ROLLUP_INTERVAL': 0, # Rollup solo manual en las pruebas
+        })
+        self.app = self.flask_app.test_client()
+        with self.flask_app.app_context():
             db.create_all()
 
     def tearDown(self):
-        with app.app_context():
+        app_module.visit_counter.stop()
+        app_module.shutdown_workers(self.flask_app)
+        with self.flask_app.app_context():
             db.session.remove()
             db.drop_all()
+            for engine in db.engines.values(): engine.dispose()
         os.close(self.test_db_fd)
-        os.unlink(self.test_db_path)
+        for suffix in ('', '-wal', '-shm'):
+            if os.path.exists(self.test_db_path + suffix): os.unlink(self.test_db_path + suffix)
 
     def test_index_page(self):
         response = self.app.get('/')
@@ -41,8 +61,270 @@ class AppTestCase(unittest.TestCase):
         self.assertEqual(response.status_code, 200)
         self.assertEqual(response.mimetype, 'image/png')
 
+    def test_metrics_and_server_timing(self):
+        import qr_metrics
+        form = {'content_type': 'url', 'data_url': 'https://metrics.example.com', 'output_format': 'png', 'enable_tracking': 'on',
+                'scale': '4'} # En línea (ver RENDER_POOL_INLINE_MAX_PIXELS)
+        before = qr_metrics.STAGE_SECONDS.count('encode')
+        self.flask_app.config['SERVER_TIMING'] = True
+        try:
+            response = self.app.post('/generate', data=form)
+            invalid = self.app.post('/generate', data={'content_type': 'url', 'data_url': 'no-url'})
+        finally:
+            self.flask_app.config['SERVER_TIMING'] = False
+        self.assertEqual(response.status_code, 200)
+        stages = [part.split(';')[0] for part in response.headers['Server-Timing'].split(', ')]
+        self.assertEqual(stages, ['validate', 'track_db', 'build', 'matrix', 'encode', 'total']) # PNG: rasterizado dentro de encode
+        self.assertEqual(invalid.status_code, 400)
+        self.assertEqual(qr_metrics.STAGE_SECONDS.count('encode'), before + 1)
+
+        metrics = self.app.get('/metrics')
+        self.assertEqual(metrics.status_code, 200)
+        self.assertTrue(metrics.content_type.startswith('text/plain; version=0.0.4'))
+        body = metrics.get_data(as_text=True)
+        self.assertIn('qr_generate_seconds_count{content_type="url",output_format="png"}', body)
+        self.assertIn('qr_generate_requests_total{status="400"}', body)
+        self.assertIn('qr_stage_errors_total{stage="validate"}', body)
+        self.assertIn('qr_render_cache_requests_total{result="miss"}', body)
+        self.assertIn('qr_db_statements_total{bind="default"}', body)
+        self.assertNotIn('Server-Timing', self.app.post('/generate', data=form).headers)
+
+    def test_render_cache_counts_one_miss_per_render(self):
+        form = {'content_type': 'url', 'data_url': 'https://cache-miss.example.com', 'output_format': 'svg'}
+        before = app_module.render_cache.stats()
+        self.assertEqual(self.app.post('/generate', data=form).status_code, 200)
+        self.assertEqual(self.app.post('/generate', data=form).status_code, 200)
+        after = app_module.render_cache.stats()
+        self.assertEqual((after['misses'] - before['misses'], after['hits'] - before['hits']), (1, 1))
+
+    def test_render_budget_and_streamed_png(self):
+        form = {'content_type': 'url', 'data_url': 'https://budget.example.com', 'output_format': 'png',
+                'scale': '200', 'border': '20'}
+        rejected = self.app.post('/generate', data=form)
+        self.assertEqual(rejected.status_code, 400)
+        self.assertIn('límite', rejected.get_json()['error'])
+
+        saved = {key: self.flask_app.config[key] for key in ('QR_RENDER_BUDGET_POLICY', 'QR_STREAM_MIN_PIXELS')}
+        self.flask_app.config.update(QR_RENDER_BUDGET_POLICY='downscale', QR_STREAM_MIN_PIXELS=1000 ** 2)
+        try:
+            streamed = self.app.post('/generate', data=form)
+        finally:
+            self.flask_app.config.update(saved)
+        self.assertEqual(streamed.status_code, 200)
+        self.assertTrue(streamed.is_streamed)
+        self.assertIsNotNone(streamed.headers.get('ETag'))
+        from PIL import Image
+        image = Image.open(BytesIO(streamed.get_data()))
+        self.assertLessEqual(image.width * image.height, self.flask_app.config['QR_MAX_PIXELS'])
+
+    def test_generate_busy_render_pool(self):
+        import qr_pool
+        release = threading.Event()
+        pool = qr_pool.RenderPool(workers=1, max_queue=0, inline_max_cost=0, kind='thread', retry_after=7)
+        form = {'content_type': 'url', 'data_url': 'https://busy.example.com', 'output_format': 'png'}
+        self.flask_app.extensions['qr']['render_pool'] = pool # Se cierra en tearDown
+        try:
+            with unittest.mock.patch.object(qr_pool, 'render_job', lambda matrix, options: release.wait(5) and b'png'):
+                from qr_matrix import get_matrix
+                worker = threading.Thread(target=pool.render, args=(get_matrix('ocupado', 'L'), {'scale': 1}))
+                worker.start()
+                while pool.stats()['in_flight'] == 0: release.wait(0.001)
+                busy = self.app.post('/generate', data=form)
+                release.set(); worker.join()
+                self.assertEqual(busy.status_code, 503)
+                self.assertEqual(busy.headers['Retry-After'], '7')
+                self.assertEqual(self.app.post('/generate', data=form).data, b'png')
+            self.assertIn('qr_render_pool_jobs_total{result="rejected"} 1', self.app.get('/metrics').get_data(as_text=True))
+        finally:
+            release.set()
+
+    def test_tracked_qr_artifacts(self):
+        with tempfile.TemporaryDirectory() as artifact_dir:
+            self.flask_app.config.update(ARTIFACT_DIR=artifact_dir, ARTIFACT_PRERENDER=('svg',)) # El almacén se crea al usarlo
+            try:
+                response = self.app.post('/generate', data={'content_type': 'url', 'data_url': 'https://artifact.example.com',
+                                                            'output_format': 'png', 'enable_tracking': 'on'})
+                self.assertEqual(response.status_code, 200)
+                with self.flask_app.app_context(): short_code = TrackableQR.query.one().short_code
+                self.assertTrue(os.path.islink(os.path.join(artifact_dir, 'codes', f"{short_code}.svg")))
+                self.assertFalse(os.path.exists(os.path.join(artifact_dir, 'codes', f"{short_code}.png")))
+
+                png = self.app.get(f'/qr/{short_code}.png')
+                self.assertEqual(png.status_code, 200)
+                self.assertEqual(png.mimetype, 'image/png')
+                self.assertIn('immutable', png.headers['Cache-Control'])
+                self.assertIn('max-age=31536000', png.headers['Cache-Control'])
+                etag = png.headers['ETag'].strip('"')
+                self.assertEqual(etag, __import__('hashlib').sha256(png.data).hexdigest())
+                png.close()
+                self.assertEqual(self.app.get(f'/qr/{short_code}.png', headers={'If-None-Match': f'"{etag}"'}).status_code, 304)
+                self.assertEqual(self.app.get(f'/qr/{short_code}.svg').mimetype, 'image/svg+xml')
+                self.assertEqual(self.app.get('/qr/noexiste.png').status_code, 404)
+                self.assertEqual(self.app.get(f'/qr/{short_code}.gif').status_code, 404)
+
+                self.flask_app.config['ARTIFACT_ACCEL_REDIRECT'] = '/_qr_artifacts/'
+                accel = self.app.get(f'/qr/{short_code}.png')
+                self.assertEqual(accel.headers['X-Accel-Redirect'], f'/_qr_artifacts/codes/{short_code}.png')
+                self.assertEqual(accel.data, b'')
+
+                with self.flask_app.app_context():
+                    self.assertEqual(app_module.gc_artifacts(grace=0), {'links_removed': 0, 'blobs_removed': 0, 'bytes_freed': 0})
+                    TrackableQR.query.delete(); db.session.commit()
+                    stats = app_module.gc_artifacts(grace=0)
+                self.assertEqual((stats['links_removed'], stats['blobs_removed']), (2, 2))
+                self.assertEqual(os.listdir(os.path.join(artifact_dir, 'codes')), [])
+            finally:
+                self.flask_app.config['ARTIFACT_PRERENDER'] = ()
+                self.flask_app.config['ARTIFACT_ACCEL_REDIRECT'] = None
+
+    def test_tracked_qr_artifact_ignores_request_host(self):
+        with self.flask_app.app_context(): short_code = create_trackable_qrs(['https://host.example.com'])[0].rsplit('/', 1)[1]
+        with tempfile.TemporaryDirectory() as artifact_dir:
+            self.flask_app.config['ARTIFACT_DIR'] = artifact_dir
+            with unittest.mock.patch('app.get_matrix', wraps=get_matrix) as matrix:
+                self.assertEqual(self.app.get(f'/qr/{short_code}.svg', headers={'Host': 'evil.example'}).status_code, 200)
+                self.assertEqual(matrix.call_args[0][0], f'http://localhost:5000/track/{short_code}')
+                self.flask_app.config['ARTIFACT_BASE_URL'] = 'https://qr.example.com/'
+                self.assertEqual(self.app.get(f'/qr/{short_code}.png', headers={'Host': 'evil.example'}).status_code, 200)
+                self.assertEqual(matrix.call_args[0][0], f'https://qr.example.com/track/{short_code}')
+            # Sin URL canónica no se renderiza nada a partir del Host de la petición
+            self.flask_app.config.update(ARTIFACT_BASE_URL=None, SERVER_NAME=None)
+            os.unlink(os.path.join(artifact_dir, 'codes', f"{short_code}.png"))
+            self.assertEqual(self.app.get(f'/qr/{short_code}.png', headers={'Host': 'evil.example'}).status_code, 503)
+            self.assertEqual(self.app.get(f'/qr/{short_code}.svg').status_code, 200) # Ya renderizado
+
+    def test_apps_have_independent_workers(self):
+        with tempfile.TemporaryDirectory() as artifact_dir:
+            other = create_app({'SQLALCHEMY_DATABASE_URI': 'sqlite://', 'ARTIFACT_DIR': artifact_dir,
+                                'RENDER_POOL_EXECUTOR': 'thread', 'RENDER_POOL_WORKERS': 3, 'VISIT_ROLLUP_INTERVAL': 0})
+            try:
+                with self.flask_app.app_context():
+                    pool, store = app_module.get_render_pool(), app_module.get_artifact_store()
+                with other.app_context():
+                    self.assertIsNot(app_module.get_render_pool(), pool)
+                    self.assertEqual(app_module.get_render_pool().workers, 3)
+                    self.assertEqual(app_module.get_artifact_store().root, artifact_dir)
+                self.assertNotEqual(store.root, artifact_dir)
+                app_module.shutdown_workers(other)
+                self.assertIsNone(other.extensions['qr']['render_pool'])
+            finally:
+                app_module.shutdown_workers(other)
+
+    def test_in_memory_database(self):
+        # 'sqlite://' no tiene bind de lectura: /track y /stats leen del engine principal, donde están las tablas
+        memory_app = create_app({'SQLALCHEMY_DATABASE_URI': 'sqlite://', 'TESTING': True, 'SERVER_NAME': 'localhost:5000',
+                                 'VISIT_ROLLUP_INTERVAL': 0, 'TRACKING_SYNC_COUNTS': True})
+        with memory_app.app_context():
+            app_module.init_db()
+            short_code = create_trackable_qrs(['https://memoria.example.com'])[0].rsplit('/', 1)[1]
+        client = memory_app.test_client()
+        self.assertEqual(client.get(f'/track/{short_code}').headers['Location'], 'https://memoria.example.com')
+        self.assertEqual(client.get('/stats').status_code, 200)
+        with memory_app.app_context():
+            self.assertEqual(db.session.execute(db.select(TrackableQR.visit_count)).scalar(), 1)
+            db.session.remove()
+
+    def test_generate_etag_and_conditional_request(self):
+        form = {'content_type': 'url', 'data_url': 'https://etag.example.com', 'output_format': 'png'}
+        response = self.app.post('/generate', data=form)
+        self.assertEqual(response.status_code, 200)
+        etag, is_weak = response.get_etag()
+        self.assertTrue(etag)
+        self.assertFalse(is_weak)
+
+        response = self.app.post('/generate', data=form, headers={'If-None-Match': f'"{etag}"'})
+        self.assertEqual(response.status_code, 304)
+        self.assertEqual(response.data, b'')
+
+        # Otras opciones de render producen otro ETag
+        response = self.app.post('/generate', data=dict(form, output_format='svg'), headers={'If-None-Match': f'"{etag}"'})
+        self.assertEqual(response.status_code, 200)
+        self.assertNotEqual(response.get_etag()[0], etag)
+
+    def test_generate_matrix_preview(self):
+        form = {'content_type': 'url', 'data_url': 'https://preview.example.com', 'scale': '20', 'border': '2'}
+        response = self.app.post('/generate/matrix', data=form)
+        self.assertEqual(response.status_code, 200)
+        self.assertLess(len(response.data), 400)
+        data = response.get_json()
+        self.assertEqual((data['scale'], data['border']), (20, 2))
+        matrix = get_matrix(construir_payload('https://preview.example.com', 'url'), 'M')
+        self.assertEqual((data['version'], data['size'], data['mask']), (matrix.version, matrix.size, matrix.mask))
+        self.assertEqual(base64.b64decode(data['bits']), matrix.bits)
+
+        etag = response.get_etag()[0]
+        response = self.app.post('/generate/matrix', data=form, headers={'If-None-Match': f'"{etag}"'})
+        self.assertEqual(response.status_code, 304)
+
+        # Con seguimiento no se crea ningún registro, pero la versión es la de la URL de seguimiento
+        response = self.app.post('/generate/matrix', data=dict(form, enable_tracking='on'))
+        self.assertEqual(response.status_code, 200)
+        with self.flask_app.app_context(): self.assertEqual(TrackableQR.query.count(), 0)
+        self.assertEqual(self.app.post('/generate/matrix', data={'content_type': 'url', 'data_url': ''}).status_code, 400)
+
+    def test_generate_plan(self):
+        form = {'content_type': 'url', 'data_url': 'https://plan.example.com', 'scale': '10', 'border': '4',
+                'enable_tracking': 'on'}
+        with unittest.mock.patch('app.get_matrix', side_effect=AssertionError):
+            response = self.app.post('/generate/plan', data=form)
+        self.assertEqual(response.status_code, 200)
+        plan = response.get_json()
+        self.assertTrue(plan['success'] and plan['fits'])
+        with self.flask_app.app_context(): self.assertEqual(TrackableQR.query.count(), 0)
+        # La versión coincide con la del QR que se generaría (la previsualización usa la misma URL de ejemplo)
+        self.assertEqual(plan['version'], self.app.post('/generate/matrix', data=form).get_json()['version'])
+        self.assertEqual(plan['outputs']['png']['width'], (plan['size'] + 8) * 10)
+        self.assertEqual(set(plan['levels']), {'L', 'M', 'Q', 'H'})
+
+        too_long = self.app.post('/generate/plan', data={'content_type': 'text', 'data_text': 'x' * 2500, 'error_correction': 'H'})
+        self.assertEqual(too_long.status_code, 200)
+        self.assertFalse(too_long.get_json()['fits'])
+        self.assertTrue(too_long.get_json()['levels']['L']['fits'])
+
+    def test_generate_batch_ndjson(self):
+        rows = [
+            {'content_type': 'url', 'data_url': 'https://example.com/1', 'output_format': 'png'},
+            {'content_type': 'wifi', 'wifi_ssid': 'Venue', 'wifi_password': 'secret', 'wifi_security': 'WPA', 'output_format': 'svg', 'filename': 'venue wifi'},
+            {'content_type': 'epc', 'epc_name': 'ACME', 'epc_iban': 'DE123456789', 'epc_amount': 'abc'},
+            {'content_type': 'text', 'data_text': 'hola', 'output_format': 'txt', 'scale': 5},
+        ]
+        body = "\n".join(json.dumps(row) for row in rows) + "\nnot json\n"
+        response = self.app.post('/generate/batch', data=body, content_type='application/x-ndjson')
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.mimetype, 'application/zip')
+        with zipfile.ZipFile(BytesIO(response.data)) as zf:
+            names = set(zf.namelist())
+            self.assertEqual(names, {'qrcode_000001.png', 'venue_wifi.svg', 'qrcode_000004.txt', 'manifest.json'})
+            self.assertTrue(zf.read('qrcode_000001.png').startswith(b'\x89PNG'))
+            manifest = json.loads(zf.read('manifest.json'))
+        self.assertEqual(manifest['rows'], 5)
+        self.assertEqual(manifest['generated'], 3)
+        self.assertEqual([e['row'] for e in manifest['errors']], [3, 5])
+        self.assertIn('epc_amount', manifest['errors'][0]['field_errors'])
+
+        # La primera pasada llena la caché de renders: la segunda no genera fallos
+        before = app_module.render_cache.stats()
+        again = self.app.post('/generate/batch', data=body, content_type='application/x-ndjson')
+        with zipfile.ZipFile(BytesIO(again.data)) as zf: self.assertEqual(set(zf.namelist()), names)
+        after = app_module.render_cache.stats()
+        self.assertEqual((after['hits'] - before['hits'], after['misses'] - before['misses']), (3, 0))
+        # Los PNG que /generate enviaría en streaming tampoco se cachean en lote
+        self.flask_app.config['QR_STREAM_MIN_PIXELS'] = 1000
+        large = json.dumps({'content_type': 'url', 'data_url': 'https://example.com/grande', 'output_format': 'png'})
+        for _ in range(2): self.app.post('/generate/batch', data=large, content_type='application/x-ndjson').close()
+        self.assertEqual(app_module.render_cache.stats()['misses'] - after['misses'], 2)
+
+    def test_generate_batch_csv_upload(self):
+        csv_data = "content_type,data_url,data_text,output_format\nurl,https://example.com/csv,,png\ntext,,Hola CSV,svg\n"
+        response = self.app.post('/generate/batch', data={'file': (BytesIO(csv_data.encode('utf-8')), 'rows.csv')},
+                                 content_type='multipart/form-data')
+        self.assertEqual(response.status_code, 200)
+        with zipfile.ZipFile(BytesIO(response.data)) as zf:
+            self.assertEqual(sorted(zf.namelist()), ['manifest.json', 'qrcode_000001.png', 'qrcode_000002.svg'])
+            self.assertEqual(json.loads(zf.read('manifest.json'))['errors'], [])
+
     def test_generate_trackable_url_qr(self):
-        with app.app_context(): # Necesario para url_for y operaciones de BD
+        with self.flask_app.app_context(): # Necesario para url_for y operaciones de BD
             original_url = 'https://trackme.example.com'
             response = self.app.post('/generate', data={
                 'content_type': 'url',
@@ -67,8 +349,17 @@ class AppTestCase(unittest.TestCase):
             # No podemos verificar el contenido del QR directamente aquí fácilmente,
             # pero la lógica asume que la URL de seguimiento se usó.
 
+    def test_bulk_trackable_creation(self):
+        with self.flask_app.test_request_context():
+            urls = [f'https://bulk.example.com/{i}' for i in range(50)]
+            tracking_urls = create_trackable_qrs(urls)
+            self.assertEqual(len(set(tracking_urls)), 50)
+            self.assertEqual(TrackableQR.query.filter(TrackableQR.original_url.like('https://bulk.example.com/%')).count(), 50)
+            short_code = urlparse(tracking_urls[0]).path.rsplit('/', 1)[1]
+            self.assertEqual(TrackableQR.query.filter_by(short_code=short_code).first().original_url, urls[0])
+
     def test_qr_tracking_redirect_and_count(self):
-         with app.app_context():
+         with self.flask_app.app_context():
             original_url = 'https://test-redirect.com'
             # Crear manualmente un QR rastreable para la prueba
             short_code = "test01"
@@ -82,19 +373,154 @@ class AppTestCase(unittest.TestCase):
             self.assertEqual(response.status_code, 302) # Espera una redirección
             self.assertEqual(response.location, original_url)
 
+            # Las visitas se acumulan en memoria hasta el siguiente volcado
+            app_module.visit_counter.flush()
+            db.session.expire_all()
             qr_record = TrackableQR.query.filter_by(short_code=short_code).first()
             self.assertEqual(qr_record.visit_count, 1)
 
             # Segunda visita
             response = self.app.get(tracking_url, follow_redirects=False)
             self.assertEqual(response.status_code, 302)
+            app_module.visit_counter.flush()
+            db.session.expire_all()
             qr_record_after_second_visit = TrackableQR.query.filter_by(short_code=short_code).first()
             self.assertEqual(qr_record_after_second_visit.visit_count, 2)
 
+    def test_qr_tracking_sync_counts(self):
+        self.flask_app.config['TRACKING_SYNC_COUNTS'] = True
+        try:
+            with self.flask_app.app_context():
+                db.session.add(TrackableQR(original_url='https://sync.example.com', short_code='sync01', visit_count=0))
+                db.session.commit()
+                for _ in range(3):
+                    self.assertEqual(self.app.get('/track/sync01').status_code, 302)
+                self.assertNotIn('sync01', app_module.visit_counter.pending())
+                self.assertEqual(TrackableQR.query.filter_by(short_code='sync01').first().visit_count, 3)
+        finally:
+            self.flask_app.config['TRACKING_SYNC_COUNTS'] = False
+
+    def test_qr_tracking_concurrent_visits_not_lost(self):
+        with self.flask_app.app_context():
+            db.session.add(TrackableQR(original_url='https://burst.example.com', short_code='burst1', visit_count=0))
+            db.session.commit()
+
+        def visit():
+            client = self.flask_app.test_client()
+            for _ in range(25): client.get('/track/burst1')
+
+        threads = [threading.Thread(target=visit) for _ in range(8)]
+        for t in threads: t.start()
+        for t in threads: t.join()
+        app_module.visit_counter.flush()
+        with self.flask_app.app_context():
+            self.assertEqual(TrackableQR.query.filter_by(short_code='burst1').first().visit_count, 200)
+
+    def test_visit_events_rollup_and_timeseries(self):
+        with self.flask_app.app_context():
+            db.session.add(TrackableQR(original_url='https://series.example.com', short_code='serie1', visit_count=0))
+            db.session.commit()
+        ios = {'User-Agent': 'Mozilla/5.0 (iPhone; CPU iPhone OS 17_0 like Mac OS X) Mobile/15E148'}
+        for _ in range(3): self.app.get('/track/serie1', headers=ios)
+        self.app.get('/track/serie1', headers={'Referer': 'https://news.example.org/'})
+        app_module.visit_counter.flush()
+        with self.flask_app.app_context():
+            events = VisitEvent.query.filter_by(short_code='serie1').all()
+            self.assertEqual(len(events), 4)
+            self.assertEqual(sorted(e.ua_class for e in events), ['desktop', 'ios', 'ios', 'ios'])
+            self.assertEqual(sorted(e.referrer_class for e in events), ['direct', 'direct', 'direct', 'external'])
+            # Otro evento de hace dos días en una hora distinta, para ver los buckets
+            old = datetime.datetime.utcnow() - datetime.timedelta(days=2)
+            db.session.add(VisitEvent(short_code='serie1', occurred_at=old))
+            db.session.commit()
+            self.assertEqual(rollup_visit_events(batch_size=2), 5)
+            self.assertEqual(rollup_visit_events(), 0) # Nada se agrega dos veces
+
+        data = self.app.get('/stats/serie1/timeseries?bucket=hour').get_json()
+        self.assertTrue(data['success'])
+        self.assertEqual(data['total_visits'], 5)
+        self.assertEqual([p['visits'] for p in data['points']], [1, 4])
+        data = self.app.get('/stats/serie1/timeseries?bucket=day').get_json()
+        self.assertEqual([p['visits'] for p in data['points']], [1, 4])
+        start = (datetime.datetime.utcnow() - datetime.timedelta(hours=1)).isoformat()
+        data = self.app.get(f'/stats/serie1/timeseries?bucket=hour&start={start}').get_json()
+        self.assertEqual(data['total_visits'], 4)
+
+        self.assertEqual(self.app.get('/stats/serie1/timeseries?bucket=week').status_code, 400)
+        self.assertEqual(self.app.get('/stats/serie1/timeseries?start=ayer').status_code, 400)
+        self.assertEqual(self.app.get('/stats/noexiste/timeseries').status_code, 404)
+
+    def test_visit_event_retention_keeps_unrolled_events(self):
+        with self.flask_app.app_context():
+            old = datetime.datetime.utcnow() - datetime.timedelta(days=40)
+            db.session.add(VisitEvent(short_code='ret001', occurred_at=old))
+            db.session.commit()
+            self.assertEqual(purge_visit_events(retention_days=30), 0) # Aún sin agregar
+            rollup_visit_events()
+            db.session.add(VisitEvent(short_code='ret001', occurred_at=old))
+            db.session.commit()
+            self.assertEqual(purge_visit_events(retention_days=30), 1)
+            self.assertEqual(VisitEvent.query.count(), 1)
+
+    def test_concurrent_track_and_generate_lose_nothing(self):
+        # Escrituras síncronas de /track y creaciones de /generate desde muchos hilos a la vez:
+        # con WAL + busy_timeout ninguna debe fallar por "database is locked"
+        self.flask_app.config['TRACKING_SYNC_COUNTS'] = True
+        with self.flask_app.app_context():
+            db.session.add(TrackableQR(original_url='https://hammer.example.com', short_code='hammer', visit_count=0))
+            db.session.commit()
+        failures = []
+
+        def worker(n):
+            client = self.flask_app.test_client()
+            for i in range(10):
+                if client.get('/track/hammer').status_code != 302: failures.append('track')
+                if i % 3 == 0:
+                    response = client.post('/generate', data={'content_type': 'url', 'enable_tracking': 'on',
+                                                              'data_url': f'https://hammer.example.com/{n}/{i}',
+                                                              'output_format': 'txt'})
+                    if response.status_code != 200: failures.append('generate')
+
+        try:
+            threads = [threading.Thread(target=worker, args=(n,)) for n in range(8)]
+            for t in threads: t.start()
+            for t in threads: t.join()
+        finally:
+            self.flask_app.config['TRACKING_SYNC_COUNTS'] = False
+        self.assertEqual(failures, [])
+        with self.flask_app.app_context():
+            self.assertEqual(TrackableQR.query.filter_by(short_code='hammer').first().visit_count, 80)
+            self.assertEqual(TrackableQR.query.filter(TrackableQR.original_url.startswith('https://hammer.example.com/')).count(), 32)
+            self.assertEqual(VisitEvent.query.filter_by(short_code='hammer').count(), 80)
+
     def test_tracking_nonexistent_qr(self):
         response = self.app.get('/track/nonexistentcode', follow_redirects=False)
         self.assertEqual(response.status_code, 404)
 
+    def test_tracking_resolution_cache(self):
+        with self.flask_app.app_context():
+            db.session.add(TrackableQR(original_url='https://cached.example.com', short_code='cache1', visit_count=0))
+            db.session.commit()
+            before = app_module.short_code_cache.stats()
+            for _ in range(3):
+                self.assertEqual(self.app.get('/track/cache1').location, 'https://cached.example.com')
+            after = app_module.short_code_cache.stats()
+            self.assertEqual(after['misses'] - before['misses'], 1)
+            self.assertEqual(after['hits'] - before['hits'], 2)
+
+            # Caché negativa, invalidada al crear el registro
+            self.assertEqual(self.app.get('/track/later1').status_code, 404)
+            self.assertEqual(self.app.get('/track/later1').status_code, 404)
+            self.assertEqual(app_module.short_code_cache.stats()['negative_hits'] - after['negative_hits'], 1)
+            db.session.add(TrackableQR(original_url='https://later.example.com', short_code='later1', visit_count=0))
+            db.session.commit()
+            self.assertEqual(self.app.get('/track/later1').status_code, 302)
+
+            # Borrar invalida la URL cacheada
+            db.session.delete(TrackableQR.query.filter_by(short_code='cache1').first())
+            db.session.commit()
+            self.assertEqual(self.app.get('/track/cache1').status_code, 404)
+
 
     def test_stats_page_empty(self):
         response = self.app.get('/stats')
@@ -102,7 +528,7 @@ class AppTestCase(unittest.TestCase):
         self.assertIn(b'No hay c\xc3\xb3digos QR rastreables generados todav\xc3\xada.', response.data)
 
     def test_stats_page_with_data(self):
-        with app.app_context():
+        with self.flask_app.app_context():
             qr1 = TrackableQR(original_url='https://example.com/stats1', short_code='stat01', visit_count=5)
             qr2 = TrackableQR(original_url='https://example.com/stats2', short_code='stat02', visit_count=10)
             db.session.add_all([qr1, qr2])
@@ -118,5 +544,96 @@ class AppTestCase(unittest.TestCase):
             self.assertIn(b'10', response.data)
             self.assertNotIn(b'No hay c\xc3\xb3digos QR rastreables generados todav\xc3\xada.', response.data)
 
+    def _add_stats_records(self):
+        base = datetime.datetime(2024, 1, 1)
+        with self.flask_app.app_context():
+            db.session.add_all([
+                TrackableQR(original_url=f'https://{"a" if i % 2 else "b"}.example.com/{i}', short_code=f'pg{i:02d}',
+                            visit_count=i * 3 % 7, created_at=base + datetime.timedelta(hours=i // 2))
+                for i in range(7)])
+            db.session.commit()
+
+    def test_stats_json_keyset_pagination(self):
+        self._add_stats_records()
+        seen, cursor = [], None
+        while True:
+            response = self.app.get('/stats.json', query_string={'limit': 3, **({'cursor': cursor} if cursor else {})})
+            self.assertEqual(response.status_code, 200)
+            page = response.get_json()
+            seen.extend(item['short_code'] for item in page['items'])
+            cursor = page['next_cursor']
+            if not cursor: break
+        # Orden por (created_at, id) descendente, sin duplicados ni huecos aunque haya fechas repetidas
+        self.assertEqual(len(seen), 7)
+        self.assertEqual(len(set(seen)), 7)
+        with self.flask_app.app_context():
+            expected = [qr.short_code for qr in TrackableQR.query.order_by(TrackableQR.created_at.desc(), TrackableQR.id.desc())]
+        self.assertEqual(seen, expected)
+        self.assertEqual(page['summary']['total_codes'], 7)
+        self.assertEqual(page['summary']['total_visits'], sum(i * 3 % 7 for i in range(7)))
+
+    def test_stats_json_sort_and_filters(self):
+        self._add_stats_records()
+        page = self.app.get('/stats.json?sort=visits&limit=2').get_json()
+        self.assertEqual([item['visit_count'] for item in page['items']], [6, 5])
+        rest = self.app.get(f"/stats.json?sort=visits&limit=10&cursor={page['next_cursor']}").get_json()
+        self.assertEqual([item['visit_count'] for item in rest['items']], [4, 3, 2, 1, 0])
+
+        page = self.app.get('/stats.json?prefix=https://a.example.com&min_visits=2').get_json()
+        self.assertEqual(sorted(item['short_code'] for item in page['items']), ['pg01', 'pg03'])
+        self.assertEqual(page['summary']['total_codes'], 2)
+        # U+10FFFF al final del prefijo no tiene sucesor: no debe dar 500
+        for prefix in ('https://a.example.com%F4%8F%BF%BF', '%F4%8F%BF%BF', 'https://a.example.co%F4%8F%BF%BF%F4%8F%BF%BF'):
+            page = self.app.get(f'/stats.json?prefix={prefix}')
+            self.assertEqual(page.status_code, 200, prefix)
+            self.assertEqual(page.get_json()['items'], [])
+
+        self.assertEqual(self.app.get('/stats.json?cursor=garbage').status_code, 400)
+        self.assertEqual(self.app.get('/stats.json?sort=nope').status_code, 400)
+
+    def test_stats_page_next_link(self):
+        self._add_stats_records()
+        response = self.app.get('/stats?limit=5')
+        self.assertEqual(response.status_code, 200)
+        self.assertIn(b'cursor=', response.data)
+        self.assertIn(b'P\xc3\xa1gina siguiente', response.data)
+
+class AppFactoryTestCase(unittest.TestCase):
+    # En un proceso aparte: importar app fija el estado por proceso y carga (o no) PIL y qrcode
+
+    def run_app_script(self, script, **env):
+        import subprocess, sys
+        with tempfile.TemporaryDirectory() as tmp:
+            db_path = os.path.join(tmp, 'factory.db')
+            env = dict(os.environ, QR_DB_PATH=db_path, **env)
+            env.pop('QR_RENDER_CACHE_DIR', None)
+            out = subprocess.run([sys.executable, '-c', 'import json, sys, app\n' + script], env=env, check=True,
+                                 capture_output=True, text=True, cwd=os.path.dirname(os.path.abspath(__file__))).stdout
+            return json.loads(out.splitlines()[-1]), db_path
+
+    def test_import_is_lazy_and_init_db_creates_schema(self):
+        result, db_path = self.run_app_script(
+            "heavy = sorted(m for m in sys.modules if m.split('.')[0] in ('PIL', 'qrcode'))\n"
+            "import os; existed = os.path.exists(app.DEFAULT_CONFIG['SQLALCHEMY_DATABASE_URI'][len('sqlite:///'):])\n"
+            "cli = app.app.test_cli_runner().invoke(args=['init-db'])\n"
+            "import sqlite3; tables = sorted(r[0] for r in sqlite3.connect(app.DEFAULT_CONFIG['SQLALCHEMY_DATABASE_URI'][len('sqlite:///'):])"
+            ".execute(\"SELECT name FROM sqlite_master WHERE type = 'table'\"))\n"
+            "print(json.dumps({'heavy': heavy, 'existed': existed, 'exit_code': cli.exit_code, 'tables': tables}))")
+        self.assertEqual(result['heavy'], [])
+        self.assertFalse(result['existed'])
+        self.assertEqual(result['exit_code'], 0)
+        self.assertIn('trackable_qr', result['tables'])
+        self.assertIn('visit_event', result['tables'])
+
+    def test_preload_warms_up_before_fork(self):
+        result, _ = self.run_app_script(
+            "import gc, qr_matrix\n"
+            "print(json.dumps({'data_areas': qr_matrix._data_area.cache_info().currsize, 'frozen': gc.get_freeze_count(),"
+            " 'pil': 'PIL.Image' in sys.modules, 'matrices': qr_matrix.matrix_cache_info().currsize}))", QR_PRELOAD='1')
+        self.assertEqual(result['data_areas'], 40)
+        self.assertGreater(result['frozen'], 0)
+        self.assertTrue(result['pil'])
+        self.assertEqual(result['matrices'], 0)
+
 if __name__ == '__main__':
     unittest.main()
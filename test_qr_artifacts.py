@@ -0,0 +1,59 @@
+import unittest
+import hashlib
+import os
+import tempfile
+import time
+
+from qr_artifacts import ArtifactStore
+
+class TestArtifactStore(unittest.TestCase):
+
+    def setUp(self):
+        self.tmp = tempfile.TemporaryDirectory()
+        self.store = ArtifactStore(self.tmp.name)
+
+    def tearDown(self):
+        self.tmp.cleanup()
+
+    def test_put_and_get_content_addressed(self):
+        self.assertIsNone(self.store.get('abc', 'png'))
+        artifact = self.store.put('abc', 'png', b'imagen')
+        self.assertEqual(artifact.digest, hashlib.sha256(b'imagen').hexdigest())
+        self.assertEqual(artifact.link, 'codes/abc.png')
+        self.assertEqual(artifact.mimetype, 'image/png')
+        found = self.store.get('abc', 'png')
+        self.assertEqual((found.digest, found.path), (artifact.digest, artifact.path))
+        with open(os.path.join(self.tmp.name, found.link), 'rb') as f: self.assertEqual(f.read(), b'imagen')
+        # Mismo contenido para otro código: un solo blob
+        self.assertEqual(self.store.put('def', 'png', b'imagen').path, artifact.path)
+        calls = []
+        self.assertEqual(self.store.get_or_render('abc', 'png', lambda: calls.append(1) or b'otra').digest, artifact.digest)
+        self.assertEqual(calls, [])
+        with self.assertRaises(ValueError): self.store.put('abc', 'gif', b'x')
+
+    def test_collect_garbage(self):
+        old = time.time() - 7200
+        kept = self.store.put('vivo', 'png', b'vivo')
+        gone = self.store.put('borrado', 'svg', b'<svg/>')
+        replaced = self.store.put('vivo', 'svg', b'<svg>v1</svg>')
+        self.store.put('vivo', 'svg', b'<svg>v2</svg>') # El blob v1 queda sin enlaces
+        os.symlink('../blobs/00/nada.png', os.path.join(self.store.codes_dir, 'roto.png'))
+        for artifact in (kept, gone, replaced): os.utime(artifact.path, (old, old))
+
+        stats = self.store.collect_garbage(lambda codes: {code for code in codes if code != 'borrado'}, grace=3600)
+        self.assertEqual(stats['links_removed'], 2) # 'borrado' y el enlace roto
+        self.assertEqual(stats['blobs_removed'], 2) # El de 'borrado' y la versión reemplazada
+        self.assertEqual(stats['bytes_freed'], len(b'<svg/>') + len(b'<svg>v1</svg>'))
+        self.assertIsNotNone(self.store.get('vivo', 'png'))
+        self.assertEqual(self.store.get('vivo', 'svg').digest, hashlib.sha256(b'<svg>v2</svg>').hexdigest())
+        self.assertIsNone(self.store.get('borrado', 'svg'))
+
+        # Dentro del margen de gracia un blob sin enlaces se conserva (un put puede estar en curso)
+        orphan = self.store.put('temporal', 'png', b'nuevo')
+        os.unlink(os.path.join(self.store.codes_dir, 'temporal.png'))
+        self.assertEqual(self.store.collect_garbage(grace=3600)['blobs_removed'], 0)
+        self.assertEqual(self.store.collect_garbage(grace=0)['blobs_removed'], 1)
+        self.assertFalse(os.path.exists(orphan.path))
+
+if __name__ == '__main__':
+    unittest.main()
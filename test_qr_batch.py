@@ -0,0 +1,58 @@
+import unittest
+import threading
+import time
+import zipfile
+from io import BytesIO
+
+import qr_batch
+
+class TestQRBatch(unittest.TestCase):
+
+    def test_rows_are_normalized_like_form_fields(self):
+        stream = BytesIO(b'{"content_type": "wifi", "wifi_ssid": "Net", "wifi_hidden": true, "scale": 5, "border": ""}\n\n[1]\n')
+        rows = list(qr_batch.iter_rows(stream, 'ndjson'))
+        self.assertEqual(rows[0], (1, {'content_type': 'wifi', 'wifi_ssid': 'Net', 'wifi_hidden': 'on', 'scale': '5'}, None))
+        self.assertEqual(rows[1][0], 2)
+        self.assertIsNotNone(rows[1][2])
+
+        csv_rows = list(qr_batch.iter_rows(BytesIO(b'\xef\xbb\xbfcontent_type,data_text\ntext,hola\ntext,\n'), 'csv'))
+        self.assertEqual([row for _, row, _ in csv_rows], [{'content_type': 'text', 'data_text': 'hola'}, {'content_type': 'text'}])
+
+    def test_entry_names(self):
+        used = set()
+        names = [qr_batch.entry_name(n, row, 'png', used) for n, row in enumerate(
+            [{'filename': 'a.svg'}, {'filename': 'a'}, {'filename': 'qrcode_000004'}, {}, {'filename': '../'}], 1)]
+        self.assertEqual(names, ['a.png', 'qrcode_000002.png', 'qrcode_000003.png', 'qrcode_000004.png', 'qrcode_000005.png'])
+        self.assertEqual(used, {'a.png'}) # Solo los de 'filename': los de por defecto no pueden repetirse
+
+    def test_run_bounded_limits_in_flight_jobs(self):
+        lock = threading.Lock()
+        state = {'running': 0, 'max_running': 0}
+
+        def job(value):
+            with lock:
+                state['running'] += 1
+                state['max_running'] = max(state['max_running'], state['running'])
+            time.sleep(0.01)
+            with lock: state['running'] -= 1
+            return value * 2
+
+        executor = qr_batch.make_executor('thread', workers=8)
+        try:
+            jobs = ((i, job, (i,)) for i in range(20))
+            results = {tag: future.result() for tag, future in qr_batch.run_bounded(executor, jobs, max_in_flight=3)}
+        finally:
+            executor.shutdown()
+        self.assertEqual(results, {i: i * 2 for i in range(20)})
+        self.assertLessEqual(state['max_running'], 3)
+
+    def test_stream_zip_yields_valid_archive(self):
+        chunks = list(qr_batch.stream_zip([('a.png', b'\x89PNG data'), ('b.svg', b'<svg/>' * 100)]))
+        self.assertGreater(len(chunks), 1)
+        with zipfile.ZipFile(BytesIO(b''.join(chunks))) as zf:
+            self.assertEqual(zf.read('b.svg'), b'<svg/>' * 100)
+            self.assertEqual(zf.getinfo('a.png').compress_type, zipfile.ZIP_STORED)
+            self.assertEqual(zf.getinfo('b.svg').compress_type, zipfile.ZIP_DEFLATED)
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,65 @@
+import unittest
+import json
+import os
+import tempfile
+from contextlib import redirect_stdout
+from io import StringIO
+
+import qr_bench
+
+class TestQRBench(unittest.TestCase):
+
+    def test_measure(self):
+        calls = []
+        result = qr_bench.measure(lambda: calls.append(bytearray(4096)), repeat=3, min_time=0.001)
+        self.assertEqual(set(result), {'time', 'median', 'peak_bytes', 'number', 'repeat'})
+        self.assertGreater(result['time'], 0)
+        self.assertLessEqual(result['time'], result['median'])
+        self.assertGreaterEqual(result['peak_bytes'], 4096)
+        self.assertGreaterEqual(len(calls), result['number'] * 3 + 2) # + calentamiento y medición de memoria
+
+    def test_run_selected_groups(self):
+        results = qr_bench.run_benchmarks(['payload', 'plan', 'matrix'], versions=[1, 2], repeat=1, min_time=0.001)
+        names = set(results['results'])
+        self.assertIn('payload/vcard', names)
+        self.assertIn('plan/event', names)
+        self.assertIn('payload/url', names)
+        self.assertEqual({n for n in names if n.startswith('matrix/')},
+                         {f"matrix/v0{v}-{e}" for v in (1, 2) for e in 'LMQH'})
+        self.assertEqual(results['version'], qr_bench.RESULTS_VERSION)
+        self.assertIn('qrcode', results['environment']['packages'])
+
+        only_render = qr_bench.run_benchmarks(pattern='render/txt', repeat=1, min_time=0.001)
+        self.assertEqual(set(only_render['results']), {'render/txt-small', 'render/txt-medium', 'render/txt-large'})
+        self.assertGreater(only_render['results']['render/txt-small']['output_bytes'], 0)
+
+    def test_startup_group(self):
+        results = qr_bench.run_benchmarks(['startup'], pattern='startup/import-app', repeat=1)
+        startup = results['results']['startup/import-app']
+        self.assertEqual((startup['number'], startup['repeat']), (1, 1))
+        self.assertGreater(startup['time'], 0)
+        self.assertGreater(startup['rss_bytes'], 0)
+
+    def test_compare_flags_regressions(self):
+        entry = lambda time, peak: {'time': time, 'median': time, 'peak_bytes': peak, 'number': 1, 'repeat': 1}
+        baseline = {'version': 1, 'results': {'a': entry(1.0, 100000), 'b': entry(1.0, 100000), 'old': entry(1.0, 1)}}
+        current = {'version': 1, 'results': {'a': entry(1.05, 100000), 'b': entry(1.5, 300000), 'new': entry(1.0, 1)}}
+        baseline['results']['a']['output_bytes'], current['results']['a']['output_bytes'] = 1000, 1050
+        baseline['results']['b']['output_bytes'], current['results']['b']['output_bytes'] = 1000, 2000
+        rows = {row[0]: row for row in qr_bench.compare_results(baseline, current, threshold=0.10)}
+        self.assertEqual(set(rows), {'a', 'b'})
+        self.assertEqual(rows['a'][-1], [])
+        self.assertEqual(rows['b'][-1], ['time', 'memory', 'size'])
+
+        with tempfile.TemporaryDirectory() as tmp:
+            paths = []
+            for name, results in (('base.json', baseline), ('current.json', current)):
+                paths.append(os.path.join(tmp, name))
+                with open(paths[-1], 'w') as f: json.dump(results, f)
+            with redirect_stdout(StringIO()) as out:
+                self.assertEqual(qr_bench.main(['compare', *paths]), 1)
+                self.assertEqual(qr_bench.main(['compare', paths[0], paths[0]]), 0)
+        self.assertIn('REGRESIÓN:time', out.getvalue())
+
+if __name__ == '__main__':
+    unittest.main()
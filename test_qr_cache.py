@@ -0,0 +1,61 @@
+import unittest
+import tempfile
+import shutil
+
+from qr_cache import RenderCache, render_key
+from qr_generator_logic import generate_qr_code
+
+class TestRenderCache(unittest.TestCase):
+
+    def test_render_key_depends_on_payload_and_options(self):
+        base = render_key("https://example.com", error='M', scale=10)
+        self.assertEqual(base, render_key("https://example.com", error='m', scale='10'))
+        self.assertNotEqual(base, render_key("https://example.org", error='M', scale=10))
+        self.assertNotEqual(base, render_key("https://example.com", error='M', scale=11))
+        self.assertNotEqual(base, render_key("https://example.com", error='M', scale=10, output_format='svg'))
+        self.assertNotEqual(base, render_key("https://example.com", error='M', scale=10, png_compression='best'))
+        self.assertEqual(render_key("x", output_format='svg'), render_key("x", output_format='svg', png_compression='best'))
+
+    def test_lru_eviction_by_bytes(self):
+        cache = RenderCache(max_bytes=10)
+        cache.put('a', b'1234')
+        cache.put('b', b'1234')
+        self.assertEqual(cache.get('a'), b'1234') # 'a' pasa a ser el más reciente
+        cache.put('c', b'1234') # Debe expulsar 'b'
+        self.assertIsNone(cache.get('b'))
+        self.assertEqual(cache.get('a'), b'1234')
+        self.assertEqual(cache.get('c'), b'1234')
+        stats = cache.stats()
+        self.assertEqual(stats['evictions'], 1)
+        self.assertEqual(stats['hits'], 3)
+        self.assertEqual(stats['misses'], 1)
+        self.assertLessEqual(stats['size_bytes'], 10)
+
+    def test_oversized_entry_not_kept_in_memory(self):
+        cache = RenderCache(max_bytes=4)
+        cache.put('big', b'123456')
+        self.assertEqual(len(cache), 0)
+
+    def test_disk_tier_survives_memory_eviction(self):
+        disk_dir = tempfile.mkdtemp()
+        try:
+            cache = RenderCache(max_bytes=4, disk_dir=disk_dir)
+            cache.put('a', b'1234')
+            cache.put('b', b'5678') # Expulsa 'a' de memoria, pero sigue en disco
+            self.assertEqual(cache.get('a'), b'1234')
+            self.assertEqual(cache.stats()['disk_hits'], 1)
+            # Una instancia nueva sobre el mismo directorio también lo encuentra
+            self.assertEqual(RenderCache(disk_dir=disk_dir).get('b'), b'5678')
+        finally:
+            shutil.rmtree(disk_dir)
+
+    def test_generate_qr_code_uses_cache(self):
+        cache = RenderCache()
+        first = generate_qr_code("cached content", content_type='text', output_format='png', cache=cache)
+        second = generate_qr_code("cached content", content_type='text', output_format='png', cache=cache)
+        self.assertEqual(first.getvalue(), second.getvalue())
+        self.assertEqual(cache.stats()['misses'], 1)
+        self.assertEqual(cache.stats()['hits'], 1)
+
+if __name__ == '__main__':
+    unittest.main()
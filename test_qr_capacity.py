@@ -0,0 +1,64 @@
+import unittest
+import random
+import string
+from unittest import mock
+
+import qr_matrix
+from qr_capacity import plan_capacity, segments, estimate_outputs
+from qr_matrix import build_matrix
+from qr_render import RenderBudget, render_matrix
+
+class TestCapacityPlanner(unittest.TestCase):
+
+    def test_version_matches_build_matrix(self):
+        rng = random.Random(7)
+        alphabets = (string.digits, string.digits + string.ascii_uppercase + ' $%*+-./:', string.printable, 'ñé€' + string.ascii_letters)
+        for _ in range(60):
+            payload = ''.join(''.join(rng.choice(rng.choice(alphabets)) for _ in range(rng.choice((1, 19, 20, 21, 90, 400))))
+                              for _ in range(rng.randint(1, 5)))
+            for error in 'LMQH':
+                try: expected = build_matrix(payload, error).version
+                except ValueError: expected = None
+                self.assertEqual(plan_capacity(payload, error)['version'], expected, (error, payload))
+
+    def test_pinned_version_and_headroom(self):
+        plan = plan_capacity('HELLO WORLD HELLO WORLD 12345678901234567890', 'q', version=3)
+        self.assertEqual([s['mode'] for s in plan['segments']], ['alphanumeric', 'numeric'])
+        self.assertEqual((plan['error'], plan['version'], plan['size']), ('Q', 3, 29))
+        level = plan['levels']['Q']
+        self.assertEqual(level['headroom_bits'], level['capacity_bits'] - level['data_bits'])
+        self.assertEqual(build_matrix('HELLO WORLD HELLO WORLD 12345678901234567890', 'Q', version=3).size, 29)
+        # No cabe en la versión 1 con H: igual que build_matrix
+        self.assertFalse(plan_capacity('HELLO WORLD HELLO WORLD 12345678901234567890', 'H', version=1)['fits'])
+        with self.assertRaises(ValueError): build_matrix('HELLO WORLD HELLO WORLD 12345678901234567890', 'H', version=1)
+        too_long = plan_capacity('x' * 2500, 'M')
+        self.assertFalse(too_long['fits'])
+        self.assertEqual(too_long['outputs'], {})
+        self.assertLess(too_long['levels']['M']['max_headroom_bits'], 0)
+        self.assertTrue(too_long['levels']['L']['fits'])
+        self.assertEqual(segments(''), [])
+        with self.assertRaises(ValueError): plan_capacity('x', version=41)
+
+    def test_never_builds_matrix(self):
+        with mock.patch.object(qr_matrix, 'build_matrix', side_effect=AssertionError), \
+             mock.patch('qrcode.QRCode', side_effect=AssertionError):
+            self.assertTrue(plan_capacity('https://example.com/sin-render', 'H', scale=20)['fits'])
+
+    def test_output_estimates(self):
+        payload = 'https://example.com/estimaciones?id=' + '7' * 60
+        plan = plan_capacity(payload, 'M', scale=8, border=2, text_style='ascii', budget=RenderBudget(max_pixels=10_000))
+        matrix = build_matrix(payload, 'M')
+        outputs = plan['outputs']
+        png = render_matrix(matrix, 'png', scale=8, border=2).getvalue()
+        self.assertEqual(outputs['png']['width'], (matrix.size + 4) * 8)
+        self.assertFalse(outputs['png']['within_budget'])
+        self.assertTrue(outputs['svg']['within_budget'])
+        self.assertEqual(outputs['txt']['bytes'], len(render_matrix(matrix, 'txt', border=2, text_style='ascii').getvalue()))
+        for output_format, actual in (('png', len(png)), ('svg', len(render_matrix(matrix, 'svg', border=2).getvalue())),
+                                      ('svgz', len(render_matrix(matrix, 'svgz', border=2).getvalue()))):
+            self.assertAlmostEqual(outputs[output_format]['bytes'] / actual, 1, delta=0.3, msg=output_format)
+        unicode_txt = len(render_matrix(matrix, 'txt', border=2).getvalue())
+        self.assertAlmostEqual(estimate_outputs(matrix.size, 8, 2)['txt']['bytes'] / unicode_txt, 1, delta=0.05)
+
+if __name__ == '__main__':
+    unittest.main()
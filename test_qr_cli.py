@@ -0,0 +1,118 @@
+import unittest
+import json
+import os
+import shutil
+import tempfile
+import zipfile
+from contextlib import redirect_stderr
+from io import StringIO
+from unittest import mock
+
+from qr_cli import ArchiveSink, Checkpoint, _part_path, main, parse_shard
+
+class TestQRCli(unittest.TestCase):
+
+    def setUp(self):
+        self.tmp_dir = tempfile.mkdtemp()
+        self.input_path = os.path.join(self.tmp_dir, 'rows.ndjson')
+        with open(self.input_path, 'w', encoding='utf-8') as f:
+            for i in range(1, 7):
+                f.write(json.dumps({'content_type': 'text', 'data_text': f'fila {i}', 'scale': 2}) + '\n')
+            f.write(json.dumps({'content_type': 'url', 'data_url': 'no-es-url'}) + '\n')
+
+    def tearDown(self):
+        shutil.rmtree(self.tmp_dir)
+
+    def _run(self, *args):
+        with redirect_stderr(StringIO()):
+            return main([self.input_path, '--workers', '1', '--chunk-size', '2', *args])
+
+    def test_parse_shard(self):
+        self.assertEqual(parse_shard('1/4'), (1, 4))
+        for bad in ['4/4', 'x', '1/0']:
+            with self.assertRaises(Exception): parse_shard(bad)
+
+    def test_checkpoint_watermark_with_shards(self):
+        checkpoint = Checkpoint(os.path.join(self.tmp_dir, 'cp.json'), self.input_path, (1, 2)) # Filas pares
+        for row_number in range(1, 7): checkpoint.seen(row_number)
+        self.assertEqual(checkpoint.watermark, 1)
+        checkpoint.mark_done(4)
+        self.assertEqual(checkpoint.watermark, 1)
+        checkpoint.mark_done(2)
+        self.assertEqual(checkpoint.watermark, 5)
+        self.assertTrue(checkpoint.is_done(3))
+        self.assertFalse(checkpoint.is_done(6))
+
+    def test_directory_output_errors_and_resume(self):
+        out_dir = os.path.join(self.tmp_dir, 'out')
+        self.assertEqual(self._run('-o', out_dir), 0)
+        self.assertEqual(sorted(os.listdir(out_dir)), [f'qrcode_00000{i}.png' for i in range(1, 7)])
+        with open(out_dir + '.errors.ndjson', encoding='utf-8') as f:
+            self.assertEqual([json.loads(line)['row'] for line in f], [7])
+
+        # Reanudar una ejecución terminada no vuelve a generar nada
+        shutil.rmtree(out_dir)
+        self.assertEqual(self._run('-o', out_dir), 0)
+        self.assertEqual(os.listdir(out_dir), [])
+
+    def test_resume_from_interrupted_run_writes_new_zip_part(self):
+        out_zip = os.path.join(self.tmp_dir, 'out.zip')
+        checkpoint = Checkpoint(out_zip + '.checkpoint.json', self.input_path, (0, 1))
+        checkpoint.watermark = 3; checkpoint.done = {5}; checkpoint.generated = 4
+        checkpoint.save()
+        self.assertEqual(self._run('-o', out_zip), 0)
+        with zipfile.ZipFile(os.path.join(self.tmp_dir, 'out.part1.zip')) as zf:
+            self.assertEqual(sorted(zf.namelist()), ['qrcode_000004.png', 'qrcode_000006.png'])
+
+    def test_resume_keeps_duplicate_filenames_per_row(self):
+        csv_path = os.path.join(self.tmp_dir, 'dup.csv')
+        with open(csv_path, 'w', encoding='utf-8') as f:
+            f.write('content_type,data_text,scale,filename\ntext,primera,2,a\ntext,segunda,2,a\n')
+        out_dir = os.path.join(self.tmp_dir, 'dup')
+        with redirect_stderr(StringIO()): self.assertEqual(main([csv_path, '--workers', '1', '-o', out_dir]), 0)
+        self.assertEqual(sorted(os.listdir(out_dir)), ['a.png', 'qrcode_000002.png'])
+        with open(os.path.join(out_dir, 'a.png'), 'rb') as f: first = f.read()
+
+        # Reanudar tras la fila 1: la fila 2 no se queda con 'a.png' aunque la 1 ya no se procese
+        os.unlink(os.path.join(out_dir, 'qrcode_000002.png'))
+        checkpoint = Checkpoint(out_dir + '.checkpoint.json', csv_path, (0, 1))
+        checkpoint.watermark = 1; checkpoint.generated = 1
+        checkpoint.save()
+        with redirect_stderr(StringIO()): self.assertEqual(main([csv_path, '--workers', '1', '-o', out_dir]), 0)
+        self.assertEqual(sorted(os.listdir(out_dir)), ['a.png', 'qrcode_000002.png'])
+        with open(os.path.join(out_dir, 'a.png'), 'rb') as f: self.assertEqual(f.read(), first)
+
+    def test_checkpoint_only_counts_closed_archive_parts(self):
+        out_zip = os.path.join(self.tmp_dir, 'out.zip')
+        open_archives = []
+        real_mark_done, real_save = Checkpoint.mark_done, Checkpoint.save
+
+        def mark_done(checkpoint, row_number):
+            real_mark_done(checkpoint, row_number)
+            if row_number == 5: raise KeyboardInterrupt # La fila 5 ya está en una parte abierta
+
+        def killed_close(sink): # Muerte del proceso (SIGKILL): ni se cierra la parte ni se guarda el checkpoint
+            if sink._archive is not None: open_archives.append(sink._archive)
+
+        with mock.patch.object(Checkpoint, 'mark_done', mark_done), mock.patch.object(ArchiveSink, 'close', killed_close), \
+             mock.patch.object(Checkpoint, 'save', lambda checkpoint: None if open_archives else real_save(checkpoint)):
+            self.assertEqual(self._run('-o', out_zip, '--checkpoint-every', '2'), 130)
+        with open(out_zip + '.checkpoint.json', encoding='utf-8') as f: state = json.load(f)
+        self.assertEqual((state['watermark'], state['part']), (4, 1))
+        names = []
+        for part in range(state['part'] + 1): # Las partes del checkpoint están cerradas y son legibles
+            with zipfile.ZipFile(_part_path(out_zip, part)) as zf: names += zf.namelist()
+        self.assertEqual(sorted(names), [f'qrcode_00000{i}.png' for i in range(1, 5)])
+        for archive in open_archives: archive.close()
+
+        self.assertEqual(self._run('-o', out_zip), 0)
+        with zipfile.ZipFile(_part_path(out_zip, 2)) as zf:
+            self.assertEqual(sorted(zf.namelist()), ['qrcode_000005.png', 'qrcode_000006.png'])
+
+    def test_shard_splits_rows(self):
+        out_dir = os.path.join(self.tmp_dir, 'shard')
+        self.assertEqual(self._run('-o', out_dir, '--shard', '0/3'), 0)
+        self.assertEqual(sorted(os.listdir(out_dir)), ['qrcode_000001.png', 'qrcode_000004.png'])
+
+if __name__ == '__main__':
+    unittest.main()
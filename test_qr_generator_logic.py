@@ -2,6 +2,8 @@ import unittest
 from io import BytesIO
 import datetime
 import urllib
+from PIL import Image
+from qrcode.image.styles.moduledrawers import CircleModuleDrawer
 
 from qr_generator_logic import (
     generate_qr_code,
@@ -15,6 +17,8 @@ from qr_generator_logic import (
     construir_event_string,
     construir_epc_string
 )
+from qr_matrix import get_matrix
+from qr_render import rasterize_pil, render_matrix, _styled_pil
 
 class TestQRGeneratorLogicPythonQrcode(unittest.TestCase):
 
@@ -41,10 +45,10 @@ class TestQRGeneratorLogicPythonQrcode(unittest.TestCase):
 
         self.assertTrue("<svg" in svg_content.strip()[:100], "SVG content should contain '<svg' near the beginning")
 
-        # Check for module and background colors in the svg tag
-        self.assertIn(f'module_color="{dark_color_hex}"', svg_content)
+        # Los colores se aplican de verdad: trazo de los módulos y rectángulo de fondo
+        self.assertIn(f'stroke="{dark_color_hex}"', svg_content)
         if light_color_hex.lower() not in ['transparent', 'none']:
-            self.assertIn(f'background="{light_color_hex}"', svg_content)
+            self.assertIn(f'fill="{light_color_hex}"', svg_content)
 
 
     def test_generate_text_txt(self):
@@ -105,6 +109,14 @@ class TestQRGeneratorLogicPythonQrcode(unittest.TestCase):
                 result = generate_qr_code("test error levels", content_type='text', error=error_level_char, output_format='png')
                 self._assert_is_valid_bytesio_output(result, content_type_for_debug=f"err_level_{error_level_char}")
 
+    def test_version_and_mask_pinning(self):
+        auto = generate_qr_code("pinned", content_type='text', output_format='txt', border=0)
+        pinned = generate_qr_code("pinned", content_type='text', output_format='txt', border=0, version=10, mask=3)
+        self.assertEqual(len(pinned.getvalue().decode('utf-8').splitlines()), (10 * 4 + 17 + 1) // 2)
+        self.assertNotEqual(auto.getvalue(), pinned.getvalue())
+        with self.assertRaises(ValueError):
+            generate_qr_code("x" * 500, content_type='text', version=1)
+
     def test_transparent_background_png(self):
         result = generate_qr_code("transparent BG", content_type='text', light_color='transparent', output_format='png')
         self._assert_is_valid_bytesio_output(result, content_type_for_debug="transparent_png")
@@ -117,7 +129,36 @@ class TestQRGeneratorLogicPythonQrcode(unittest.TestCase):
         # o un <rect> de fondo con fill sólido.
         self.assertNotIn('background_color="#ffffff"', svg_content.lower())
         self.assertNotIn('fill="white"', svg_content.lower()) # Asegurar que no haya un rect blanco de fondo
-
+        self.assertNotIn('<rect', svg_content)
+
+
+    def test_fast_png_rasterizer_pixel_identical(self):
+        # El camino NumPy debe coincidir píxel a píxel con StyledPilImage
+        cases = [("short", 'L', 1, 0, '#000000', '#ffffff'),
+                 ("https://example.com/" + "x" * 100, 'H', 3, 4, '#336699', '#EFEFEF'),
+                 ("transparent", 'Q', 3, 2, '#112233', 'transparent')]
+        for data, error, scale, border, dark, light in cases:
+            with self.subTest(error=error, scale=scale, light=light):
+                matrix = get_matrix(data, error)
+                fast = rasterize_pil(matrix, scale, border, dark, light)
+                styled = _styled_pil(matrix, scale, border, dark, light, None)
+                self.assertEqual(fast.mode, styled.mode)
+                self.assertEqual(fast.size, styled.size)
+                self.assertEqual(fast.tobytes(), styled.tobytes())
+
+    def test_png_uses_requested_colors(self):
+        result = generate_qr_code("colors", content_type='text', output_format='png', dark_color='#336699', light_color='#efefef')
+        image = Image.open(result)
+        self.assertEqual(image.mode, 'P') # Paleta de 2 colores, 1 bit por píxel
+        colors = {color for _, color in image.convert('RGB').getcolors()}
+        self.assertEqual(colors, {(0x33, 0x66, 0x99), (0xef, 0xef, 0xef)})
+
+    def test_png_with_module_drawer_uses_styled_path(self):
+        matrix = get_matrix("styled", 'M')
+        square = Image.open(render_matrix(matrix, 'png', scale=10, border=1))
+        circles = Image.open(render_matrix(matrix, 'png', scale=10, border=1, module_drawer=CircleModuleDrawer()))
+        self.assertEqual(square.size, circles.size)
+        self.assertNotEqual(square.tobytes(), circles.tobytes())
 
     def test_empty_data_string_for_url_or_text(self):
         with self.assertRaisesRegex(ValueError, "El contenido a codificar no puede ser vacío."):
@@ -0,0 +1,223 @@
+import unittest
+import base64
+import gzip
+import io
+import random
+import re
+import qrcode
+import qrcode.util
+from io import BytesIO
+from qrcode.image.svg import SvgPathImage
+
+from qr_matrix import (QRMatrix, ERROR_CORRECTION, build_matrix, get_matrix, matrix_cache_info, clear_matrix_cache,
+                       mask_penalty)
+import qr_render
+from qr_render import render_matrix, render_svg, render_txt, _qrcode_from_matrix
+from qr_generator_logic import generate_qr_code
+
+class TestQRMatrix(unittest.TestCase):
+
+    def test_matches_python_qrcode_modules(self):
+        for error, constant in [('L', qrcode.constants.ERROR_CORRECT_L), ('H', qrcode.constants.ERROR_CORRECT_H)]:
+            with self.subTest(error=error):
+                qr_obj = qrcode.QRCode(error_correction=constant, border=0)
+                qr_obj.add_data("https://example.com/matrix")
+                qr_obj.make(fit=True)
+                matrix = build_matrix("https://example.com/matrix", error)
+                self.assertEqual(matrix.version, qr_obj.version)
+                self.assertEqual(matrix.size, qr_obj.modules_count)
+                self.assertEqual(matrix.to_modules(), [[bool(c) for c in row] for row in qr_obj.modules])
+                self.assertIn(matrix.mask, range(8))
+        # Las constantes se copian para no importar qrcode (y PIL) al importar el módulo
+        self.assertEqual(ERROR_CORRECTION, {e: getattr(qrcode.constants, f'ERROR_CORRECT_{e}') for e in 'LMQH'})
+
+    def test_mask_penalty_matches_python_qrcode(self):
+        rng = random.Random(7)
+        for size in (21, 25, 33):
+            for density in (0.2, 0.5, 0.8):
+                modules = [[rng.random() < density for _ in range(size)] for _ in range(size)]
+                self.assertEqual(mask_penalty(modules), qrcode.util.lost_point(modules))
+        qr_obj = qrcode.QRCode(error_correction=qrcode.constants.ERROR_CORRECT_Q)
+        qr_obj.add_data("BEGIN:VCARD\nFN:Penalización\nEND:VCARD")
+        qr_obj.best_fit()
+        for mask in range(8):
+            qr_obj.makeImpl(True, mask)
+            self.assertEqual(mask_penalty(qr_obj.modules), qrcode.util.lost_point(qr_obj.modules))
+
+    def test_same_mask_as_python_qrcode(self):
+        for payload in ["a", "https://example.com/" + "m" * 200, "BEGIN:VEVENT\n" + "evento " * 150]:
+            for error in 'LH':
+                with self.subTest(payload=payload[:20], error=error):
+                    qr_obj = qrcode.QRCode(error_correction=ERROR_CORRECTION[error], border=0)
+                    qr_obj.add_data(payload)
+                    qr_obj.make(fit=True)
+                    self.assertEqual(build_matrix(payload, error).to_modules(),
+                                     [[bool(c) for c in row] for row in qr_obj.modules])
+
+    def test_version_and_mask_pinning(self):
+        auto = build_matrix("pin me", 'M')
+        self.assertEqual(build_matrix("pin me", 'M', version=auto.version, mask=auto.mask), auto)
+        pinned = build_matrix("pin me", 'M', version=5, mask=(auto.mask + 1) % 8)
+        self.assertEqual((pinned.version, pinned.mask, pinned.size), (5, (auto.mask + 1) % 8, 37))
+        qr_obj = qrcode.QRCode(version=5, error_correction=ERROR_CORRECTION['M'], border=0, mask_pattern=pinned.mask)
+        qr_obj.add_data("pin me")
+        qr_obj.make(fit=False)
+        self.assertEqual(pinned.to_modules(), [[bool(c) for c in row] for row in qr_obj.modules])
+        self.assertIs(get_matrix("pin me", 'M', 5, pinned.mask), get_matrix("pin me", 'm', 5, pinned.mask))
+        with self.assertRaises(ValueError): build_matrix("x" * 200, 'H', version=2)
+        with self.assertRaises(ValueError): build_matrix("x", 'M', version=41)
+        with self.assertRaises(ValueError): build_matrix("x", 'M', mask=8)
+
+    def test_bit_packing_and_accessors(self):
+        modules = [[(r + c) % 3 == 0 for c in range(21)] for r in range(21)]
+        matrix = QRMatrix.from_modules(modules, 1, 'M', 0)
+        self.assertEqual(len(matrix.bits), 21 * 3)
+        self.assertEqual(matrix.to_modules(), modules)
+        self.assertTrue(matrix.is_dark(0, 0))
+        self.assertFalse(matrix.is_dark(0, 1))
+        self.assertTrue(matrix.is_dark(1, 20))
+        data = matrix.to_dict()
+        self.assertEqual((data['version'], data['size'], data['stride']), (1, 21, 3))
+        self.assertEqual(QRMatrix(1, 'M', 0, 21, base64.b64decode(data['bits'])), matrix)
+
+    def test_immutable_and_hashable(self):
+        a = build_matrix("hash me", 'M')
+        b = build_matrix("hash me", 'm')
+        self.assertEqual(a, b)
+        self.assertEqual(hash(a), hash(b))
+        self.assertEqual(len({a, b}), 1)
+        with self.assertRaises(AttributeError):
+            a.version = 3
+
+    def test_cache_reused_across_formats_and_scales(self):
+        clear_matrix_cache()
+        for output_format in ['png', 'svg', 'txt']:
+            generate_qr_code("multi format", content_type='text', output_format=output_format, error='Q')
+        generate_qr_code("multi format", content_type='text', output_format='png', error='Q', scale=3)
+        info = matrix_cache_info()
+        self.assertEqual(info.misses, 1)
+        self.assertEqual(info.hits, 3)
+        self.assertIs(get_matrix("multi format", 'Q'), get_matrix("multi format", 'q'))
+
+    def test_render_matrix_formats(self):
+        matrix = get_matrix("render me", 'M')
+        self.assertTrue(render_matrix(matrix, 'png').getvalue().startswith(b'\x89PNG'))
+        self.assertIn(b'<svg', render_matrix(matrix, 'svg').getvalue()[:200])
+        self.assertTrue(render_matrix(matrix, 'txt', border=1).getvalue().decode('utf-8').strip())
+
+    def _svg_modules(self, svg, size, border):
+        # Reconstruye la matriz a partir de los tramos del <path> ("M x y.5", "m dx 0", "h ancho")
+        path = re.search(r' d="([^"]*)"', svg).group(1)
+        modules = [[False] * size for _ in range(size)]
+        x = y = 0
+        for command, a, b in re.findall(r'([Mmh])(-?\d+)(?: (-?\d+)(?:\.5)?)?', path):
+            if command == 'M': x, y = int(a), int(b)
+            elif command == 'm': x += int(a)
+            else:
+                for c in range(x, x + int(a)): modules[y - border][c - border] = True
+                x += int(a)
+        return modules
+
+    def test_svg_writer_matches_matrix_and_is_compact(self):
+        matrix = get_matrix("https://example.com/" + "svg" * 120, 'M')
+        svg = render_svg(matrix, scale=10, border=4).getvalue()
+        self.assertEqual(self._svg_modules(svg.decode('ascii'), matrix.size, 4), matrix.to_modules())
+        self.assertIn(f'viewBox="0 0 {matrix.size + 8} {matrix.size + 8}"'.encode(), svg)
+
+        reference = BytesIO()
+        _qrcode_from_matrix(matrix, 10, 4).make_image(image_factory=SvgPathImage).save(reference)
+        self.assertLess(len(svg) * 3, len(reference.getvalue()))
+
+    def test_svgz(self):
+        matrix = get_matrix("svgz please", 'Q')
+        svgz = render_matrix(matrix, 'svgz').getvalue()
+        self.assertEqual(gzip.decompress(svgz), render_matrix(matrix, 'svg').getvalue())
+        self.assertEqual(svgz, render_matrix(matrix, 'svgz').getvalue()) # Determinista (para ETag y caché)
+
+    def test_txt_matches_print_ascii(self):
+        # Mismos bytes que print_ascii (con y sin inversión), incluidas alturas impares
+        for payload, border in [("txt", 4), ("txt impar", 3), ("https://example.com/" + "t" * 60, 1)]:
+            matrix = get_matrix(payload, 'M')
+            for invert in (False, True):
+                with self.subTest(payload=payload, border=border, invert=invert):
+                    expected = io.StringIO()
+                    _qrcode_from_matrix(matrix, 1, border).print_ascii(out=expected, invert=invert)
+                    style = 'unicode-invert' if invert else 'unicode'
+                    self.assertEqual(render_txt(matrix, border, text_style=style).getvalue(),
+                                     expected.getvalue().encode('utf-8'))
+
+    def test_txt_ascii_styles_and_fallback(self):
+        matrix = get_matrix("ascii", 'L')
+        lines = render_txt(matrix, 2, text_style='ascii').getvalue().decode('ascii').splitlines()
+        self.assertEqual(len(lines), matrix.size + 4)
+        self.assertEqual(lines[0], ' ' * 2 * (matrix.size + 4))
+        self.assertEqual(lines[2][4:18], '#' * 14) # Patrón localizador: 7 módulos oscuros
+        inverted = render_txt(matrix, 2, text_style='ascii-invert').getvalue().decode('ascii')
+        self.assertEqual(inverted.translate(str.maketrans('# ', ' #')).splitlines(), lines)
+
+        numpy = qr_render.np
+        try:
+            qr_render.np = None
+            for style in qr_render.TEXT_STYLES:
+                with self.subTest(style=style):
+                    qr_render.np = numpy
+                    expected = render_txt(matrix, 3, text_style=style).getvalue()
+                    qr_render.np = None
+                    self.assertEqual(render_txt(matrix, 3, text_style=style).getvalue(), expected)
+        finally:
+            qr_render.np = numpy
+        with self.assertRaises(ValueError): render_txt(matrix, text_style='braille')
+
+    def test_streamed_png_matches_rasterized_image(self):
+        from PIL import Image
+        matrix = get_matrix("https://example.com/stream", 'M')
+        splice_min = qr_render.PNG_SPLICE_MIN_BYTES
+        cases = (('#000000', '#ffffff', None, '1'), ('#ffffff', '#000000', None, '1'), ('#102030', '#ffffff', None, 'P'),
+                 ('#102030', 'transparent', None, 'P'), ('#000000', 'transparent', 'best', 'P'), ('#102030', '#ffffff', 1, 'P'))
+        for dark, light, variant, mode in cases:
+            with self.subTest(dark=dark, light=light, variant=variant):
+                if variant == 1: qr_render.PNG_SPLICE_MIN_BYTES = 1 # fuerza el camino de bloques precomprimidos
+                try: png = qr_render.render_png(matrix, 7, 3, dark, light, compression=variant if isinstance(variant, str) else 'default').getvalue()
+                finally: qr_render.PNG_SPLICE_MIN_BYTES = splice_min
+                self.assertTrue(png.startswith(qr_render.PNG_SIGNATURE))
+                decoded = Image.open(BytesIO(png)); decoded.load()
+                self.assertEqual(decoded.mode, mode)
+                self.assertEqual(png[24:26], b'\x01' + (b'\x00' if mode == '1' else b'\x03')) # 1 bit, gris o paleta
+                expected = qr_render.rasterize_pil(matrix, 7, 3, dark, light)
+                self.assertEqual(decoded.convert(expected.mode).tobytes(), expected.tobytes())
+        with self.assertRaises(ValueError): qr_render.render_png(matrix, compression='máxima')
+
+    def test_streamed_png_large_image(self):
+        import zlib
+        matrix = get_matrix("x" * 2000, 'L', version=40)
+        chunks = list(qr_render.iter_png(matrix, 60, 4, '#000000', '#ffffff'))
+        self.assertLessEqual(max(len(chunk) for chunk in chunks), 2 * qr_render.PNG_IDAT_SIZE)
+        png = b''.join(chunks)
+        width = (matrix.size + 8) * 60
+        self.assertEqual(png[16:24], width.to_bytes(4, 'big') * 2)
+        idat, offset = b'', 8
+        while offset < len(png):
+            length = int.from_bytes(png[offset:offset + 4], 'big')
+            if png[offset + 4:offset + 8] == b'IDAT': idat += png[offset + 8:offset + 8 + length]
+            offset += length + 12
+        decompressor = zlib.decompressobj() # zlib valida el Adler-32 calculado en forma cerrada
+        rows = decompressor.decompress(idat, 0)
+        self.assertTrue(decompressor.eof)
+        self.assertEqual(len(rows), width * (1 + (width + 7) // 8))
+
+    def test_render_budget(self):
+        matrix = get_matrix("https://example.com/budget", 'Q') # 29 módulos -> 37 con borde 4
+        budget = qr_render.RenderBudget(max_pixels=1000 ** 2)
+        self.assertEqual(budget.admit(matrix, 20, 4), 20)
+        with self.assertRaises(qr_render.RenderBudgetError): budget.admit(matrix, 30, 4)
+        self.assertEqual(budget.admit(matrix, 30, 4, 'svg'), 30)
+        self.assertEqual(qr_render.RenderBudget(max_pixels=1000 ** 2, policy='downscale').admit(matrix, 30, 4), 27)
+        # Bytes en memoria: PNG en streaming guarda dos scanlines, JPEG la imagen completa
+        by_bytes = qr_render.RenderBudget(max_bytes=1024 * 1024)
+        self.assertEqual(by_bytes.admit(matrix, 100, 4, 'png'), 100)
+        with self.assertRaises(qr_render.RenderBudgetError): by_bytes.admit(matrix, 100, 4, 'jpeg')
+        with self.assertRaises(ValueError):
+            generate_qr_code("https://example.com/budget", error='q', scale=30, budget=budget)
+
+if __name__ == '__main__':
+    unittest.main()
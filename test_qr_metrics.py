@@ -0,0 +1,48 @@
+import unittest
+
+import qr_metrics
+from qr_metrics import Registry, collect_timings, server_timing, stage
+
+class TestQRMetrics(unittest.TestCase):
+
+    def test_histogram_exposition(self):
+        registry = Registry()
+        histogram = registry.histogram('demo_seconds', "Demo.", ['kind'], buckets=(0.1, 1.0))
+        for value in (0.05, 0.5, 0.5, 3.0): histogram.observe(value, 'a"b')
+        counter = registry.counter('demo_total', "Demo.", ['kind'])
+        counter.inc('x'); counter.inc('x', amount=2)
+        registry.add_collector(lambda: [('demo_gauge', 'gauge', "Demo.", [({}, 7)])])
+        lines = registry.expose().splitlines()
+        self.assertIn('# TYPE demo_seconds histogram', lines)
+        self.assertIn('demo_seconds_bucket{kind="a\\"b",le="0.1"} 1', lines)
+        self.assertIn('demo_seconds_bucket{kind="a\\"b",le="1.0"} 3', lines)
+        self.assertIn('demo_seconds_bucket{kind="a\\"b",le="+Inf"} 4', lines)
+        self.assertIn('demo_seconds_count{kind="a\\"b"} 4', lines)
+        self.assertIn('demo_total{kind="x"} 3', lines)
+        self.assertIn('demo_gauge 7', lines)
+
+    def test_stage_timings_and_errors(self):
+        errors_before = qr_metrics.STAGE_ERRORS.value('test-stage')
+        with collect_timings() as timings:
+            with stage('test-stage'): pass
+            with self.assertRaises(ValueError):
+                with stage('test-stage'): raise ValueError("fallo")
+        with stage('test-stage'): pass # Fuera de collect_timings no se anota
+        self.assertEqual([name for name, _ in timings], ['test-stage', 'test-stage'])
+        self.assertEqual(qr_metrics.STAGE_ERRORS.value('test-stage'), errors_before + 1)
+        self.assertEqual(server_timing([('a', 0.001), ('b', 0.002), ('a', 0.001)], total=0.005),
+                         "a;dur=2.000, b;dur=2.000, total;dur=5.000")
+
+    def test_disabled(self):
+        count = qr_metrics.STAGE_SECONDS.count('test-disabled')
+        qr_metrics.set_enabled(False)
+        try:
+            with collect_timings() as timings:
+                with stage('test-disabled'): pass
+        finally:
+            qr_metrics.set_enabled(True)
+        self.assertEqual(timings, [])
+        self.assertEqual(qr_metrics.STAGE_SECONDS.count('test-disabled'), count)
+
+if __name__ == '__main__':
+    unittest.main()
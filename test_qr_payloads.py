@@ -0,0 +1,76 @@
+import unittest
+
+import qr_payloads
+from qr_payloads import Field, PayloadSpec, PAYLOAD_TYPES, normalize_iban, parse_date, register_payload_type
+from qr_forms import CONTENT_TYPES, validate_generation_form
+from qr_generator_logic import construir_payload
+
+class TestQRPayloads(unittest.TestCase):
+
+    def test_form_and_library_share_spec(self):
+        form = {'content_type': 'wifi', 'wifi_ssid': 'Venue', 'wifi_password': 'secret', 'wifi_security': 'WPA',
+                'wifi_hidden': 'on'}
+        params, errors = validate_generation_form(form)
+        self.assertEqual(errors, {})
+        self.assertEqual(params['generator_kwargs'],
+                         {'wifi_ssid': 'Venue', 'wifi_password': 'secret', 'wifi_security': 'WPA', 'wifi_hidden': True})
+        expected = "WIFI:S:Venue;T:WPA;P:secret;H:true;;"
+        self.assertEqual(construir_payload(None, 'wifi', **params['generator_kwargs']), expected)
+        self.assertEqual(construir_payload(None, 'wifi', wifi_ssid='Venue', wifi_password='secret',
+                                           wifi_security='WPA', wifi_hidden=True), expected)
+
+    def test_grouped_params(self):
+        params, errors = validate_generation_form({'content_type': 'vcard', 'vcard_firstname': 'Ana',
+                                                   'vcard_phone_work': '123', 'vcard_city': ''})
+        self.assertEqual(errors, {})
+        self.assertEqual(params['generator_kwargs'], {'vcard_params': {'firstname': 'Ana', 'phone': '123'}})
+        _, errors = validate_generation_form({'content_type': 'vcard', 'vcard_email': 'a@b.c'})
+        self.assertIn('vcard_name', errors)
+
+    def test_field_errors(self):
+        _, errors = validate_generation_form({'content_type': 'geo', 'geo_latitude': 'norte', 'geo_longitude': '2'})
+        self.assertEqual(errors, {'geo_coords': "Latitud y Longitud deben ser números."})
+        _, errors = validate_generation_form({'content_type': 'event', 'event_summary': 'Demo',
+                                              'event_start_datetime': '2024-05-01T10:00',
+                                              'event_end_datetime': '2024-05-01T09:00'})
+        self.assertEqual(list(errors), ['event_end_datetime'])
+        _, errors = validate_generation_form({'content_type': 'text', 'data_text': '   '})
+        self.assertIn('data_text', errors)
+        _, errors = validate_generation_form({'content_type': 'desconocido'})
+        self.assertIn('content_type', errors)
+
+    def test_iban(self):
+        self.assertEqual(normalize_iban('de89 3704 0044 0532 0130 00'), 'DE89370400440532013000')
+        for invalid in ('DE89370400440532013001', 'DE123456789', '1234'):
+            with self.assertRaises(ValueError): normalize_iban(invalid)
+        params, errors = validate_generation_form({'content_type': 'epc', 'epc_name': 'ACME', 'epc_amount': '9.5',
+                                                   'epc_iban': 'DE89 3704 0044 0532 0130 00'})
+        self.assertEqual(errors, {})
+        self.assertIn("DE89370400440532013000\nEUR9.5", construir_payload(None, 'epc', **params['generator_kwargs']))
+
+    def test_parse_date(self):
+        self.assertEqual(parse_date('1990-02-03'), parse_date('19900203'))
+        self.assertIsNone(parse_date('1990-02-30'))
+        self.assertIsNone(parse_date('ayer'))
+
+    def test_register_new_type(self):
+        spec = PayloadSpec('whatsapp', 'WhatsApp', builder=lambda phone, text=None: f"https://wa.me/{phone}" + (f"?text={text}" if text else ''),
+                           fields=[Field('whatsapp_phone', 'phone', required="Número obligatorio."), Field('whatsapp_text', 'text')])
+        register_payload_type(spec)
+        try:
+            params, errors = validate_generation_form({'content_type': 'whatsapp', 'whatsapp_phone': '34600000000'})
+            self.assertEqual(errors, {})
+            self.assertEqual(construir_payload(None, 'whatsapp', **params['generator_kwargs']), "https://wa.me/34600000000")
+            self.assertEqual(validate_generation_form({'content_type': 'whatsapp'})[1], {'whatsapp_phone': "Número obligatorio."})
+        finally:
+            del PAYLOAD_TYPES['whatsapp']
+        self.assertEqual(set(CONTENT_TYPES), set(PAYLOAD_TYPES))
+
+    def test_specs_use_slots(self):
+        for spec in PAYLOAD_TYPES.values():
+            self.assertFalse(hasattr(spec, '__dict__'))
+            for field in spec.fields: self.assertFalse(hasattr(field, '__dict__'))
+        self.assertIs(qr_payloads.get_payload_type('url').trackable, True)
+
+if __name__ == '__main__':
+    unittest.main()
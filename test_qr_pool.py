@@ -0,0 +1,92 @@
+import unittest
+import os
+import signal
+import threading
+import time
+from unittest import mock
+
+import qr_pool
+from qr_matrix import get_matrix
+from qr_pool import PoolBusyError, RenderPool, render_cost
+from qr_render import render_matrix
+
+OPTIONS = {'output_format': 'png', 'scale': 10, 'border': 4}
+
+class TestRenderPool(unittest.TestCase):
+
+    def setUp(self):
+        self.matrix = get_matrix("https://example.com/pool", 'M')
+        self.release = threading.Event()
+
+    def blocking_job(self, matrix, options):
+        self.release.wait(5)
+        return b'ok'
+
+    def test_inline_below_threshold_and_process_above(self):
+        pool = RenderPool(workers=1, inline_max_cost=render_cost(self.matrix, 5, 4))
+        try:
+            expected = render_matrix(self.matrix, **OPTIONS).getvalue()
+            self.assertEqual(pool.render(self.matrix, OPTIONS), expected) # La matriz viaja por pickle al worker
+            self.assertEqual(pool.render(self.matrix, dict(OPTIONS, scale=5)),
+                             render_matrix(self.matrix, scale=5).getvalue())
+            self.assertEqual(pool.render(self.matrix, {'output_format': 'svg', 'scale': 50}),
+                             render_matrix(self.matrix, 'svg', scale=50).getvalue())
+            stats = pool.stats()
+            self.assertEqual((stats['submitted'], stats['inline'], stats['in_flight']), (1, 2, 0))
+        finally:
+            pool.shutdown()
+
+    def test_saturated_pool_rejects(self):
+        pool = RenderPool(workers=1, max_queue=1, inline_max_cost=0, kind='thread', retry_after=3)
+        with mock.patch.object(qr_pool, 'render_job', self.blocking_job):
+            running = [threading.Thread(target=pool.render, args=(self.matrix, OPTIONS)) for _ in range(2)]
+            for thread in running: thread.start()
+            while pool.stats()['in_flight'] < 2: threading.Event().wait(0.001)
+            with self.assertRaises(PoolBusyError) as busy: pool.render(self.matrix, OPTIONS)
+            self.assertEqual(busy.exception.retry_after, 3)
+            self.release.set()
+            for thread in running: thread.join()
+            self.assertEqual(pool.render(self.matrix, OPTIONS), b'ok')
+        stats = pool.stats()
+        self.assertEqual((stats['submitted'], stats['rejected'], stats['in_flight']), (3, 1, 0))
+        pool.shutdown()
+
+    def test_timeout_keeps_slot_until_job_ends(self):
+        pool = RenderPool(workers=1, max_queue=0, timeout=0.05, inline_max_cost=0, kind='thread')
+        with mock.patch.object(qr_pool, 'render_job', self.blocking_job):
+            with self.assertRaises(PoolBusyError): pool.render(self.matrix, OPTIONS)
+            self.assertEqual(pool.stats()['in_flight'], 1)
+            with self.assertRaises(PoolBusyError): pool.render(self.matrix, OPTIONS) # Hueco aún ocupado
+            self.release.set()
+            pool.shutdown()
+        stats = pool.stats()
+        self.assertEqual((stats['timeouts'], stats['rejected'], stats['in_flight']), (1, 1, 0))
+
+    def test_workers_recycled_after_max_jobs(self):
+        pool = RenderPool(workers=2, max_jobs_per_worker=2, inline_max_cost=0, kind='thread')
+        for _ in range(9): pool.render(self.matrix, OPTIONS)
+        self.assertEqual(pool.stats()['recycles'], 2)
+        pool.shutdown()
+        self.assertEqual(RenderPool(workers=0, inline_max_cost=0).render(self.matrix, OPTIONS),
+                         render_matrix(self.matrix, **OPTIONS).getvalue())
+
+    def test_idle_worker_death_restarts_pool(self):
+        pool = RenderPool(workers=1, inline_max_cost=0)
+        try:
+            expected = render_matrix(self.matrix, **OPTIONS).getvalue()
+            self.assertEqual(pool.render(self.matrix, OPTIONS), expected)
+            broken = pool._executor
+            for process in list(broken._processes.values()): # p. ej. el OOM killer entre trabajos
+                os.kill(process.pid, signal.SIGKILL)
+                process.join()
+            deadline = time.monotonic() + 5
+            while not broken._broken and time.monotonic() < deadline: time.sleep(0.01)
+            self.assertTrue(broken._broken)
+            self.assertEqual(pool.render(self.matrix, OPTIONS), expected)
+            self.assertIsNot(pool._executor, broken)
+            self.assertEqual(pool.stats()['restarts'], 1)
+        finally:
+            pool.shutdown()
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,97 @@
+import unittest
+import asyncio
+import datetime
+import os
+import tempfile
+
+import sqlalchemy as sa
+
+from app import db, TrackableQR, VisitEvent
+from redirect_server import RedirectServer
+
+async def _request(port, raw):
+    reader, writer = await asyncio.open_connection('127.0.0.1', port)
+    writer.write(raw)
+    await writer.drain()
+    data = await reader.read()
+    writer.close()
+    return data
+
+class TestRedirectServer(unittest.TestCase):
+
+    def setUp(self):
+        fd, self.db_path = tempfile.mkstemp(suffix='.db')
+        os.close(fd)
+        # Mismo esquema que la app
+        self.engine = sa.create_engine('sqlite:///' + self.db_path)
+        db.metadata.create_all(self.engine, tables=[TrackableQR.__table__, VisitEvent.__table__])
+        with self.engine.begin() as conn:
+            conn.execute(sa.insert(TrackableQR.__table__).values(
+                id='1', original_url='https://example.com/ruta?q=ñ', short_code='abc1234', visit_count=0))
+        self.server = RedirectServer(self.db_path, flush_interval=60)
+
+    def tearDown(self):
+        self.server.close()
+        self.engine.dispose()
+        for suffix in ('', '-wal', '-shm'):
+            if os.path.exists(self.db_path + suffix): os.unlink(self.db_path + suffix)
+
+    def test_http_redirects_with_keep_alive_and_records_visits(self):
+        async def scenario():
+            listener = await self.server.start('127.0.0.1', 0)
+            port = listener.sockets[0].getsockname()[1]
+            async with listener:
+                pipelined = (b"GET /track/abc1234 HTTP/1.1\r\nHost: qr.test\r\nUser-Agent: Mozilla/5.0 (iPhone)\r\n\r\n"
+                             b"GET /track/abc1234 HTTP/1.1\r\nHost: qr.test\r\nReferer: https://news.example.org/\r\n\r\n"
+                             b"GET /track/nope123 HTTP/1.1\r\nHost: qr.test\r\nConnection: close\r\n\r\n")
+                return (await _request(port, pipelined),
+                        await _request(port, b"POST /track/abc1234 HTTP/1.0\r\n\r\n"),
+                        await _request(port, b"GET /stats HTTP/1.0\r\n\r\n"))
+        pipelined, post, other = asyncio.run(scenario())
+        responses = pipelined.split(b'\r\n\r\n')
+        self.assertTrue(responses[0].startswith(b'HTTP/1.1 302 Found'))
+        self.assertIn(b'Location: https://example.com/ruta?q=%C3%B1', responses[0])
+        self.assertTrue(responses[1].startswith(b'HTTP/1.1 302 Found'))
+        self.assertTrue(responses[2].startswith(b'HTTP/1.1 404 Not Found'))
+        self.assertTrue(post.startswith(b'HTTP/1.1 405'))
+        self.assertTrue(other.startswith(b'HTTP/1.1 404'))
+
+        self.server.visit_counter.flush()
+        with self.engine.connect() as conn:
+            self.assertEqual(conn.execute(sa.select(TrackableQR.visit_count)).scalar(), 2)
+            events = conn.execute(sa.select(VisitEvent.occurred_at, VisitEvent.ua_class, VisitEvent.referrer_class)
+                                  .order_by(VisitEvent.id)).all()
+        self.assertEqual([(e.ua_class, e.referrer_class) for e in events], [('ios', 'direct'), ('unknown', 'external')])
+        self.assertIsInstance(events[0].occurred_at, datetime.datetime) # Legible por SQLAlchemy (rollup de la app)
+
+    def test_http_rejects_large_or_malformed_bodies(self):
+        async def scenario():
+            listener = await self.server.start('127.0.0.1', 0)
+            port = listener.sockets[0].getsockname()[1]
+            async with listener:
+                return [await _request(port, b"POST /track/abc1234 HTTP/1.1\r\nConnection: close\r\nContent-Length: " + length + b"\r\n\r\n" + body)
+                        for length, body in ((b'999999999', b''), (b'abc', b''), (b'-1', b''), (b'4', b'abcd'))]
+        too_large, not_a_number, negative, small = asyncio.run(scenario())
+        self.assertTrue(too_large.startswith(b'HTTP/1.1 413'))
+        self.assertIn(b'Connection: close', too_large)
+        self.assertTrue(not_a_number.startswith(b'HTTP/1.1 400'))
+        self.assertTrue(negative.startswith(b'HTTP/1.1 400'))
+        self.assertTrue(small.startswith(b'HTTP/1.1 405')) # Cuerpo pequeño: se descarta y se responde
+
+    def test_asgi(self):
+        sent = []
+        async def send(message): sent.append(message)
+        async def receive(): return {'type': 'http.request'}
+        scope = {'type': 'http', 'method': 'GET', 'path': '/track/abc1234', 'headers': [(b'host', b'qr.test')]}
+        asyncio.run(self.server(scope, receive, send))
+        self.assertEqual(sent[0]['status'], 302)
+        self.assertIn((b'location', b'https://example.com/ruta?q=%C3%B1'), sent[0]['headers'])
+        self.assertEqual(self.server.visit_counter.pending(), {'abc1234': 1})
+
+        sent.clear()
+        asyncio.run(self.server(dict(scope, path='/track/missing'), receive, send))
+        self.assertEqual(sent[0]['status'], 404)
+        self.assertEqual(self.server.cache.stats()['entries'], 2) # Incluida la entrada negativa
+
+if __name__ == '__main__':
+    unittest.main()
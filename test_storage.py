@@ -0,0 +1,65 @@
+import unittest
+import os
+import tempfile
+
+import sqlalchemy as sa
+from flask import Flask
+
+import storage
+
+class TestStorage(unittest.TestCase):
+
+    def setUp(self):
+        fd, self.db_path = tempfile.mkstemp(suffix='.db')
+        os.close(fd)
+        self.uri = 'sqlite:///' + self.db_path
+
+    def tearDown(self):
+        for suffix in ('', '-wal', '-shm'):
+            if os.path.exists(self.db_path + suffix): os.unlink(self.db_path + suffix)
+
+    def test_pragmas_on_every_connection(self):
+        engine = sa.create_engine(self.uri, **storage.engine_options(self.uri, pool_size=2))
+        storage.install_pragmas(engine, storage.SQLITE_PRAGMAS)
+        with engine.connect() as conn:
+            self.assertEqual(conn.exec_driver_sql("PRAGMA journal_mode").scalar(), 'wal')
+            self.assertEqual(conn.exec_driver_sql("PRAGMA busy_timeout").scalar(), 5000)
+            self.assertEqual(conn.exec_driver_sql("PRAGMA synchronous").scalar(), 1) # NORMAL
+        self.assertEqual(engine.pool.size(), 2)
+        engine.dispose()
+
+    def test_read_only_engine_rejects_writes(self):
+        engine = sa.create_engine(self.uri)
+        storage.install_pragmas(engine, storage.SQLITE_PRAGMAS)
+        with engine.begin() as conn: conn.exec_driver_sql("CREATE TABLE t (x INTEGER)")
+        reader = sa.create_engine(self.uri)
+        storage.install_pragmas(reader, storage.SQLITE_PRAGMAS, read_only=True)
+        with reader.connect() as conn:
+            self.assertEqual(conn.exec_driver_sql("SELECT count(*) FROM t").scalar(), 0)
+            with self.assertRaises(sa.exc.OperationalError):
+                conn.exec_driver_sql("INSERT INTO t VALUES (1)")
+        engine.dispose(); reader.dispose()
+
+    def test_configure_app(self):
+        app = Flask(__name__)
+        app.config['SQLALCHEMY_DATABASE_URI'] = self.uri
+        app.config['DB_POOL_SIZE'] = 3
+        app.config['SQLITE_PRAGMAS'] = {'busy_timeout': 250}
+        storage.configure_app(app)
+        self.assertEqual(app.config['SQLALCHEMY_ENGINE_OPTIONS']['pool_size'], 3)
+        self.assertEqual(app.config['SQLALCHEMY_BINDS'][storage.READ_BIND]['url'], self.uri)
+        self.assertEqual(app.config['SQLITE_PRAGMAS']['busy_timeout'], 250)
+        self.assertEqual(app.config['SQLITE_PRAGMAS']['journal_mode'], 'WAL')
+
+    def test_memory_database_has_no_pool_options(self):
+        self.assertEqual(storage.engine_options('sqlite://'), {})
+        self.assertEqual(storage.engine_options('sqlite:///:memory:'), {})
+        self.assertFalse(storage.is_sqlite_file('sqlite://'))
+        self.assertTrue(storage.is_sqlite_file(self.uri))
+        app = Flask(__name__)
+        app.config['SQLALCHEMY_DATABASE_URI'] = 'sqlite://'
+        storage.configure_app(app)
+        self.assertNotIn(storage.READ_BIND, app.config['SQLALCHEMY_BINDS']) # Sería otra BD en memoria, vacía
+
+if __name__ == '__main__':
+    unittest.main()
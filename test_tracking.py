@@ -0,0 +1,166 @@
+import unittest
+import threading
+
+from tracking import (VisitCounter, ShortCodeCache, ShortCodeAllocator, PeriodicTask, base62_encode,
+                      classify_user_agent, classify_referrer)
+
+class TestVisitCounter(unittest.TestCase):
+
+    def test_aggregates_per_short_code(self):
+        flushed = []
+        counter = VisitCounter(lambda counts, events: flushed.append((counts, events)), interval=60, threshold=1000)
+        for code in ['a', 'b', 'a', 'a']: counter.record(code, event=(code,))
+        self.assertEqual(counter.pending(), {'a': 3, 'b': 1})
+        self.assertEqual(counter.flush(), 4)
+        self.assertEqual(flushed, [({'a': 3, 'b': 1}, [('a',), ('b',), ('a',), ('a',)])])
+        self.assertEqual(counter.flush(), 0) # Nada pendiente: no se llama a la BD
+        self.assertEqual(len(flushed), 1)
+        counter.stop()
+
+    def test_failed_flush_keeps_increments(self):
+        calls = []
+        def failing(counts, events):
+            calls.append((dict(counts), list(events)))
+            if len(calls) == 1: raise RuntimeError("database is locked")
+        counter = VisitCounter(failing, interval=60)
+        counter.record('a', 2, event='e1')
+        with self.assertRaises(RuntimeError): counter.flush()
+        counter.record('a', event='e2')
+        self.assertEqual(counter.pending(), {'a': 3})
+        counter.flush()
+        self.assertEqual(calls[-1], ({'a': 3}, ['e1', 'e2']))
+        self.assertEqual(counter.flush_errors, 1)
+        counter.stop()
+
+    def test_repeated_flush_failures_bound_events(self):
+        calls = []
+        def failing(counts, events):
+            calls.append((dict(counts), list(events)))
+            if len(calls) < 4: raise RuntimeError("database is locked")
+        counter = VisitCounter(failing, interval=60, max_events=3)
+        for attempt in range(3):
+            for i in range(2): counter.record('a', event=f'e{attempt}{i}')
+            with self.assertRaises(RuntimeError): counter.flush()
+        # Incrementos intactos; de los eventos solo quedan los más recientes
+        self.assertEqual(counter.pending(), {'a': 6})
+        self.assertEqual(counter.events_dropped, 3)
+        self.assertEqual(counter.flush(), 6)
+        self.assertEqual(calls[-1], ({'a': 6}, ['e11', 'e20', 'e21']))
+        self.assertEqual(counter.flush_errors, 3)
+        counter.stop()
+
+    def test_threshold_wakes_background_flush(self):
+        flushed = threading.Event()
+        counter = VisitCounter(lambda counts, events: flushed.set(), interval=60, threshold=5)
+        for _ in range(5): counter.record('a')
+        self.assertTrue(flushed.wait(5))
+        counter.stop()
+
+    def test_stop_flushes_pending(self):
+        flushed = []
+        counter = VisitCounter(lambda counts, events: flushed.append(counts), interval=60)
+        counter.record('a')
+        counter.stop()
+        self.assertEqual(flushed, [{'a': 1}])
+
+class TestVisitClassification(unittest.TestCase):
+
+    def test_classify_user_agent(self):
+        self.assertEqual(classify_user_agent(None), 'unknown')
+        self.assertEqual(classify_user_agent('Mozilla/5.0 (iPhone; CPU iPhone OS 17_0 like Mac OS X) Mobile/15E148'), 'ios')
+        self.assertEqual(classify_user_agent('Mozilla/5.0 (Linux; Android 14; Pixel 8) Mobile Safari/537.36'), 'android')
+        self.assertEqual(classify_user_agent('Mozilla/5.0 (compatible; Googlebot/2.1)'), 'bot')
+        self.assertEqual(classify_user_agent('Mozilla/5.0 (Windows NT 10.0; Win64; x64) Chrome/120.0'), 'desktop')
+
+    def test_classify_referrer(self):
+        self.assertEqual(classify_referrer(None), 'direct')
+        self.assertEqual(classify_referrer('https://qr.example.com/stats', 'qr.example.com'), 'internal')
+        self.assertEqual(classify_referrer('https://news.example.org/a', 'qr.example.com'), 'external')
+
+    def test_periodic_task_runs_and_survives_errors(self):
+        calls = threading.Semaphore(0)
+        state = {'n': 0}
+        def fn():
+            state['n'] += 1
+            calls.release()
+            if state['n'] == 1: raise RuntimeError("fallo puntual")
+        task = PeriodicTask(fn, interval=0.01)
+        task.start()
+        self.assertTrue(calls.acquire(timeout=5))
+        self.assertTrue(calls.acquire(timeout=5))
+        task.stop()
+        self.assertEqual(task.errors, 1)
+        self.assertGreaterEqual(task.runs, 1)
+
+class TestShortCodeCache(unittest.TestCase):
+
+    def setUp(self):
+        self.now = 0.0
+        self.cache = ShortCodeCache(max_entries=2, ttl=10, negative_ttl=2, clock=lambda: self.now)
+
+    def test_ttl_and_negative_ttl(self):
+        self.cache.put('a', 'https://a.example.com')
+        self.cache.put_not_found('zz')
+        self.assertEqual(self.cache.get('a'), 'https://a.example.com')
+        self.assertIs(self.cache.get('zz'), ShortCodeCache.NOT_FOUND)
+        self.now = 5
+        self.assertIsNone(self.cache.get('zz')) # La entrada negativa caduca antes
+        self.assertEqual(self.cache.get('a'), 'https://a.example.com')
+        self.now = 11
+        self.assertIsNone(self.cache.get('a'))
+
+    def test_lru_bound_invalidation_and_stats(self):
+        self.cache.put('a', 'A'); self.cache.put('b', 'B')
+        self.cache.get('a')
+        self.cache.put('c', 'C') # Expulsa 'b'
+        self.assertIsNone(self.cache.get('b'))
+        self.cache.invalidate('a')
+        self.assertIsNone(self.cache.get('a'))
+        stats = self.cache.stats()
+        self.assertEqual((stats['hits'], stats['misses'], stats['evictions'], stats['invalidations']), (1, 2, 1, 1))
+        self.assertAlmostEqual(stats['hit_ratio'], 1 / 3)
+
+class TestShortCodeAllocator(unittest.TestCase):
+
+    def setUp(self):
+        self.sequence = 0
+        self.reserved = []
+        def reserve(count):
+            start = self.sequence
+            self.sequence += count
+            self.reserved.append(count)
+            return start
+        self.allocator = ShortCodeAllocator(reserve, block_size=10)
+
+    def test_base62_encode(self):
+        self.assertEqual(base62_encode(0, 3), '000')
+        self.assertEqual(base62_encode(61, 2), '0Z')
+        self.assertEqual(base62_encode(62, 2), '10')
+        with self.assertRaises(ValueError): base62_encode(62 ** 2, 2)
+
+    def test_codes_unique_without_probing(self):
+        codes = [self.allocator.allocate() for _ in range(25)] + self.allocator.allocate_many(500)
+        self.assertEqual(len(set(codes)), len(codes))
+        self.assertTrue(all(len(code) == 7 for code in codes)) # Nunca 6 caracteres como los heredados
+        # 25 códigos = 3 bloques; el lote usa los 5 restantes y reserva 495 de una vez
+        self.assertEqual(self.reserved, [10, 10, 10, 495])
+
+    def test_small_bulk_reserves_a_block(self):
+        self.allocator.allocate_many(3)
+        self.allocator.allocate_many(3)
+        self.assertEqual(self.reserved, [10])
+
+    def test_widens_length_at_threshold(self):
+        capacity = int(62 ** 7 * self.allocator.threshold)
+        self.assertEqual(len(self.allocator.code_for(capacity - 1)), 7)
+        self.assertEqual(len(self.allocator.code_for(capacity)), 8)
+        self.assertEqual(self.allocator.tier(capacity + 5), (8, 5))
+
+    def test_permutation_is_bijective_on_small_space(self):
+        allocator = ShortCodeAllocator(lambda n: 0, min_length=2, max_length=2, threshold=1.0)
+        codes = {allocator.code_for(value) for value in range(62 ** 2)}
+        self.assertEqual(len(codes), 62 ** 2)
+        with self.assertRaises(OverflowError): allocator.code_for(62 ** 2)
+
+if __name__ == '__main__':
+    unittest.main()
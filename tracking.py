@@ -0,0 +1,303 @@
+import atexit
+import logging
+import re
+import threading
+import time
+from collections import OrderedDict, deque
+
+logger = logging.getLogger(__name__)
+
+# Piezas del camino caliente de /track:
+# - VisitCounter: conteo "write-behind". /track solo incrementa un contador en memoria (y anota el
+#   evento de visita) y un hilo en segundo plano vuelca los acumulados por short_code a la BD en una
+#   única transacción (UPDATE ... SET visit_count = visit_count + n más el INSERT de los eventos),
+#   por tiempo o al superar un umbral de visitas.
+# - classify_user_agent / classify_referrer: clases gruesas para el log de eventos de visita.
+# - PeriodicTask: hilo de fondo para tareas periódicas (p. ej. el rollup de eventos).
+# - ShortCodeCache: resolución short_code -> URL en memoria, con TTL y caché negativa.
+# - ShortCodeAllocator: short_codes únicos sin sondear la BD (secuencia permutada en base62).
+
+class VisitCounter:
+    # Si la BD no acepta volcados (caída larga), los incrementos se conservan (su tamaño depende de los
+    # short_codes distintos, no de las visitas) pero los eventos se limitan a max_events: se descartan
+    # los más antiguos y se cuentan en events_dropped.
+    def __init__(self, flush_fn, interval=1.0, threshold=1000, max_events=100_000):
+        self._flush_fn = flush_fn # Recibe ({short_code: incremento}, [eventos]) y lo persiste (o lanza excepción)
+        self.interval = interval
+        self.threshold = threshold
+        self.max_events = max_events
+        self._pending = {}
+        self._events = deque()
+        self._pending_total = 0
+        self._lock = threading.Lock()
+        self._flush_lock = threading.Lock() # Serializa los volcados (hilo de fondo, umbral y cierre)
+        self._wakeup = threading.Event()
+        self._stopped = threading.Event()
+        self._thread = None
+        self.flushed_visits = 0
+        self.flush_count = 0
+        self.flush_errors = 0
+        self.events_dropped = 0
+
+    def _trim_events(self):
+        # Requiere tener self._lock
+        while len(self._events) > self.max_events:
+            self._events.popleft()
+            self.events_dropped += 1
+
+    def record(self, short_code, count=1, event=None):
+        # Nunca toca la BD: como mucho despierta al hilo de volcado
+        with self._lock:
+            self._pending[short_code] = self._pending.get(short_code, 0) + count
+            if event is not None:
+                self._events.append(event)
+                self._trim_events()
+            self._pending_total += count
+            over_threshold = self._pending_total >= self.threshold
+        self._ensure_thread()
+        if over_threshold: self._wakeup.set()
+
+    def pending(self):
+        with self._lock: return dict(self._pending)
+
+    def flush(self):
+        with self._flush_lock:
+            with self._lock:
+                counts, self._pending, self._pending_total = self._pending, {}, 0
+                events, self._events = list(self._events), deque()
+            if not counts and not events: return 0
+            try:
+                self._flush_fn(counts, events)
+            except Exception:
+                # Se devuelven los incrementos y eventos al buffer para el siguiente intento
+                with self._lock:
+                    for short_code, count in counts.items():
+                        self._pending[short_code] = self._pending.get(short_code, 0) + count
+                        self._pending_total += count
+                    self._events.extendleft(reversed(events))
+                    self._trim_events()
+                self.flush_errors += 1
+                raise
+            total = sum(counts.values())
+            self.flushed_visits += total
+            self.flush_count += 1
+            return total
+
+    def _ensure_thread(self):
+        if self._thread is not None or self._stopped.is_set(): return
+        with self._lock:
+            if self._thread is not None: return
+            self._thread = threading.Thread(target=self._run, name='visit-counter-flush', daemon=True)
+            self._thread.start()
+        atexit.register(self.stop)
+
+    def _run(self):
+        while not self._stopped.is_set():
+            self._wakeup.wait(self.interval)
+            self._wakeup.clear()
+            try: self.flush()
+            except Exception: pass # Ya contabilizado en flush_errors; se reintenta en el siguiente ciclo
+
+    def stop(self):
+        # Vuelca lo pendiente y detiene el hilo (se registra con atexit al arrancarlo)
+        self._stopped.set()
+        self._wakeup.set()
+        if self._thread is not None and self._thread is not threading.current_thread():
+            self._thread.join(timeout=5)
+        try: self.flush()
+        except Exception as e:
+            logger.error(f"No se pudieron volcar {sum(self.pending().values())} visitas pendientes al cerrar: {e}")
+
+_BOT_RE = re.compile(r'bot|crawl|spider|slurp|preview|facebookexternalhit|curl|wget|python-requests', re.I)
+_IOS_RE = re.compile(r'iPhone|iPad|iPod', re.I)
+_ANDROID_RE = re.compile(r'Android', re.I)
+_MOBILE_RE = re.compile(r'Mobile', re.I)
+
+def classify_user_agent(user_agent):
+    if not user_agent: return 'unknown'
+    if _BOT_RE.search(user_agent): return 'bot'
+    if _IOS_RE.search(user_agent): return 'ios'
+    if _ANDROID_RE.search(user_agent): return 'android'
+    if _MOBILE_RE.search(user_agent): return 'mobile'
+    return 'desktop'
+
+def classify_referrer(referrer, own_host=None):
+    # Los escaneos de QR normalmente llegan sin Referer ('direct')
+    if not referrer: return 'direct'
+    host = referrer.split('://', 1)[-1].split('/', 1)[0].lower()
+    if own_host and host == own_host.lower(): return 'internal'
+    return 'external'
+
+class PeriodicTask:
+    # Ejecuta fn cada `interval` segundos en un hilo daemon; los errores se registran y se reintenta
+    def __init__(self, fn, interval, name='periodic-task'):
+        self._fn = fn
+        self.interval = interval
+        self.name = name
+        self._stopped = threading.Event()
+        self._thread = None
+        self._lock = threading.Lock()
+        self.runs = 0
+        self.errors = 0
+
+    def start(self):
+        if self._thread is not None: return
+        with self._lock:
+            if self._thread is not None or self._stopped.is_set(): return
+            self._thread = threading.Thread(target=self._run, name=self.name, daemon=True)
+            self._thread.start()
+
+    def _run(self):
+        while not self._stopped.wait(self.interval):
+            try:
+                self._fn()
+                self.runs += 1
+            except Exception as e:
+                self.errors += 1
+                logger.error(f"Error en la tarea periódica {self.name}: {e}")
+
+    def stop(self):
+        self._stopped.set()
+        if self._thread is not None and self._thread is not threading.current_thread():
+            self._thread.join(timeout=5)
+
+class ShortCodeCache:
+    # Caché acotada (LRU) short_code -> original_url para resolver /track sin ir a la BD.
+    # Guarda también los códigos inexistentes (caché negativa, con TTL más corto) para que
+    # escáneres que repiten códigos malos no martilleen la BD.
+    NOT_FOUND = object()
+
+    def __init__(self, max_entries=100000, ttl=300.0, negative_ttl=30.0, clock=None):
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self.negative_ttl = negative_ttl
+        self._clock = clock or time.monotonic
+        self._entries = OrderedDict() # short_code -> (original_url | NOT_FOUND, expira)
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.negative_hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.invalidations = 0
+
+    def get(self, short_code):
+        # Devuelve la URL, NOT_FOUND (caché negativa) o None si hay que consultar la BD
+        now = self._clock()
+        with self._lock:
+            entry = self._entries.get(short_code)
+            if entry is None or entry[1] <= now:
+                if entry is not None: del self._entries[short_code]
+                self.misses += 1
+                return None
+            self._entries.move_to_end(short_code)
+            if entry[0] is self.NOT_FOUND: self.negative_hits += 1
+            else: self.hits += 1
+            return entry[0]
+
+    def put(self, short_code, original_url):
+        self._store(short_code, original_url, self.ttl)
+
+    def put_not_found(self, short_code):
+        self._store(short_code, self.NOT_FOUND, self.negative_ttl)
+
+    def _store(self, short_code, value, ttl):
+        with self._lock:
+            self._entries[short_code] = (value, self._clock() + ttl)
+            self._entries.move_to_end(short_code)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+                self.evictions += 1
+
+    def invalidate(self, short_code):
+        with self._lock:
+            if self._entries.pop(short_code, None) is not None: self.invalidations += 1
+
+    def clear(self):
+        with self._lock: self._entries.clear()
+
+    def stats(self):
+        with self._lock:
+            lookups = self.hits + self.negative_hits + self.misses
+            return {'hits': self.hits, 'negative_hits': self.negative_hits, 'misses': self.misses,
+                    'evictions': self.evictions, 'invalidations': self.invalidations,
+                    'entries': len(self._entries),
+                    'hit_ratio': (self.hits + self.negative_hits) / lookups if lookups else 0.0}
+
+BASE62_ALPHABET = '0123456789abcdefghijklmnopqrstuvwxyzABCDEFGHIJKLMNOPQRSTUVWXYZ'
+
+def base62_encode(value, length):
+    chars = []
+    for _ in range(length):
+        value, digit = divmod(value, 62)
+        chars.append(BASE62_ALPHABET[digit])
+    if value: raise ValueError("El valor no cabe en la longitud indicada.")
+    return ''.join(reversed(chars))
+
+class ShortCodeAllocator:
+    # Reparte short_codes a partir de una secuencia monótona compartida (reserve_fn(n) reserva n
+    # valores consecutivos en una transacción y devuelve el primero). Cada valor se permuta con una
+    # biyección afín módulo 62**longitud, así que los códigos son únicos por construcción y no
+    # parecen consecutivos. Cada proceso reserva bloques de block_size para no ir a la BD por código.
+    #
+    # Los códigos empiezan en 7 caracteres: los heredados (uuid4().hex[:6]) tienen 6, así que nunca
+    # colisionan. Cuando una longitud llega a usar la fracción `threshold` de su espacio, la secuencia
+    # pasa a la longitud siguiente (hasta max_length, el tamaño de la columna).
+    OFFSET = 0x2545F491
+
+    def __init__(self, reserve_fn, block_size=100, min_length=7, max_length=10, threshold=0.5):
+        self._reserve_fn = reserve_fn
+        self.block_size = block_size
+        self.min_length = min_length
+        self.max_length = max_length
+        self.threshold = threshold
+        self._next = 0
+        self._end = 0
+        self._lock = threading.Lock()
+        self.reservations = 0
+
+    def tier(self, sequence_value):
+        # Devuelve (longitud, índice dentro de esa longitud) para un valor de la secuencia
+        index = sequence_value
+        for length in range(self.min_length, self.max_length + 1):
+            capacity = int(62 ** length * self.threshold)
+            if index < capacity: return length, index
+            index -= capacity
+        raise OverflowError("Espacio de short_codes agotado.")
+
+    @staticmethod
+    def multiplier(space):
+        # ~ proporción áurea del espacio (reparte bien valores consecutivos), coprimo con 62 = 2 * 31
+        m = int(space * 0.6180339887) | 1
+        while m % 31 == 0: m += 2
+        return m
+
+    def code_for(self, sequence_value):
+        length, index = self.tier(sequence_value)
+        space = 62 ** length
+        return base62_encode((index * self.multiplier(space) + self.OFFSET) % space, length)
+
+    def _reserve(self, count):
+        start = self._reserve_fn(count)
+        self.reservations += 1
+        return start
+
+    def allocate_many(self, count):
+        # Para creación masiva: usa lo que quede del bloque local y reserva el resto en una sola
+        # transacción (un bloque nuevo si faltan menos de block_size, o exactamente lo que falta si no).
+        with self._lock:
+            local = min(count, self._end - self._next)
+            values = list(range(self._next, self._next + local))
+            self._next += local
+            missing = count - local
+            if missing >= self.block_size:
+                start = self._reserve(missing)
+                values.extend(range(start, start + missing))
+            elif missing:
+                self._next = self._reserve(self.block_size)
+                self._end = self._next + self.block_size
+                values.extend(range(self._next, self._next + missing))
+                self._next += missing
+        return [self.code_for(value) for value in values]
+
+    def allocate(self):
+        return self.allocate_many(1)[0]